@@ -1,236 +1,377 @@
 import os
-from psycopg2 import connect
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import List, Literal, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi import Query, HTTPException
+from iot_company.repository.database import create_pool, pool_stats
 from iot_company.repository.model.iot_api_model import SimilarTripResult, WeeklyAverageTrips, \
-    WeeklyAverageTripsByRegions
+    WeeklyAverageTripsByRegions, SimilarTripsResponse, WeeklyAverageTripsResponse, WeeklyAverageTripsByRegionsResponse, \
+    TopRegion, DatasourceRegion, TopRegionsResponse, DatasourceRegionsResponse, AreaWeeklyAverageTrips, \
+    WeeklyAverageTripsBatchRequest, WeeklyAverageTripsBatchResponse
+from iot_company.repository.queries import SIMILAR_TRIPS_QUERY, WEEKLY_AVERAGE_TRIPS_QUERY, \
+    WEEKLY_AVERAGE_TRIPS_BY_REGIONS_QUERY, SIMILAR_TRIPS_WINDOW_QUERY, WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, \
+    WEEKLY_AVERAGE_TRIPS_BY_REGIONS_WINDOW_QUERY, DATA_VERSION_QUERY, TOP_REGIONS_QUERY, DATASOURCE_REGIONS_QUERY, \
+    WEEKLY_AVERAGE_TRIPS_BATCH_QUERY, WEEKLY_AVERAGE_TRIPS_BATCH_WINDOW_QUERY
+from iot_company.service.pagination import InvalidCursor, decode_cursor, encode_cursor
+from iot_company.service.profiling import ProfilingMiddleware, RequestMetrics, SlowQueryLog, acquire, record_query, \
+    timed
+from iot_company.service.response_cache import ResponseCache, create_backend, round_bbox, normalize_regions, \
+    CACHE_BYPASS_HEADER
+from iot_company.service.serialization import columns_of, encode_keyed_rows, encode_rows, row_mapper
+from iot_company.service.streaming import streaming_response
+
+# Open ends of a time window, iot.datetime is a timestamp without time zone
+MIN_DATETIME = datetime(1, 1, 1)
+MAX_DATETIME = datetime(9999, 12, 31)
+
+# Answers the weekly average endpoints from an in-memory columnar copy of the trips (needs numpy)
+snapshot_enabled = os.environ.get('SNAPSHOT_ENABLED', 'false').lower() == 'true'
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One bounded pool per worker, shared by every request
+    app.state.pool = await create_pool()
+    app.state.snapshot = None
+    if snapshot_enabled:
+        from iot_company.service.snapshot import ColumnarSnapshot
+        app.state.snapshot = ColumnarSnapshot()
+        await app.state.snapshot.start(app.state.pool)
+    yield
+    if app.state.snapshot:
+        await app.state.snapshot.stop()
+    await app.state.pool.close()
 
-# Retrieve PostgreSQL connection parameters from environment variables
-db_host = os.environ.get('DB_HOST', 'my_postgres') # my_postgres # localhost
-db_port = os.environ.get('DB_PORT', 5432)
-db_name = os.environ.get('DB_NAME', 'mydatabase')
-db_user = os.environ.get('DB_USER', 'myuser')
-db_password = os.environ.get('DB_PASSWORD', 'mypassword')
 
 # Create FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Per request pool wait / SQL / fetch / serialize timings, served on /metrics
+request_metrics = RequestMetrics()
+slow_query_log = SlowQueryLog()
+app.add_middleware(ProfilingMiddleware, metrics=request_metrics, slow_query_log=slow_query_log)
+
+
+async def fetch(query: str, *args, explain_when_slow: bool = True):
+    if explain_when_slow:
+        record_query(query, args)
+    # Borrow a pooled connection only for the duration of the query
+    async with acquire(app.state.pool) as conn:
+        # The rows come back with the execute reply, their transfer is part of the sql stage
+        with timed('sql'):
+            statement = await conn.prepared(query)
+            return await statement.fetch(*args)
+
+
+async def load_data_version() -> int:
+    rows = await fetch(DATA_VERSION_QUERY, explain_when_slow=False)
+    return rows[0][0] if rows else 0
+
+
+response_cache = ResponseCache(create_backend(), load_data_version)
+
+
+async def cached_data(request: Request, key: tuple, load):
+    """Serve load() through the response cache unless the client sent the bypass header."""
+    bypass = request.headers.get(CACHE_BYPASS_HEADER, '').lower() in ('1', 'true')
+    return await response_cache.get_or_load(key, load, bypass)
+
+
+def snapshot_view():
+    """Published state of the columnar snapshot, None when it is disabled or still loading."""
+    snapshot = app.state.snapshot
+    return snapshot.view if snapshot else None
+
+
+def json_response(body: bytes, cache_status: str) -> Response:
+    # Bodies are encoded once (and cached encoded), FastAPI only adds the headers
+    return Response(content=body, status_code=200, media_type="application/json",
+                    headers={"X-Cache": cache_status})
+
+
+# json returns one cached document, ndjson and json_stream stream rows from a server side cursor
+ResponseFormat = Literal['json', 'ndjson', 'json_stream']
+FORMAT_DESCRIPTION = "json, or ndjson / json_stream to stream the rows in chunks"
+
+
+def time_window(start: Optional[datetime], end: Optional[datetime]) -> Optional[Tuple[datetime, datetime]]:
+    """Bounds of the [start, end) window as naive UTC datetimes, None when no window was asked."""
+    if start is None and end is None:
+        return None
+    return _naive_utc(start) if start else MIN_DATETIME, _naive_utc(end) if end else MAX_DATETIME
+
+
+def week_cursor(row) -> str:
+    """next_cursor after a page of weeks, week_start is the second column of SQL and snapshot rows."""
+    return encode_cursor(row[1].isoformat())
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Response keys of each endpoint, rows are mapped to them without building a model per row
+SIMILAR_TRIP_COLUMNS = columns_of(SimilarTripResult)
+WEEKLY_AVERAGE_TRIPS_COLUMNS = columns_of(WeeklyAverageTrips)
+WEEKLY_AVERAGE_TRIPS_BY_REGIONS_COLUMNS = columns_of(WeeklyAverageTripsByRegions)
+TOP_REGION_COLUMNS = columns_of(TopRegion)
+DATASOURCE_REGION_COLUMNS = columns_of(DatasourceRegion)
+AREA_WEEKLY_AVERAGE_TRIPS_COLUMNS = columns_of(AreaWeeklyAverageTrips)
 
 
 # Define your endpoint
-@app.get("/similar_trips")
-async def similar_trips():
+@app.get("/similar_trips", response_model=SimilarTripsResponse)
+async def similar_trips(
+        request: Request,
+        radius_m: int = Query(1000, gt=0, description="Distance in meters under which trips are considered similar"),
+        limit: int = Query(10, gt=0, le=1000, description="Maximum number of trip clusters"),
+        start: Optional[datetime] = Query(None, description="Only trips at or after this datetime"),
+        end: Optional[datetime] = Query(None, description="Only trips before this datetime"),
+        response_format: ResponseFormat = Query('json', alias='format', description=FORMAT_DESCRIPTION),
+):
     try:
-        # Create a new PostgreSQL connection
-        conn = connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
-
-        # Create a cursor
-        cursor = conn.cursor()
-
-        # Define your query
-        query = """
-                    SELECT
-                        a.region,
-                        CAST(DATE_TRUNC('hour', a.datetime) AS DATE) AS date_of_event,
-                        EXTRACT(HOUR FROM a.datetime) AS hour_of_day,
-                        ST_X(ST_GeomFromWKB(a.origin_coord, 4326)) AS origin1_longitude,
-                        ST_Y(ST_GeomFromWKB(a.origin_coord, 4326)) AS origin1_latitude,
-                        ST_X(ST_GeomFromWKB(a.destination_coord, 4326)) AS destination1_longitude,
-                        ST_Y(ST_GeomFromWKB(a.destination_coord, 4326)) AS destination1_latitude,
-                        ST_X(ST_GeomFromWKB(b.origin_coord, 4326)) AS origin2_longitude,
-                        ST_Y(ST_GeomFromWKB(b.origin_coord, 4326)) AS origin2_latitude,
-                        ST_X(ST_GeomFromWKB(b.destination_coord, 4326)) AS destination2_longitude,
-                        ST_Y(ST_GeomFromWKB(b.destination_coord, 4326)) AS destination2_latitude,
-                        COUNT(*) AS trip_count
-                    FROM
-                        public.iot a
-                    JOIN
-                        public.iot b
-                    ON
-                        a.id <> b.id -- Exclude the same row
-                        AND ST_DWithin(a.origin_coord, b.origin_coord, 1000) -- Adjust the distance as needed
-                        AND ST_DWithin(a.destination_coord, b.destination_coord, 1000) -- Adjust the distance as needed
-                    GROUP BY
-                        a.region,
-                        CAST(DATE_TRUNC('hour', a.datetime) AS DATE),
-                        EXTRACT(HOUR FROM a.datetime),
-                        a.origin_coord,
-                        a.destination_coord,
-                        b.origin_coord,
-                        b.destination_coord
-                    ORDER BY
-                        trip_count DESC
-                    LIMIT 10    
-                        ;
-        """
-
-        # Execute the query
-        cursor.execute(query)
-
-        # Fetch the results
-        rows = cursor.fetchall()
-
-        # and convert to SimilarTripResult instances
-        result_data = [SimilarTripResult(
-            region=row[0],
-            date_of_event=row[1],
-            hour_of_day=row[2],
-            origin1_longitude=row[3],
-            origin1_latitude=row[4],
-            destination1_longitude=row[5],
-            destination1_latitude=row[6],
-            origin2_longitude=row[7],
-            origin2_latitude=row[8],
-            destination2_longitude=row[9],
-            destination2_latitude=row[10],
-            trip_count=row[11]
-        ).model_dump() for row in rows]
-
-        # Close the cursor and connection
-        cursor.close()
-        conn.close()
+        window = time_window(start, end)
+        # Fetch the biggest clusters of the grid matching the radius
+        if window:
+            query, args = SIMILAR_TRIPS_WINDOW_QUERY, (radius_m, limit, *window)
+        else:
+            query, args = SIMILAR_TRIPS_QUERY, (radius_m, limit)
+
+        if response_format != 'json':
+            return streaming_response(app.state.pool, query, args, row_mapper(SIMILAR_TRIP_COLUMNS),
+                                      response_format)
+
+        async def load():
+            rows = await fetch(query, *args)
+            # and encode the rows with the SimilarTripResult keys
+            with timed('serialize'):
+                return encode_rows(SIMILAR_TRIP_COLUMNS, rows)
 
         # Return the results as JSON
-        return JSONResponse(content={"data": result_data}, status_code=200, media_type="application/json")
+        body, cache_status = await cached_data(request, ('similar_trips', radius_m, limit, window), load)
+        return json_response(body, cache_status)
 
 
     except Exception as e:
         # Handle exceptions
-        return HTTPException(detail=str(e), status_code=500)
+        raise HTTPException(detail=str(e), status_code=500)
 
 
-@app.get("/weekly_average_trips")
+@app.get("/weekly_average_trips", response_model=WeeklyAverageTripsResponse)
 async def similar_trips_filtered(
-        min_lon: float = Query(..., description="Minimum longitude"),
-        min_lat: float = Query(..., description="Minimum latitude"),
-        max_lon: float = Query(..., description="Maximum longitude"),
-        max_lat: float = Query(..., description="Maximum latitude"),
+        request: Request,
+        min_lon: float = Query(..., ge=-180, le=180, description="Minimum (west) longitude, greater than max_lon "
+                                                                 "when the box crosses the antimeridian"),
+        min_lat: float = Query(..., ge=-90, le=90, description="Minimum latitude"),
+        max_lon: float = Query(..., ge=-180, le=180, description="Maximum (east) longitude"),
+        max_lat: float = Query(..., ge=-90, le=90, description="Maximum latitude"),
+        start: Optional[datetime] = Query(None, description="Only trips at or after this datetime"),
+        end: Optional[datetime] = Query(None, description="Only trips before this datetime"),
+        response_format: ResponseFormat = Query('json', alias='format', description=FORMAT_DESCRIPTION),
 ):
+    # Longitudes wrap around the antimeridian, latitudes don't
+    if min_lat > max_lat:
+        raise HTTPException(detail="min_lat is greater than max_lat", status_code=400)
+
     try:
-        # Create a new PostgreSQL connection
-        conn = connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
+        window = time_window(start, end)
+        # Rounded so dashboards asking for nearly the same box share cache entries
+        bbox = round_bbox(min_lon, min_lat, max_lon, max_lat)
+        # Fetch the results for the bounding box
+        if window:
+            query, args = WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, (*bbox, *window)
+        else:
+            query, args = WEEKLY_AVERAGE_TRIPS_QUERY, bbox
+
+        if response_format != 'json':
+            return streaming_response(app.state.pool, query, args, row_mapper(WEEKLY_AVERAGE_TRIPS_COLUMNS),
+                                      response_format)
+
+        view = snapshot_view()
+
+        async def load():
+            if view:
+                with timed('snapshot'):
+                    rows = await view.weekly_average_trips(bbox, window)
+            else:
+                rows = await fetch(query, *args)
+            # Encode with the WeeklyAverageTrips keys
+            with timed('serialize'):
+                return encode_rows(WEEKLY_AVERAGE_TRIPS_COLUMNS, rows)
+
+        # Return the results as JSON, snapshot answers are cached per snapshot state
+        key = ('weekly_average_trips', bbox, window, view.rows if view else None)
+        body, cache_status = await cached_data(request, key, load)
+        return json_response(body, cache_status)
+
+    except Exception as e:
+        # Handle exceptions
+        raise HTTPException(detail=str(e), status_code=500)
+
+
+@app.get("/weekly_average_trips_by_regions", response_model=WeeklyAverageTripsByRegionsResponse)
+async def weekly_average_trips_by_regions(
+        request: Request,
+        regions: List[str] = Query(..., description="List of regions"),
+        start: Optional[datetime] = Query(None, description="Only trips at or after this datetime"),
+        end: Optional[datetime] = Query(None, description="Only trips before this datetime"),
+        limit: Optional[int] = Query(None, gt=0, le=10000, description="Weeks per page, pages are linked by next_cursor"),
+        cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+        response_format: ResponseFormat = Query('json', alias='format', description=FORMAT_DESCRIPTION),
+):
+    # Keyset pagination: the cursor is the oldest week of the previous page, weeks are returned newest first
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except InvalidCursor as e:
+        raise HTTPException(detail=str(e), status_code=400)
 
-        # Create a cursor
-        cursor = conn.cursor()
-
-        # Define your query with dynamic bounding box
-        query = f"""
-            WITH area_filter AS (
-                SELECT ST_MakeEnvelope({min_lon}, {min_lat}, {max_lon}, {max_lat}, 4326)::geography AS bounding_box
-            )
-            SELECT
-                STRING_AGG(iot.region, ',') AS regions,
-                ST_X(ST_Centroid(area_filter.bounding_box::geometry)) AS bounding_box_longitude,
-                ST_Y(ST_Centroid(area_filter.bounding_box::geometry)) AS bounding_box_latitude,
-                DATE_TRUNC('week', iot.datetime) AS week_start,
-                COUNT(*) / COUNT(DISTINCT DATE_TRUNC('week', iot.datetime)) AS weekly_avg_trips
-            FROM
-                public.iot iot
-            JOIN
-                area_filter ON ST_Intersects(iot.origin_coord::geometry, area_filter.bounding_box)
-                            OR ST_Intersects(iot.destination_coord::geometry, area_filter.bounding_box)
-            GROUP BY
-                area_filter.bounding_box,
-                week_start
-            ORDER BY
-                week_start desc
-            LIMIT 100
-        """
-        # Execute the query
-        cursor.execute(query)
-
-        # Fetch the results
-        rows = cursor.fetchall()
-
-        # Convert to WeeklyAverageTrips instances
-        result_data = [WeeklyAverageTrips(
-            regions=row[0],
-            bounding_box_longitude=row[1],
-            bounding_box_latitude=row[2],
-            week_start=row[3],
-            weekly_avg_trips=row[4],
-        ).model_dump() for row in rows]
-        print(result_data)
-        # Close the cursor and connection
-        cursor.close()
-        conn.close()
+    try:
+        window = time_window(start, end)
+        regions = normalize_regions(regions)
+        # Regions are bound as an array parameter instead of being quoted into the query
+        if window:
+            window_end = min(window[1], before) if before else window[1]
+            query, args = WEEKLY_AVERAGE_TRIPS_BY_REGIONS_WINDOW_QUERY, (list(regions), window[0], window_end, limit)
+        else:
+            query, args = WEEKLY_AVERAGE_TRIPS_BY_REGIONS_QUERY, (list(regions), before or MAX_DATETIME, limit)
+
+        if response_format != 'json':
+            return streaming_response(app.state.pool, query, args,
+                                      row_mapper(WEEKLY_AVERAGE_TRIPS_BY_REGIONS_COLUMNS), response_format,
+                                      limit, week_cursor if limit else None)
+
+        view = snapshot_view()
+
+        async def load():
+            if view:
+                with timed('snapshot'):
+                    rows = await view.weekly_average_trips_by_regions(regions, window, before, limit)
+            else:
+                rows = await fetch(query, *args)
+            # Encode with the WeeklyAverageTripsByRegions keys
+            with timed('serialize'):
+                if not limit:
+                    return encode_rows(WEEKLY_AVERAGE_TRIPS_BY_REGIONS_COLUMNS, rows)
+                # A full page may have older weeks behind it
+                next_cursor = week_cursor(rows[-1]) if len(rows) == limit else None
+                return encode_rows(WEEKLY_AVERAGE_TRIPS_BY_REGIONS_COLUMNS, rows, next_cursor=next_cursor)
 
         # Return the results as JSON
-        return JSONResponse(content={"data": result_data}, status_code=200, media_type="application/json")
+        body, cache_status = await cached_data(
+            request, ('weekly_average_trips_by_regions', regions, window, before, limit, view.rows if view else None),
+            load)
+        return json_response(body, cache_status)
 
     except Exception as e:
         # Handle exceptions
-        return HTTPException(detail=str(e), status_code=500)
+        raise HTTPException(detail=str(e), status_code=500)
+
 
+@app.post("/weekly_average_trips/batch", response_model=WeeklyAverageTripsBatchResponse)
+async def weekly_average_trips_batch(request: Request, batch: WeeklyAverageTripsBatchRequest):
+    try:
+        window = time_window(batch.start, batch.end)
+        # Rounded and sorted like the single area endpoints so repeated dashboards share the cache entry
+        boxes = tuple((area.id, round_bbox(area.bbox.min_lon, area.bbox.min_lat, area.bbox.max_lon, area.bbox.max_lat))
+                      for area in batch.areas if area.bbox)
+        region_sets = tuple((area.id, normalize_regions(area.regions)) for area in batch.areas if area.regions)
+
+        # Areas are bound as arrays, one statement and one round trip whatever their number
+        args = (
+            [area_id for area_id, _ in boxes],
+            *([bbox[index] for _, bbox in boxes] for index in range(4)),
+            [area_id for area_id, regions in region_sets for _ in regions],
+            [region for _, regions in region_sets for region in regions],
+            batch.limit,
+        )
+        if window:
+            query, args = WEEKLY_AVERAGE_TRIPS_BATCH_WINDOW_QUERY, (*args, *window)
+        else:
+            query = WEEKLY_AVERAGE_TRIPS_BATCH_QUERY
 
-from typing import List
+        async def load():
+            rows = await fetch(query, *args)
+            # Results keyed by area id, in the order the areas were sent
+            with timed('serialize'):
+                return encode_keyed_rows(AREA_WEEKLY_AVERAGE_TRIPS_COLUMNS, rows, (area.id for area in batch.areas))
 
+        key = ('weekly_average_trips_batch', boxes, region_sets, window, batch.limit)
+        body, cache_status = await cached_data(request, key, load)
+        return json_response(body, cache_status)
 
-@app.get("/weekly_average_trips_by_regions")
-async def weekly_average_trips_by_regions(regions: List[str] = Query(..., description="List of regions")):
+    except Exception as e:
+        # Handle exceptions
+        raise HTTPException(detail=str(e), status_code=500)
+
+
+@app.get("/top_regions", response_model=TopRegionsResponse)
+async def top_regions(
+        request: Request,
+        limit: int = Query(2, gt=0, le=1000, description="Number of regions, most trips first"),
+):
     try:
-        # Create a new PostgreSQL connection
-        conn = connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
+        # Counters kept by the ingest, no scan of the trips
+        async def load():
+            rows = await fetch(TOP_REGIONS_QUERY, limit)
+            with timed('serialize'):
+                return encode_rows(TOP_REGION_COLUMNS, rows)
 
-        # Create a cursor
-        cursor = conn.cursor()
-
-        # Convert the list of regions to a string for the IN clause
-        regions_str = ', '.join([f"'{region}'" for region in regions])
-
-        # Define your query with dynamic bounding box
-        query = f"""
-            SELECT
-                STRING_AGG(iot.region, ', ') AS regions,
-                DATE_TRUNC('week', iot.datetime) AS week_start,
-                COUNT(*) / COUNT(DISTINCT DATE_TRUNC('week', iot.datetime)) AS weekly_avg_trips
-            FROM
-                public.iot iot
-            WHERE
-                iot.region IN ({regions_str})
-            GROUP BY
-                DATE_TRUNC('week', iot.datetime)
-            ORDER BY
-                week_start DESC;
-        """
-        # Execute the query
-        cursor.execute(query)
-
-        # Fetch the results
-        rows = cursor.fetchall()
-
-        # Convert to WeeklyAverageTripsByRegions instances
-        result_data = [WeeklyAverageTripsByRegions(
-            regions=row[0],
-            week_start=row[1],
-            weekly_avg_trips=row[2],
-        ).model_dump() for row in rows]
-        print(result_data)
-        # Close the cursor and connection
-        cursor.close()
-        conn.close()
+        body, cache_status = await cached_data(request, ('top_regions', limit), load)
+        return json_response(body, cache_status)
 
-        # Return the results as JSON
-        return JSONResponse(content={"data": result_data}, status_code=200, media_type="application/json")
+    except Exception as e:
+        # Handle exceptions
+        raise HTTPException(detail=str(e), status_code=500)
+
+
+@app.get("/datasource_regions", response_model=DatasourceRegionsResponse)
+async def datasource_regions(
+        request: Request,
+        datasource: str = Query(..., description="Datasource, e.g. cheap_mobile"),
+):
+    try:
+        async def load():
+            rows = await fetch(DATASOURCE_REGIONS_QUERY, datasource)
+            with timed('serialize'):
+                return encode_rows(DATASOURCE_REGION_COLUMNS, rows)
+
+        body, cache_status = await cached_data(request, ('datasource_regions', datasource), load)
+        return json_response(body, cache_status)
 
     except Exception as e:
         # Handle exceptions
-        return HTTPException(detail=str(e), status_code=500)
+        raise HTTPException(detail=str(e), status_code=500)
+
+
+@app.get("/pool_stats")
+async def get_pool_stats():
+    return JSONResponse(content=pool_stats(app.state.pool), status_code=200, media_type="application/json")
+
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    return JSONResponse(content=response_cache.snapshot(), status_code=200, media_type="application/json")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text format, each uvicorn worker exposes its own counters
+    gauges = {f'iot_api_pool_{key}': ('Connection pool', value) for key, value in pool_stats(app.state.pool).items()}
+    gauges.update({f'iot_api_cache_{key}': ('Response cache', value)
+                   for key, value in response_cache.snapshot().items() if isinstance(value, (int, float))})
+    view = snapshot_view()
+    if view:
+        gauges['iot_api_snapshot_rows'] = ('Trips in the columnar snapshot', view.rows)
+        gauges['iot_api_snapshot_watermark'] = ('Highest trip id in the columnar snapshot', view.watermark)
+    return Response(content=request_metrics.render(gauges), status_code=200,
+                    media_type="text/plain; version=0.0.4")
+
+
+@app.get("/slow_queries")
+async def get_slow_queries():
+    return JSONResponse(content=list(slow_query_log.plans), status_code=200, media_type="application/json")
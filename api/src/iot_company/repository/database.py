@@ -0,0 +1,57 @@
+import os
+
+import asyncpg
+
+# Retrieve PostgreSQL connection parameters from environment variables
+db_host = os.environ.get('DB_HOST', 'my_postgres') # my_postgres # localhost
+db_port = int(os.environ.get('DB_PORT', 5432))
+db_name = os.environ.get('DB_NAME', 'mydatabase')
+db_user = os.environ.get('DB_USER', 'myuser')
+db_password = os.environ.get('DB_PASSWORD', 'mypassword')
+
+# Bounds of the shared pool, each uvicorn worker owns one pool
+pool_min_size = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+pool_max_size = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+command_timeout = float(os.environ.get('DB_COMMAND_TIMEOUT', 60))
+
+
+class IotConnection(asyncpg.Connection):
+    """asyncpg connection that keeps one server-side prepared statement per query text."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iot_statements = {}
+
+    async def prepared(self, query: str):
+        # Prepared once per pooled connection, later requests only send Bind/Execute
+        statement = self._iot_statements.get(query)
+        if statement is None:
+            statement = await self.prepare(query)
+            self._iot_statements[query] = statement
+        return statement
+
+
+async def create_pool() -> asyncpg.Pool:
+    return await asyncpg.create_pool(
+        host=db_host,
+        port=db_port,
+        user=db_user,
+        password=db_password,
+        database=db_name,
+        min_size=pool_min_size,
+        max_size=pool_max_size,
+        command_timeout=command_timeout,
+        connection_class=IotConnection,
+    )
+
+
+def pool_stats(pool: asyncpg.Pool) -> dict:
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    return {
+        'min_size': pool.get_min_size(),
+        'max_size': pool.get_max_size(),
+        'size': size,
+        'idle': idle,
+        'in_use': size - idle,
+    }
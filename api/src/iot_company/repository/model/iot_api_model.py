@@ -11,38 +11,23 @@
 # import json
 # from typing import List
 # import datetime
-from pydantic import field_validator
+from pydantic import Field, field_validator, model_validator
 from decimal import Decimal
+from typing import Dict, List, Optional
 from datetime import datetime
 from pydantic import BaseModel
 
 
 class SimilarTripResult(BaseModel):
     region: str
-    date_of_event: datetime
     hour_of_day: int
-    origin1_longitude: float
-    origin1_latitude: float
-    destination1_longitude: float
-    destination1_latitude: float
-    origin2_longitude: float
-    origin2_latitude: float
-    destination2_longitude: float
-    destination2_latitude: float
+    cell_size_m: int
+    origin_longitude: float
+    origin_latitude: float
+    destination_longitude: float
+    destination_latitude: float
     trip_count: int
 
-    @field_validator('date_of_event')
-    def convert_datetime(cls, value):
-        if isinstance(value, datetime):
-            return value.isoformat()
-        return value
-
-    class Config:
-        json_encoders = {
-            datetime: str,
-            Decimal: int  # This will automatically convert Decimal to int during JSON serialization
-        }
-
 
 class WeeklyAverageTrips(BaseModel):
     regions: str
@@ -90,3 +75,90 @@ class WeeklyAverageTripsByRegions(BaseModel):
             datetime: str,
             Decimal: int  # This will automatically convert Decimal to int during JSON serialization
         }
+
+
+class TopRegion(BaseModel):
+    region: str
+    trip_count: int
+    latest_datasource: Optional[str] = None
+    latest_datetime: Optional[datetime] = None
+
+
+class DatasourceRegion(BaseModel):
+    region: str
+    trip_count: int
+
+
+class BoundingBox(BaseModel):
+    min_lon: float = Field(..., ge=-180, le=180, description="Minimum (west) longitude, greater than max_lon "
+                                                             "when the box crosses the antimeridian")
+    min_lat: float = Field(..., ge=-90, le=90)
+    max_lon: float = Field(..., ge=-180, le=180)
+    max_lat: float = Field(..., ge=-90, le=90)
+
+    @model_validator(mode='after')
+    def check_latitudes(self):
+        # Longitudes wrap around the antimeridian, latitudes don't
+        if self.min_lat > self.max_lat:
+            raise ValueError("min_lat is greater than max_lat")
+        return self
+
+
+class Area(BaseModel):
+    id: str
+    bbox: Optional[BoundingBox] = None
+    regions: Optional[List[str]] = Field(None, min_length=1)
+
+    @model_validator(mode='after')
+    def check_one_shape(self):
+        if (self.bbox is None) == (self.regions is None):
+            raise ValueError(f"area {self.id} needs either a bbox or regions")
+        return self
+
+
+class WeeklyAverageTripsBatchRequest(BaseModel):
+    areas: List[Area] = Field(..., min_length=1, max_length=200)
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    limit: int = Field(100, gt=0, le=1000, description="Weeks per area, newest first")
+
+    @model_validator(mode='after')
+    def check_unique_ids(self):
+        ids = [area.id for area in self.areas]
+        if len(set(ids)) != len(ids):
+            raise ValueError("area ids must be unique")
+        return self
+
+
+class AreaWeeklyAverageTrips(BaseModel):
+    regions: str
+    bounding_box_longitude: Optional[float] = None
+    bounding_box_latitude: Optional[float] = None
+    week_start: datetime
+    weekly_avg_trips: float
+
+
+# Response envelopes, only used for the OpenAPI schema since rows are serialized without a model
+class SimilarTripsResponse(BaseModel):
+    data: List[SimilarTripResult]
+
+
+class WeeklyAverageTripsResponse(BaseModel):
+    data: List[WeeklyAverageTrips]
+
+
+class WeeklyAverageTripsByRegionsResponse(BaseModel):
+    data: List[WeeklyAverageTripsByRegions]
+    next_cursor: Optional[str] = None
+
+
+class TopRegionsResponse(BaseModel):
+    data: List[TopRegion]
+
+
+class DatasourceRegionsResponse(BaseModel):
+    data: List[DatasourceRegion]
+
+
+class WeeklyAverageTripsBatchResponse(BaseModel):
+    data: Dict[str, List[AreaWeeklyAverageTrips]]
@@ -0,0 +1,509 @@
+# SQL used by the API endpoints, parameters are bound server side ($1, $2, ...)
+
+# $1 radius in meters, $2 limit
+# Reads the precomputed clusters of the grid whose cell size is the smallest one covering the radius
+# (or the largest available), ordered straight from idx_trip_cluster_count
+SIMILAR_TRIPS_QUERY = """
+    SELECT
+        cluster.region,
+        cluster.hour_of_day,
+        cluster.cell_size_m,
+        ((cluster.origin_cell_x + 0.5) * (cluster.cell_size_m / 111320.0))::DOUBLE PRECISION AS origin_longitude,
+        ((cluster.origin_cell_y + 0.5) * (cluster.cell_size_m / 111320.0))::DOUBLE PRECISION AS origin_latitude,
+        ((cluster.destination_cell_x + 0.5) * (cluster.cell_size_m / 111320.0))::DOUBLE PRECISION AS destination_longitude,
+        ((cluster.destination_cell_y + 0.5) * (cluster.cell_size_m / 111320.0))::DOUBLE PRECISION AS destination_latitude,
+        cluster.trip_count
+    FROM
+        public.iot_trip_cluster cluster
+    WHERE
+        cluster.cell_size_m = (
+            SELECT grid.cell_size_m
+            FROM public.iot_cluster_grid grid
+            ORDER BY grid.cell_size_m < $1, ABS(grid.cell_size_m - $1)
+            LIMIT 1
+        )
+        AND cluster.trip_count > 1 -- A single trip has nothing similar to it
+    ORDER BY
+        cluster.trip_count DESC
+    LIMIT $2
+"""
+
+# $1 radius in meters, $2 limit, $3 start, $4 end
+# Same clusters computed from the raw trips of a time window, the datetime range prunes partitions
+# and is served by idx_iot_datetime
+SIMILAR_TRIPS_WINDOW_QUERY = """
+    WITH grid AS (
+        SELECT grid.cell_size_m
+        FROM public.iot_cluster_grid grid
+        ORDER BY grid.cell_size_m < $1, ABS(grid.cell_size_m - $1)
+        LIMIT 1
+    ),
+    trip_cells AS (
+        SELECT
+            COALESCE(iot.region, '') AS region,
+            EXTRACT(HOUR FROM iot.datetime)::SMALLINT AS hour_of_day,
+            grid.cell_size_m,
+            public.iot_grid_index(ST_X(iot.origin_coord::geometry), grid.cell_size_m) AS origin_cell_x,
+            public.iot_grid_index(ST_Y(iot.origin_coord::geometry), grid.cell_size_m) AS origin_cell_y,
+            public.iot_grid_index(ST_X(iot.destination_coord::geometry), grid.cell_size_m) AS destination_cell_x,
+            public.iot_grid_index(ST_Y(iot.destination_coord::geometry), grid.cell_size_m) AS destination_cell_y
+        FROM
+            public.iot iot
+        CROSS JOIN
+            grid
+        WHERE
+            iot.datetime >= $3
+            AND iot.datetime < $4
+    )
+    SELECT
+        region,
+        hour_of_day,
+        cell_size_m,
+        ((origin_cell_x + 0.5) * (cell_size_m / 111320.0))::DOUBLE PRECISION AS origin_longitude,
+        ((origin_cell_y + 0.5) * (cell_size_m / 111320.0))::DOUBLE PRECISION AS origin_latitude,
+        ((destination_cell_x + 0.5) * (cell_size_m / 111320.0))::DOUBLE PRECISION AS destination_longitude,
+        ((destination_cell_y + 0.5) * (cell_size_m / 111320.0))::DOUBLE PRECISION AS destination_latitude,
+        COUNT(*) AS trip_count
+    FROM
+        trip_cells
+    GROUP BY
+        region, hour_of_day, cell_size_m, origin_cell_x, origin_cell_y, destination_cell_x, destination_cell_y
+    HAVING
+        COUNT(*) > 1
+    ORDER BY
+        trip_count DESC
+    LIMIT $2
+"""
+
+# Bounding box parts of $1 min_lon, $2 min_lat, $3 max_lon, $4 max_lat: the box itself, or when min_lon > max_lon
+# (crossing the antimeridian) its part up to 180 and its part from -180
+BBOX_PARTS = """
+    bbox_parts AS (
+        SELECT
+            $1::DOUBLE PRECISION AS min_lon,
+            $2::DOUBLE PRECISION AS min_lat,
+            (CASE WHEN $1 <= $3 THEN $3 ELSE 180 END)::DOUBLE PRECISION AS max_lon,
+            $4::DOUBLE PRECISION AS max_lat
+        UNION ALL
+        SELECT -180, $2, $3, $4
+        WHERE $1 > $3
+    )"""
+
+# Center of the bounding box, on the right side of the antimeridian when the box crosses it
+BBOX_CENTER = """
+        (CASE
+            WHEN $1 <= $3 THEN ($1 + $3) / 2
+            WHEN $1 + $3 > 0 THEN ($1 + $3) / 2 - 180
+            ELSE ($1 + $3) / 2 + 180
+        END)::DOUBLE PRECISION AS bounding_box_longitude,
+        (($2 + $4) / 2)::DOUBLE PRECISION AS bounding_box_latitude"""
+
+# Rollup cells lying fully inside every box part of {parts} (an empty range when no cell fits in the part) and the
+# strips between those cells and the edges of the part, the whole part when no cell fits. Cell indexes follow
+# iot_grid_index, cell i covers [i, i + 1) * degrees
+INTERIOR_CELLS = """
+    area_filter AS (
+        SELECT
+            {parts}.*,
+            CEIL({parts}.min_lon / cell.degrees)::INTEGER AS min_cell_x,
+            CEIL({parts}.min_lat / cell.degrees)::INTEGER AS min_cell_y,
+            FLOOR({parts}.max_lon / cell.degrees)::INTEGER - 1 AS max_cell_x,
+            FLOOR({parts}.max_lat / cell.degrees)::INTEGER - 1 AS max_cell_y,
+            cell.degrees
+        FROM
+            {parts}
+        CROSS JOIN
+            (SELECT (public.iot_rollup_cell_size_m() / 111320.0)::DOUBLE PRECISION AS degrees) cell
+    ),
+    boundary_strips AS (
+        SELECT area_filter.*, ST_MakeEnvelope(min_lon, min_lat, max_lon, max_lat, 4326) AS strip
+        FROM area_filter
+        WHERE min_cell_x > max_cell_x OR min_cell_y > max_cell_y
+        UNION ALL
+        SELECT area_filter.*, strips.strip
+        FROM area_filter
+        CROSS JOIN LATERAL (VALUES
+            (ST_MakeEnvelope(min_lon, min_lat, max_lon, min_cell_y * degrees, 4326)),
+            (ST_MakeEnvelope(min_lon, (max_cell_y + 1) * degrees, max_lon, max_lat, 4326)),
+            (ST_MakeEnvelope(min_lon, min_cell_y * degrees, min_cell_x * degrees, (max_cell_y + 1) * degrees, 4326)),
+            (ST_MakeEnvelope((max_cell_x + 1) * degrees, min_cell_y * degrees, max_lon, (max_cell_y + 1) * degrees, 4326))
+        ) AS strips(strip)
+        WHERE min_cell_x <= max_cell_x AND min_cell_y <= max_cell_y
+    )"""
+
+# Rollup cell indexes of the raw trips matched in the boundary strips
+BOUNDARY_TRIP_COLUMNS = """
+            iot.id,
+            iot.datetime,
+            COALESCE(iot.region, '') AS region,
+            public.iot_grid_index(ST_X(iot.origin_geom), public.iot_rollup_cell_size_m()) AS origin_cell_x,
+            public.iot_grid_index(ST_Y(iot.origin_geom), public.iot_rollup_cell_size_m()) AS origin_cell_y,
+            public.iot_grid_index(ST_X(iot.destination_geom), public.iot_rollup_cell_size_m()) AS destination_cell_x,
+            public.iot_grid_index(ST_Y(iot.destination_geom), public.iot_rollup_cell_size_m()) AS destination_cell_y"""
+
+# $1 min_lon, $2 min_lat, $3 max_lon, $4 max_lat
+# Exact bounding box match like WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, mostly read from the rollup: trips with their
+# origin or destination in a cell fully inside the box are summed from the rollup (origins and destinations looked
+# up through their cell indexes and merged with a UNION on the primary key, an OR would scan the whole rollup),
+# the other trips are matched on their raw points in the strips along the box edges through the geometry indexes
+WEEKLY_AVERAGE_TRIPS_QUERY = f"""
+    WITH {BBOX_PARTS.strip()},{INTERIOR_CELLS.format(parts='bbox_parts')},
+    matching_cells AS (
+        SELECT rollup.*
+        FROM public.iot_weekly_rollup rollup
+        JOIN area_filter ON rollup.origin_cell_x BETWEEN area_filter.min_cell_x AND area_filter.max_cell_x
+                        AND rollup.origin_cell_y BETWEEN area_filter.min_cell_y AND area_filter.max_cell_y
+        UNION
+        SELECT rollup.*
+        FROM public.iot_weekly_rollup rollup
+        JOIN area_filter ON rollup.destination_cell_x BETWEEN area_filter.min_cell_x AND area_filter.max_cell_x
+                        AND rollup.destination_cell_y BETWEEN area_filter.min_cell_y AND area_filter.max_cell_y
+    ),
+    boundary_trips AS (
+        SELECT{BOUNDARY_TRIP_COLUMNS}
+        FROM public.iot iot
+        JOIN boundary_strips ON iot.origin_geom && boundary_strips.strip
+        UNION
+        SELECT{BOUNDARY_TRIP_COLUMNS}
+        FROM public.iot iot
+        JOIN boundary_strips ON iot.destination_geom && boundary_strips.strip
+    ),
+    matching_trips AS (
+        SELECT matching_cells.week_start, matching_cells.region, matching_cells.trip_count
+        FROM matching_cells
+        UNION ALL
+        -- Trips with an end in an inside cell are already counted by the rollup
+        SELECT DATE_TRUNC('week', boundary_trips.datetime), boundary_trips.region, 1
+        FROM boundary_trips
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM area_filter
+            WHERE (boundary_trips.origin_cell_x BETWEEN area_filter.min_cell_x AND area_filter.max_cell_x
+                   AND boundary_trips.origin_cell_y BETWEEN area_filter.min_cell_y AND area_filter.max_cell_y)
+               OR (boundary_trips.destination_cell_x BETWEEN area_filter.min_cell_x AND area_filter.max_cell_x
+                   AND boundary_trips.destination_cell_y BETWEEN area_filter.min_cell_y AND area_filter.max_cell_y)
+        )
+    )
+    SELECT
+        STRING_AGG(DISTINCT matching_trips.region, ',') AS regions,{BBOX_CENTER},
+        matching_trips.week_start,
+        SUM(matching_trips.trip_count)::DOUBLE PRECISION AS weekly_avg_trips
+    FROM
+        matching_trips
+    GROUP BY
+        matching_trips.week_start
+    ORDER BY
+        matching_trips.week_start DESC
+    LIMIT 100
+"""
+
+# $1 min_lon, $2 min_lat, $3 max_lon, $4 max_lat, $5 start, $6 end
+# Raw trips of a time window, exact bounding box match. && on the generated geometry columns is served by
+# idx_iot_origin_geom / idx_iot_destination_geom on every partition of the window, one index scan per column
+# merged by a UNION on the trip key (an OR across both columns would fall back to a sequential scan)
+WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY = f"""
+    WITH {BBOX_PARTS.strip()},
+    area_filter AS (
+        SELECT ST_MakeEnvelope(min_lon, min_lat, max_lon, max_lat, 4326) AS bounding_box
+        FROM bbox_parts
+    ),
+    matching_trips AS (
+        SELECT iot.id, iot.datetime, iot.region
+        FROM public.iot iot
+        JOIN area_filter ON iot.origin_geom && area_filter.bounding_box
+        WHERE iot.datetime >= $5 AND iot.datetime < $6
+        UNION
+        SELECT iot.id, iot.datetime, iot.region
+        FROM public.iot iot
+        JOIN area_filter ON iot.destination_geom && area_filter.bounding_box
+        WHERE iot.datetime >= $5 AND iot.datetime < $6
+    )
+    SELECT
+        STRING_AGG(DISTINCT matching_trips.region, ',') AS regions,{BBOX_CENTER},
+        DATE_TRUNC('week', matching_trips.datetime) AS week_start,
+        COUNT(*)::DOUBLE PRECISION AS weekly_avg_trips
+    FROM
+        matching_trips
+    GROUP BY
+        week_start
+    ORDER BY
+        week_start DESC
+    LIMIT 100
+"""
+
+# Areas of a batch request, bound as arrays so one prepared statement serves any number of areas:
+# $1 area ids, $2 min_lon, $3 min_lat, $4 max_lon, $5 max_lat, one element per bounding box area,
+# $6 area ids, $7 regions, one element per region of a region area.
+# Boxes crossing the antimeridian are split in two parts like BBOX_PARTS
+AREA_PARTS = """
+    areas AS (
+        SELECT *
+        FROM UNNEST($1::TEXT[], $2::DOUBLE PRECISION[], $3::DOUBLE PRECISION[], $4::DOUBLE PRECISION[],
+                    $5::DOUBLE PRECISION[]) AS areas(area_id, min_lon, min_lat, max_lon, max_lat)
+    ),
+    area_parts AS (
+        SELECT
+            areas.area_id,
+            areas.min_lon,
+            areas.min_lat,
+            CASE WHEN areas.min_lon <= areas.max_lon THEN areas.max_lon ELSE 180 END AS max_lon,
+            areas.max_lat
+        FROM areas
+        UNION ALL
+        SELECT areas.area_id, -180, areas.min_lat, areas.max_lon, areas.max_lat
+        FROM areas
+        WHERE areas.min_lon > areas.max_lon
+    ),
+    area_regions AS (
+        SELECT DISTINCT area_regions.area_id, area_regions.region
+        FROM UNNEST($6::TEXT[], $7::VARCHAR[]) AS area_regions(area_id, region)
+    )"""
+
+# Weeks of every area ranked newest first, with the box center of bounding box areas (NULL for region areas),
+# $8 is the number of weeks per area
+AREA_WEEKS_SELECT = """
+    ranked_weeks AS (
+        SELECT
+            area_weeks.*,
+            ROW_NUMBER() OVER (PARTITION BY area_weeks.area_id ORDER BY area_weeks.week_start DESC) AS week_rank
+        FROM
+            area_weeks
+    )
+    SELECT
+        ranked_weeks.area_id,
+        ranked_weeks.regions,
+        (CASE
+            WHEN areas.min_lon <= areas.max_lon THEN (areas.min_lon + areas.max_lon) / 2
+            WHEN areas.min_lon + areas.max_lon > 0 THEN (areas.min_lon + areas.max_lon) / 2 - 180
+            ELSE (areas.min_lon + areas.max_lon) / 2 + 180
+        END)::DOUBLE PRECISION AS bounding_box_longitude,
+        ((areas.min_lat + areas.max_lat) / 2)::DOUBLE PRECISION AS bounding_box_latitude,
+        ranked_weeks.week_start,
+        ranked_weeks.weekly_avg_trips::DOUBLE PRECISION AS weekly_avg_trips
+    FROM
+        ranked_weeks
+    LEFT JOIN
+        areas ON areas.area_id = ranked_weeks.area_id
+    WHERE
+        ranked_weeks.week_rank <= $8
+    ORDER BY
+        ranked_weeks.area_id,
+        ranked_weeks.week_start DESC"""
+
+# $1-$7 AREA_PARTS, $8 weeks per area
+# Every area of a dashboard in one statement, each box matched exactly like WEEKLY_AVERAGE_TRIPS_QUERY: the inside
+# rollup cells of all the boxes in one join against the origin / destination cell indexes, the boundary strips
+# through the geometry indexes, region areas through idx_weekly_rollup_region, then grouped per area
+WEEKLY_AVERAGE_TRIPS_BATCH_QUERY = f"""
+    WITH {AREA_PARTS.strip()},{INTERIOR_CELLS.format(parts='area_parts')},
+    matching_cells AS (
+        SELECT area_filter.area_id, rollup.*
+        FROM public.iot_weekly_rollup rollup
+        JOIN area_filter ON rollup.origin_cell_x BETWEEN area_filter.min_cell_x AND area_filter.max_cell_x
+                        AND rollup.origin_cell_y BETWEEN area_filter.min_cell_y AND area_filter.max_cell_y
+        UNION
+        SELECT area_filter.area_id, rollup.*
+        FROM public.iot_weekly_rollup rollup
+        JOIN area_filter ON rollup.destination_cell_x BETWEEN area_filter.min_cell_x AND area_filter.max_cell_x
+                        AND rollup.destination_cell_y BETWEEN area_filter.min_cell_y AND area_filter.max_cell_y
+    ),
+    boundary_trips AS (
+        SELECT boundary_strips.area_id,{BOUNDARY_TRIP_COLUMNS}
+        FROM public.iot iot
+        JOIN boundary_strips ON iot.origin_geom && boundary_strips.strip
+        UNION
+        SELECT boundary_strips.area_id,{BOUNDARY_TRIP_COLUMNS}
+        FROM public.iot iot
+        JOIN boundary_strips ON iot.destination_geom && boundary_strips.strip
+    ),
+    matching_trips AS (
+        SELECT matching_cells.area_id, matching_cells.week_start, matching_cells.region, matching_cells.trip_count
+        FROM matching_cells
+        UNION ALL
+        -- Trips with an end in an inside cell of their area are already counted by the rollup
+        SELECT boundary_trips.area_id, DATE_TRUNC('week', boundary_trips.datetime), boundary_trips.region, 1
+        FROM boundary_trips
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM area_filter
+            WHERE area_filter.area_id = boundary_trips.area_id
+              AND ((boundary_trips.origin_cell_x BETWEEN area_filter.min_cell_x AND area_filter.max_cell_x
+                    AND boundary_trips.origin_cell_y BETWEEN area_filter.min_cell_y AND area_filter.max_cell_y)
+                   OR (boundary_trips.destination_cell_x BETWEEN area_filter.min_cell_x AND area_filter.max_cell_x
+                       AND boundary_trips.destination_cell_y BETWEEN area_filter.min_cell_y AND area_filter.max_cell_y))
+        )
+    ),
+    area_weeks AS (
+        SELECT
+            matching_trips.area_id,
+            STRING_AGG(DISTINCT matching_trips.region, ',') AS regions,
+            matching_trips.week_start,
+            SUM(matching_trips.trip_count) AS weekly_avg_trips
+        FROM
+            matching_trips
+        GROUP BY
+            matching_trips.area_id,
+            matching_trips.week_start
+        UNION ALL
+        SELECT
+            area_regions.area_id,
+            STRING_AGG(DISTINCT rollup.region, ', ') AS regions,
+            rollup.week_start,
+            SUM(rollup.trip_count) AS weekly_avg_trips
+        FROM
+            public.iot_weekly_rollup rollup
+        JOIN
+            area_regions ON rollup.region = area_regions.region
+        GROUP BY
+            area_regions.area_id,
+            rollup.week_start
+    ),{AREA_WEEKS_SELECT}
+"""
+
+# $1-$7 AREA_PARTS, $8 weeks per area, $9 start, $10 end
+# Raw trips of a time window for every area in one statement, the boxes are probed through
+# idx_iot_origin_geom / idx_iot_destination_geom and the region sets through idx_iot_region_datetime
+WEEKLY_AVERAGE_TRIPS_BATCH_WINDOW_QUERY = f"""
+    WITH {AREA_PARTS.strip()},
+    area_filter AS (
+        SELECT
+            area_parts.area_id,
+            ST_MakeEnvelope(area_parts.min_lon, area_parts.min_lat, area_parts.max_lon, area_parts.max_lat, 4326)
+                AS bounding_box
+        FROM
+            area_parts
+    ),
+    matching_trips AS (
+        SELECT area_filter.area_id, iot.id, iot.datetime, iot.region
+        FROM public.iot iot
+        JOIN area_filter ON iot.origin_geom && area_filter.bounding_box
+        WHERE iot.datetime >= $9 AND iot.datetime < $10
+        UNION
+        SELECT area_filter.area_id, iot.id, iot.datetime, iot.region
+        FROM public.iot iot
+        JOIN area_filter ON iot.destination_geom && area_filter.bounding_box
+        WHERE iot.datetime >= $9 AND iot.datetime < $10
+    ),
+    area_weeks AS (
+        SELECT
+            matching_trips.area_id,
+            STRING_AGG(DISTINCT matching_trips.region, ',') AS regions,
+            DATE_TRUNC('week', matching_trips.datetime) AS week_start,
+            COUNT(*) AS weekly_avg_trips
+        FROM
+            matching_trips
+        GROUP BY
+            matching_trips.area_id,
+            DATE_TRUNC('week', matching_trips.datetime)
+        UNION ALL
+        SELECT
+            area_regions.area_id,
+            STRING_AGG(DISTINCT iot.region, ', ') AS regions,
+            DATE_TRUNC('week', iot.datetime) AS week_start,
+            COUNT(*) AS weekly_avg_trips
+        FROM
+            public.iot iot
+        JOIN
+            area_regions ON iot.region = area_regions.region
+        WHERE
+            iot.datetime >= $9
+            AND iot.datetime < $10
+        GROUP BY
+            area_regions.area_id,
+            DATE_TRUNC('week', iot.datetime)
+    ),{AREA_WEEKS_SELECT}
+"""
+
+# $1 list of regions, $2 weeks before this one (keyset cursor), $3 limit (NULL for every week)
+WEEKLY_AVERAGE_TRIPS_BY_REGIONS_QUERY = """
+    SELECT
+        STRING_AGG(DISTINCT rollup.region, ', ') AS regions,
+        rollup.week_start,
+        SUM(rollup.trip_count)::DOUBLE PRECISION AS weekly_avg_trips
+    FROM
+        public.iot_weekly_rollup rollup
+    WHERE
+        rollup.region = ANY($1::varchar[])
+        AND rollup.week_start < $2
+    GROUP BY
+        rollup.week_start
+    ORDER BY
+        rollup.week_start DESC
+    LIMIT $3
+"""
+
+# $1 list of regions, $2 start, $3 end, $4 limit (NULL for every week)
+# Served by idx_iot_region_datetime on the partitions of the window, the keyset cursor moves $3
+WEEKLY_AVERAGE_TRIPS_BY_REGIONS_WINDOW_QUERY = """
+    SELECT
+        STRING_AGG(DISTINCT iot.region, ', ') AS regions,
+        DATE_TRUNC('week', iot.datetime) AS week_start,
+        COUNT(*)::DOUBLE PRECISION AS weekly_avg_trips
+    FROM
+        public.iot iot
+    WHERE
+        iot.region = ANY($1::varchar[])
+        AND iot.datetime >= $2
+        AND iot.datetime < $3
+    GROUP BY
+        DATE_TRUNC('week', iot.datetime)
+    ORDER BY
+        week_start DESC
+    LIMIT $4
+"""
+
+# $1 limit
+# Regions with the most trips and the datasource of their latest trip, read in order from idx_region_stats_count
+TOP_REGIONS_QUERY = """
+    SELECT
+        stats.region,
+        stats.trip_count,
+        stats.latest_datasource,
+        stats.latest_datetime
+    FROM
+        public.iot_region_stats stats
+    ORDER BY
+        stats.trip_count DESC,
+        stats.region
+    LIMIT $1
+"""
+
+# $1 datasource
+# Regions a datasource appeared in, a range of the iot_datasource_region primary key
+DATASOURCE_REGIONS_QUERY = """
+    SELECT
+        datasource_region.region,
+        datasource_region.trip_count
+    FROM
+        public.iot_datasource_region datasource_region
+    WHERE
+        datasource_region.datasource = $1
+    ORDER BY
+        datasource_region.trip_count DESC,
+        datasource_region.region
+"""
+
+# $1 id watermark, $2 limit
+# Trips loaded by the columnar snapshot, in id order across the partitions through their (id, datetime) primary keys
+SNAPSHOT_ROWS_QUERY = """
+    SELECT
+        iot.id,
+        COALESCE(ST_X(iot.origin_geom), 'NaN')::REAL AS origin_lon,
+        COALESCE(ST_Y(iot.origin_geom), 'NaN')::REAL AS origin_lat,
+        COALESCE(ST_X(iot.destination_geom), 'NaN')::REAL AS destination_lon,
+        COALESCE(ST_Y(iot.destination_geom), 'NaN')::REAL AS destination_lat,
+        FLOOR(EXTRACT(EPOCH FROM iot.datetime))::BIGINT AS epoch_seconds,
+        iot.region,
+        iot.datasource
+    FROM
+        public.iot iot
+    WHERE
+        iot.id > $1
+    ORDER BY
+        iot.id
+    LIMIT $2
+"""
+
+DATA_VERSION_QUERY = """
+    SELECT version FROM public.iot_data_version
+"""
@@ -0,0 +1,18 @@
+import base64
+from datetime import datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(week_start: str) -> str:
+    """Opaque keyset token pointing after the last week of a page."""
+    return base64.urlsafe_b64encode(week_start.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> datetime:
+    try:
+        return datetime.fromisoformat(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
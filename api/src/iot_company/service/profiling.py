@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+# Requests slower than this get their queries EXPLAINed (ANALYZE, BUFFERS), 0 disables it
+slow_query_explain_ms = float(os.environ.get('SLOW_QUERY_EXPLAIN_MS', 0))
+# EXPLAIN ANALYZE runs the query again, each query text is explained at most once per interval
+slow_query_explain_interval_seconds = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS', 60))
+# Slow query plans kept for /slow_queries
+slow_query_log_size = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 20))
+
+# pool_wait: acquiring a pooled connection, sql: prepare + execute until the first rows,
+# fetch: the next cursor round trips of streamed responses, snapshot: answering from the columnar snapshot,
+# serialize: rows to JSON bytes
+STAGES = ('pool_wait', 'sql', 'fetch', 'snapshot', 'serialize')
+
+# Histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestTimings:
+    """Seconds spent per stage by one request, and the queries it ran."""
+    __slots__ = ('stages', 'queries')
+
+    def __init__(self):
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.queries: List[Tuple[str, Sequence[Any]]] = []
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] += seconds
+
+
+# Timings of the request being served, None outside of a request (e.g. startup)
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar('current_timings', default=None)
+
+
+def record(stage: str, seconds: float):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+def record_query(query: str, args: Sequence[Any]):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.queries.append((query, args))
+
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+@asynccontextmanager
+async def acquire(pool: asyncpg.Pool):
+    """pool.acquire() that records how long the request waited for a connection."""
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        record('pool_wait', time.perf_counter() - started)
+        yield conn
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        index = bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            self.counts[index] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bucket, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bucket}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RequestMetrics:
+    """In-process Prometheus registry of the request and stage timings, per uvicorn worker."""
+
+    def __init__(self):
+        self.requests = {}
+        self.durations = {}
+        self.stage_durations = {}
+        self.slow_requests = {}
+
+    def observe(self, endpoint: str, status: int, seconds: float, timings: RequestTimings):
+        key = (endpoint, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        self.durations.setdefault(endpoint, Histogram()).observe(seconds)
+        for stage, stage_seconds in timings.stages.items():
+            self.stage_durations.setdefault((endpoint, stage), Histogram()).observe(stage_seconds)
+
+    def slow(self, endpoint: str):
+        self.slow_requests[endpoint] = self.slow_requests.get(endpoint, 0) + 1
+
+    def render(self, gauges: dict) -> str:
+        """Prometheus text exposition format, gauges are {name: (help, value)}."""
+        lines = ['# HELP iot_api_requests_total Requests served', '# TYPE iot_api_requests_total counter']
+        for (endpoint, status), count in sorted(self.requests.items()):
+            lines.append(f'iot_api_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+        lines += ['# HELP iot_api_request_duration_seconds Request duration, streamed bodies included',
+                  '# TYPE iot_api_request_duration_seconds histogram']
+        for endpoint, histogram in sorted(self.durations.items()):
+            lines += histogram.lines('iot_api_request_duration_seconds', f'endpoint="{endpoint}"')
+
+        lines += ['# HELP iot_api_stage_duration_seconds Request time per stage (pool_wait, sql, fetch, snapshot, serialize)',
+                  '# TYPE iot_api_stage_duration_seconds histogram']
+        for (endpoint, stage), histogram in sorted(self.stage_durations.items()):
+            lines += histogram.lines('iot_api_stage_duration_seconds', f'endpoint="{endpoint}",stage="{stage}"')
+
+        lines += ['# HELP iot_api_slow_requests_total Requests over SLOW_QUERY_EXPLAIN_MS',
+                  '# TYPE iot_api_slow_requests_total counter']
+        for endpoint, count in sorted(self.slow_requests.items()):
+            lines.append(f'iot_api_slow_requests_total{{endpoint="{endpoint}"}} {count}')
+
+        for name, (description, value) in gauges.items():
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+class SlowQueryLog:
+    """Runs EXPLAIN (ANALYZE, BUFFERS) in the background for the queries of slow requests."""
+
+    def __init__(self, threshold_ms: float = slow_query_explain_ms,
+                 interval_seconds: float = slow_query_explain_interval_seconds, size: int = slow_query_log_size):
+        self.threshold_seconds = threshold_ms / 1000
+        self.interval_seconds = interval_seconds
+        self.plans = deque(maxlen=size)
+        self._last_explained = {}
+        # References to the running tasks, asyncio only keeps weak ones
+        self._tasks = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_seconds > 0
+
+    def capture(self, pool: asyncpg.Pool, endpoint: str, seconds: float, timings: RequestTimings):
+        now = time.monotonic()
+        for query, args in timings.queries:
+            if now - self._last_explained.get(query, -self.interval_seconds) < self.interval_seconds:
+                continue
+            self._last_explained[query] = now
+            task = asyncio.ensure_future(self._explain(pool, endpoint, seconds, timings.stages, query, args))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _explain(self, pool, endpoint, seconds, stages, query, args):
+        try:
+            async with pool.acquire() as conn:
+                # Read only and rolled back, the plan is all we want from the second run
+                async with conn.transaction(readonly=True):
+                    plan = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *args)
+        except Exception as e:
+            logging.warning(f"Error explaining slow query of {endpoint}: {e}")
+            return
+
+        entry = {
+            'endpoint': endpoint,
+            'request_ms': round(seconds * 1000, 3),
+            'stages_ms': {stage: round(value * 1000, 3) for stage, value in stages.items()},
+            'query': ' '.join(query.split()),
+            'args': [str(arg) for arg in args],
+            'plan': plan,
+        }
+        self.plans.append(entry)
+        logging.warning(f"Slow request on {endpoint} ({entry['request_ms']} ms): {entry['query']} plan: {plan}")
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware timing every HTTP request, streamed bodies included: the stages are recorded by
+    the database helpers into the request's RequestTimings through a context variable.
+    """
+
+    def __init__(self, app, metrics: RequestMetrics, slow_query_log: SlowQueryLog):
+        self.app = app
+        self.metrics = metrics
+        self.slow_query_log = slow_query_log
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - started
+            current_timings.reset(token)
+            # Route templates keep the label set bounded, unknown paths are grouped
+            route = scope.get('route')
+            endpoint = getattr(route, 'path', None) or 'unmatched'
+            self.metrics.observe(endpoint, status, seconds, timings)
+            if self.slow_query_log.enabled and seconds >= self.slow_query_log.threshold_seconds:
+                self.metrics.slow(endpoint)
+                if timings.queries:
+                    self.slow_query_log.capture(scope['app'].state.pool, endpoint, seconds, timings)
@@ -0,0 +1,128 @@
+import importlib
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+# Response cache configuration
+cache_enabled = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+cache_max_entries = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+cache_ttl_seconds = float(os.environ.get('CACHE_TTL_SECONDS', 300))
+# How long the data version read from Postgres is trusted before being read again
+cache_version_check_seconds = float(os.environ.get('CACHE_VERSION_CHECK_SECONDS', 1))
+# Optional 'package.module:ClassName' of a CacheBackend subclass, e.g. one backed by Redis
+cache_backend = os.environ.get('CACHE_BACKEND')
+
+# Request header that skips the cache, e.g. X-Cache-Bypass: 1
+CACHE_BYPASS_HEADER = 'x-cache-bypass'
+
+# Bounding boxes are rounded to this many decimals (~11 meters) so near identical requests share entries
+BBOX_DECIMALS = 4
+
+
+class CacheBackend(ABC):
+    """Storage behind ResponseCache, implement it to plug a shared store."""
+
+    evictions = 0
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, ttl_seconds: float):
+        ...
+
+    def __len__(self):
+        return 0
+
+
+class LruTtlBackend(CacheBackend):
+    """In-process LRU with a per entry time to live."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: float):
+        self._entries[key] = (time.monotonic() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache:
+    """
+    Caches endpoint results under the current data version, the ingest bumps the version
+    after every committed batch so entries are only invalidated when new trips land.
+    """
+
+    def __init__(self, backend: CacheBackend, load_version: Callable[[], Awaitable[int]]):
+        self.backend = backend
+        self._load_version = load_version
+        self._version = None
+        self._version_checked_at = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'bypasses': 0}
+
+    async def data_version(self) -> int:
+        if self._version is None or time.monotonic() - self._version_checked_at >= cache_version_check_seconds:
+            self._version = await self._load_version()
+            self._version_checked_at = time.monotonic()
+        return self._version
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable[Any]], bypass: bool = False):
+        """Returns (value, 'HIT' | 'MISS' | 'BYPASS')."""
+        if bypass or not cache_enabled:
+            self.stats['bypasses'] += 1
+            return await load(), 'BYPASS'
+
+        versioned_key = (await self.data_version(), key)
+        value = self.backend.get(versioned_key)
+        if value is not None:
+            self.stats['hits'] += 1
+            return value, 'HIT'
+
+        self.stats['misses'] += 1
+        value = await load()
+        self.backend.set(versioned_key, value, cache_ttl_seconds)
+        return value, 'MISS'
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            'evictions': self.backend.evictions,
+            'entries': len(self.backend),
+            'data_version': self._version,
+        }
+
+
+def create_backend() -> CacheBackend:
+    if cache_backend:
+        module_name, class_name = cache_backend.split(':')
+        return getattr(importlib.import_module(module_name), class_name)()
+    return LruTtlBackend(cache_max_entries)
+
+
+def round_bbox(min_lon: float, min_lat: float, max_lon: float, max_lat: float):
+    return tuple(round(value, BBOX_DECIMALS) for value in (min_lon, min_lat, max_lon, max_lat))
+
+
+def normalize_regions(regions):
+    return tuple(sorted(set(regions)))
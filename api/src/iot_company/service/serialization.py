@@ -0,0 +1,38 @@
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Sequence, Type
+
+import orjson
+from pydantic import BaseModel
+
+
+def columns_of(model: Type[BaseModel]) -> tuple:
+    """Response keys in the order of the model fields, the queries select their columns in that order."""
+    return tuple(model.model_fields)
+
+
+def _default(value: Any):
+    # NUMERIC results, orjson handles datetime, int and float natively
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def row_mapper(columns: Sequence[str]) -> Callable[[Sequence[Any]], dict]:
+    return lambda row: dict(zip(columns, row))
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+def encode_rows(columns: Sequence[str], rows: Iterable[Sequence[Any]], **extra) -> bytes:
+    """{"data": [...], **extra} built straight from database rows, without a model per row."""
+    return orjson.dumps({"data": [dict(zip(columns, row)) for row in rows], **extra}, default=_default)
+
+
+def encode_keyed_rows(columns: Sequence[str], rows: Iterable[Sequence[Any]], keys: Iterable[str]) -> bytes:
+    """{"data": {key: [...]}} from rows whose first column is the key, every key is present even without rows."""
+    data: Dict[str, list] = {key: [] for key in keys}
+    for row in rows:
+        data[row[0]].append(dict(zip(columns, row[1:])))
+    return orjson.dumps({"data": data}, default=_default)
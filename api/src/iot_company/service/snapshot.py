@@ -0,0 +1,295 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+import numpy as np
+
+from iot_company.repository.queries import SNAPSHOT_ROWS_QUERY
+
+# Columnar snapshot configuration
+# Shared by the uvicorn workers of the host, /dev/shm keeps the memory mapped columns in RAM
+snapshot_dir = os.environ.get('SNAPSHOT_DIR', '/dev/shm/iot_snapshot')
+snapshot_refresh_seconds = float(os.environ.get('SNAPSHOT_REFRESH_SECONDS', 1))
+snapshot_fetch_rows = int(os.environ.get('SNAPSHOT_FETCH_ROWS', 100000))
+# Identity values are taken before commit, so rows up to this many ids behind the watermark are read again
+snapshot_id_overlap = int(os.environ.get('SNAPSHOT_ID_OVERLAP', 10000))
+
+# One file per column, float32 coordinates (~1 meter), dictionary encoded region / datasource (-1 is NULL)
+COLUMNS = {
+    'id': np.int64,
+    'origin_lon': np.float32,
+    'origin_lat': np.float32,
+    'destination_lon': np.float32,
+    'destination_lat': np.float32,
+    'epoch_seconds': np.int64,
+    'epoch_week': np.int64,
+    'region': np.int32,
+    'datasource': np.int32,
+}
+
+META_FILE = 'current.json'
+LOCK_FILE = 'refresh.lock'
+EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(seconds=1)
+
+
+def epoch_week(seconds):
+    # Weeks start on Monday like DATE_TRUNC('week'), 1970-01-01 was a Thursday
+    return (seconds // 86400 + 3) // 7
+
+
+def week_start(week: int) -> datetime:
+    return EPOCH + timedelta(days=int(week) * 7 - 3)
+
+
+def bbox_center(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> Tuple[float, float]:
+    """Same center as BBOX_CENTER, on the right side of the antimeridian when the box crosses it."""
+    if min_lon <= max_lon:
+        longitude = (min_lon + max_lon) / 2
+    elif min_lon + max_lon > 0:
+        longitude = (min_lon + max_lon) / 2 - 180
+    else:
+        longitude = (min_lon + max_lon) / 2 + 180
+    return longitude, (min_lat + max_lat) / 2
+
+
+class SnapshotView:
+    """
+    Read only view of one published state of the snapshot: memory mapped columns of `rows` trips.
+    Answers the weekly average endpoints with vectorized masks and bincount, rows are returned in
+    the column order of the matching SQL query.
+    """
+
+    def __init__(self, directory: str, meta: dict):
+        self.rows = meta['rows']
+        self.watermark = meta['watermark']
+        self.regions = meta['regions']
+        self.region_codes = {region: code for code, region in enumerate(self.regions)}
+        self.columns = {
+            name: np.memmap(os.path.join(directory, f'{name}.bin'), dtype=dtype, mode='r', shape=(self.rows,))
+            if self.rows else np.zeros(0, dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+
+    async def weekly_average_trips(self, bbox: Sequence[float], window: Optional[Tuple[datetime, datetime]],
+                                   limit: int = 100) -> List[tuple]:
+        return await _run(self._weekly_average_trips, bbox, window, limit)
+
+    async def weekly_average_trips_by_regions(self, regions: Sequence[str],
+                                              window: Optional[Tuple[datetime, datetime]],
+                                              before: Optional[datetime], limit: Optional[int]) -> List[tuple]:
+        return await _run(self._weekly_average_trips_by_regions, regions, window, before, limit)
+
+    def _weekly_average_trips(self, bbox, window, limit):
+        # Exact match of origins or destinations like the windowed SQL query, NaN (NULL) coordinates never match
+        mask = self._in_box('origin', bbox) | self._in_box('destination', bbox)
+        if window:
+            mask &= self._in_window(window)
+        center = bbox_center(*bbox)
+        return [(regions, *center, week, count) for regions, week, count in self._weeks(mask, ',', None, limit)]
+
+    def _weekly_average_trips_by_regions(self, regions, window, before, limit):
+        codes = [self.region_codes[region] for region in regions if region in self.region_codes]
+        if not codes:
+            return []
+        mask = np.isin(self.columns['region'], codes)
+        if window:
+            mask &= self._in_window(window)
+        return self._weeks(mask, ', ', before, limit)
+
+    def _in_box(self, prefix, bbox):
+        min_lon, min_lat, max_lon, max_lat = bbox
+        lon = self.columns[f'{prefix}_lon']
+        lat = self.columns[f'{prefix}_lat']
+        if min_lon <= max_lon:
+            lon_mask = (lon >= min_lon) & (lon <= max_lon)
+        else:
+            # Crosses the antimeridian
+            lon_mask = (lon >= min_lon) | (lon <= max_lon)
+        return lon_mask & (lat >= min_lat) & (lat <= max_lat)
+
+    def _in_window(self, window):
+        seconds = self.columns['epoch_seconds']
+        return (seconds >= epoch_seconds(window[0])) & (seconds < epoch_seconds(window[1]))
+
+    def _weeks(self, mask, separator, before, limit):
+        """(regions, week_start, trips) of the weeks with matching trips, newest first."""
+        weeks = self.columns['epoch_week'][mask]
+        if not weeks.size:
+            return []
+        first = weeks.min()
+        offsets = weeks - first
+        counts = np.bincount(offsets)
+        present = np.flatnonzero(counts)[::-1]
+        if before is not None:
+            present = present[present + first < epoch_week(epoch_seconds(before))]
+        if limit:
+            present = present[:limit]
+
+        # Distinct regions per week from the sorted (week, region) pairs, NULL regions are skipped like STRING_AGG
+        codes = self.columns['region'][mask].astype(np.int64) + 1
+        pairs = np.unique(offsets * (len(self.regions) + 1) + codes)
+        pair_weeks = pairs // (len(self.regions) + 1)
+        pair_codes = pairs % (len(self.regions) + 1) - 1
+
+        rows = []
+        for offset in present:
+            low, high = np.searchsorted(pair_weeks, offset, 'left'), np.searchsorted(pair_weeks, offset, 'right')
+            names = sorted(self.regions[code] for code in pair_codes[low:high] if code >= 0)
+            rows.append((separator.join(names), week_start(offset + first), float(counts[offset])))
+        return rows
+
+
+async def _run(function, *args):
+    # numpy releases the GIL on the masks, a thread keeps the event loop serving other requests
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+class ColumnarSnapshot:
+    """
+    NumPy columnar copy of public.iot shared by the uvicorn workers of a host through memory mapped files.
+
+    The worker holding the refresh lock appends the trips past the id watermark to the column files and then
+    publishes the new row count in current.json, every worker maps the columns again when it changes.
+    Deleted trips (retention, benchmark cleanups) stay in the snapshot until its directory is removed.
+    """
+
+    def __init__(self, directory: str = snapshot_dir, refresh_seconds: float = snapshot_refresh_seconds,
+                 fetch_rows: int = snapshot_fetch_rows, id_overlap: int = snapshot_id_overlap):
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self.fetch_rows = fetch_rows
+        self.id_overlap = id_overlap
+        self.view: Optional[SnapshotView] = None
+        self._lock = None
+        self._meta_stat = None
+        self._task = None
+        os.makedirs(directory, exist_ok=True)
+
+    async def start(self, pool: asyncpg.Pool):
+        self._task = asyncio.ensure_future(self._run(pool))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._lock:
+            self._lock.close()
+
+    async def _run(self, pool):
+        while True:
+            try:
+                await self.refresh(pool)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Error refreshing the columnar snapshot: {e}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def refresh(self, pool: asyncpg.Pool):
+        """One refresh: append the new trips when this worker is the refresher, then map the published state."""
+        if self._lock is None:
+            self._lock = self._try_lock()
+        if self._lock is not None:
+            await self._append(pool)
+        self._reload()
+
+    def _try_lock(self):
+        # Taken over by another worker when the refresher exits, the lock goes with its file descriptor
+        lock = open(os.path.join(self.directory, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.directory, META_FILE)) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return None
+
+    def _reload(self):
+        try:
+            stat = os.stat(os.path.join(self.directory, META_FILE))
+        except FileNotFoundError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) == self._meta_stat:
+            return
+        meta = self._read_meta()
+        self.view = SnapshotView(os.path.join(self.directory, meta['generation']), meta)
+        self._meta_stat = (stat.st_mtime_ns, stat.st_size)
+
+    async def _append(self, pool):
+        meta = self._read_meta() or {
+            'generation': f'{int(time.time())}-{os.getpid()}', 'rows': 0, 'watermark': 0,
+            'regions': [], 'datasources': [],
+        }
+        generation_dir = os.path.join(self.directory, meta['generation'])
+        os.makedirs(generation_dir, exist_ok=True)
+        # Drops what a previous refresher appended without publishing it
+        for name, dtype in COLUMNS.items():
+            with open(os.path.join(generation_dir, f'{name}.bin'), 'ab') as column_file:
+                column_file.truncate(meta['rows'] * np.dtype(dtype).itemsize)
+
+        dictionaries = {name: {value: code for code, value in enumerate(meta[f'{name}s'])}
+                        for name in ('region', 'datasource')}
+        after = max(meta['watermark'] - self.id_overlap, 0)
+        known = np.zeros(0, dtype=np.int64)
+        # Also when after is 0 (no more trips than the overlap), the rows read again must not be appended twice
+        if meta['rows']:
+            ids = np.memmap(os.path.join(generation_dir, 'id.bin'), dtype=np.int64, mode='r', shape=(meta['rows'],))
+            known = np.array(ids[ids > after])
+
+        appended = 0
+        async with pool.acquire() as conn:
+            while True:
+                rows = await conn.fetch(SNAPSHOT_ROWS_QUERY, after, self.fetch_rows)
+                if not rows:
+                    break
+                after = rows[-1][0]
+                columns = self._columns(rows, dictionaries)
+                new = ~np.isin(columns['id'], known)
+                for name, values in columns.items():
+                    with open(os.path.join(generation_dir, f'{name}.bin'), 'ab') as column_file:
+                        column_file.write(values[new].tobytes())
+                appended += int(new.sum())
+                meta['watermark'] = max(meta['watermark'], after)
+                if len(rows) < self.fetch_rows:
+                    break
+
+        if appended or not os.path.exists(os.path.join(self.directory, META_FILE)):
+            meta['rows'] += appended
+            for name, codes in dictionaries.items():
+                meta[f'{name}s'] = sorted(codes, key=codes.get)
+            # Readers only look at the published row count, the columns are written first
+            path = os.path.join(self.directory, META_FILE)
+            with open(f'{path}.{os.getpid()}', 'w') as meta_file:
+                json.dump(meta, meta_file)
+            os.replace(f'{path}.{os.getpid()}', path)
+
+    @staticmethod
+    def _columns(rows, dictionaries: Dict[str, dict]) -> Dict[str, np.ndarray]:
+        count = len(rows)
+        columns = {
+            name: np.fromiter((row[index] for row in rows), dtype=COLUMNS[name], count=count)
+            for index, name in enumerate(('id', 'origin_lon', 'origin_lat', 'destination_lon', 'destination_lat',
+                                          'epoch_seconds'))
+        }
+        columns['epoch_week'] = epoch_week(columns['epoch_seconds'])
+        for index, name in ((6, 'region'), (7, 'datasource')):
+            codes = dictionaries[name]
+            columns[name] = np.fromiter(
+                (-1 if row[index] is None else codes.setdefault(row[index], len(codes)) for row in rows),
+                dtype=np.int32, count=count)
+        return columns
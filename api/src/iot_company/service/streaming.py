@@ -0,0 +1,90 @@
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Optional, Sequence
+
+import asyncpg
+from fastapi.responses import StreamingResponse
+
+from iot_company.service.profiling import acquire, record, record_query
+from iot_company.service.serialization import dumps
+
+# Rows fetched from the server side cursor per round trip, also the rows per emitted chunk
+stream_fetch_rows = int(os.environ.get('STREAM_FETCH_ROWS', 500))
+
+STREAM_FORMATS = ('ndjson', 'json_stream')
+
+
+async def stream_rows(pool: asyncpg.Pool, query: str, args: Sequence[Any], to_item: Callable,
+                      response_format: str, limit: Optional[int] = None,
+                      cursor_of: Optional[Callable] = None) -> AsyncIterator[bytes]:
+    """
+    Yields the query results encoded as NDJSON lines or as one chunked {"data": [...]} document,
+    reading them through a server side cursor so memory stays flat whatever the result size.
+    A paged query (cursor_of given, the cursor of a row) ends with the next_cursor of its page like the json
+    response: a last {"next_cursor": ...} line, or a next_cursor key after data. It is null on the last page.
+    """
+    ndjson = response_format == 'ndjson'
+    if not ndjson:
+        yield b'{"data": ['
+
+    first = True
+    rows = 0
+    last_row = None
+    record_query(query, args)
+    async with acquire(pool) as conn:
+        # Server side cursors only live inside a transaction
+        async with conn.transaction(readonly=True):
+            # Waiting for the first rows is sql, for the next cursor round trips fetch
+            stage = 'sql'
+            started = time.perf_counter()
+            statement = await conn.prepared(query)
+            chunk = []
+            try:
+                async for row in statement.cursor(*args, prefetch=stream_fetch_rows):
+                    received = time.perf_counter()
+                    record(stage, received - started)
+                    stage = 'fetch'
+
+                    rows += 1
+                    last_row = row
+                    item = dumps(to_item(row))
+                    if ndjson:
+                        chunk.append(item + b'\n')
+                    else:
+                        chunk.append(item if first else b',' + item)
+                    first = False
+                    started = time.perf_counter()
+                    record('serialize', started - received)
+
+                    if len(chunk) >= stream_fetch_rows:
+                        yield b''.join(chunk)
+                        chunk = []
+                        # Time spent sending the chunk to the client is not ours
+                        started = time.perf_counter()
+                record(stage, time.perf_counter() - started)
+            except Exception as e:
+                # Headers are already sent, the truncated body is the only signal left to the client
+                logging.error(f"Error streaming results: {e}")
+                raise
+            if chunk:
+                yield b''.join(chunk)
+
+    if cursor_of is None:
+        if not ndjson:
+            yield b']}'
+        return
+    # A full page may have more rows behind it
+    next_cursor = dumps(cursor_of(last_row) if limit and rows == limit else None)
+    if ndjson:
+        yield b'{"next_cursor": ' + next_cursor + b'}\n'
+    else:
+        yield b'], "next_cursor": ' + next_cursor + b'}'
+
+
+def streaming_response(pool: asyncpg.Pool, query: str, args: Sequence[Any], to_item: Callable,
+                       response_format: str, limit: Optional[int] = None,
+                       cursor_of: Optional[Callable] = None) -> StreamingResponse:
+    media_type = 'application/x-ndjson' if response_format == 'ndjson' else 'application/json'
+    return StreamingResponse(stream_rows(pool, query, args, to_item, response_format, limit, cursor_of),
+                             media_type=media_type)
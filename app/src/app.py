@@ -1,18 +1,64 @@
+import io
 import logging
 import json
+import os
+import time
+import weakref
 from pg8000 import connect, Cursor
 from typing import List
 
-from iot_company.repository.model.iot_model import MessageDTO, MessagesBatchDTO
+from iot_company.repository.model.iot_model import DecodeError, DecodedBatch, decode_body, decode_records
+from iot_company.service.ingest_metrics import InvocationMetrics, body_bytes
 # Configure logging to send messages to CloudWatch Logs
 logging.basicConfig(level=logging.INFO)
 
 # Retrieve PostgreSQL connection parameters from environment variables
-db_host = 'my_postgres'#'localhost' # 'my_postgres'
-db_port = 5432
-db_name = 'mydatabase'
-db_user = 'myuser'
-db_password = 'mypassword'
+db_host = os.environ.get('DB_HOST', 'my_postgres') # my_postgres # localhost
+db_port = int(os.environ.get('DB_PORT', 5432))
+db_name = os.environ.get('DB_NAME', 'mydatabase')
+db_user = os.environ.get('DB_USER', 'myuser')
+db_password = os.environ.get('DB_PASSWORD', 'mypassword')
+
+# A warm connection idle for longer than this is checked with SELECT 1 before being reused
+health_check_idle_seconds = float(os.environ.get('DB_HEALTH_CHECK_IDLE_SECONDS', 5))
+
+# 'copy' streams each batch through COPY FROM STDIN, 'insert' keeps the executemany path
+write_mode = os.environ.get('INGEST_WRITE_MODE', 'copy')
+
+# Logging every event is a cost of its own under load, only for debugging
+log_payloads = os.environ.get('LOG_PAYLOADS', 'false').lower() == 'true'
+
+IOT_COLUMNS = "region, origin_coord, destination_coord, datetime, datasource, ingest_key"
+
+# Trips already stored (same ingest_key) are skipped, redeliveries and retries don't duplicate them
+ON_CONFLICT_CLAUSE = "ON CONFLICT (ingest_key, datetime) DO NOTHING"
+
+# Session scoped table COPY loads into before the deduplicating INSERT ... SELECT, emptied on commit
+CREATE_STAGING_QUERY = """
+    CREATE TEMP TABLE IF NOT EXISTS iot_staging (
+        region VARCHAR(255),
+        origin_coord TEXT,
+        destination_coord TEXT,
+        datetime TIMESTAMP,
+        datasource VARCHAR(255),
+        ingest_key UUID
+    ) ON COMMIT DELETE ROWS
+"""
+
+# Connections whose session already has iot_staging
+staging_connections = weakref.WeakSet()
+
+# Months (YYYY-MM) whose iot partition is known to exist, kept across warm invocations
+known_partitions = set()
+
+# SQLSTATE class of the COPY errors the INSERT path may not hit (COPY refused by a proxy, ...)
+FEATURE_NOT_SUPPORTED_CLASS = '0A'
+
+# Characters that must be backslash escaped in COPY text format
+COPY_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+# Stage timings and counters of the current invocation, emitted as one EMF line when it ends
+invocation_metrics = InvocationMetrics()
 
 def connect_to_postgres():
     try:
@@ -28,19 +74,85 @@ def connect_to_postgres():
         logging.error(f"Error creating PostgreSQL connection: {e}")
         raise  # Re-raise the exception
 
+
+class ConnectionManager:
+    """
+    Keeps a single PostgreSQL connection open at module level so warm Lambda containers
+    reuse it across invocations instead of paying TCP + auth + startup on every trigger.
+    """
+
+    def __init__(self, connect_fn, health_check_idle_seconds: float):
+        self._connect_fn = connect_fn
+        self._health_check_idle_seconds = health_check_idle_seconds
+        self._conn = None
+        self._last_used = 0.0
+        self.metrics = {
+            'connects': 0,
+            'reuses': 0,
+            'reconnects': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'last_connect_ms': 0.0,
+            'total_connect_ms': 0.0,
+        }
+
+    def get_connection(self):
+        if self._conn is not None:
+            idle_seconds = time.monotonic() - self._last_used
+            # Recently used connections are trusted, only idle ones (e.g. a thawed container) get checked
+            if idle_seconds < self._health_check_idle_seconds or self._is_healthy():
+                self.metrics['reuses'] += 1
+                self._last_used = time.monotonic()
+                return self._conn
+
+            self.metrics['health_check_failures'] += 1
+            self.metrics['reconnects'] += 1
+            self.invalidate()
+
+        return self._open()
+
+    def invalidate(self):
+        """Drop the current connection, the next get_connection() opens a new one."""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception as e:
+                logging.warning(f"Error closing PostgreSQL connection: {e}")
+        self._conn = None
+
+    def _open(self):
+        started = time.perf_counter()
+        self._conn = self._connect_fn()
+        connect_ms = (time.perf_counter() - started) * 1000
+
+        self.metrics['connects'] += 1
+        self.metrics['last_connect_ms'] = round(connect_ms, 3)
+        self.metrics['total_connect_ms'] = round(self.metrics['total_connect_ms'] + connect_ms, 3)
+        self._last_used = time.monotonic()
+        return self._conn
+
+    def _is_healthy(self) -> bool:
+        self.metrics['health_checks'] += 1
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logging.warning(f"PostgreSQL connection health check failed: {e}")
+            return False
+
+
+# Module level so it survives across invocations of a warm container
+connection_manager = ConnectionManager(connect_to_postgres, health_check_idle_seconds)
+
+
 def process_sqs_record(record):
     try:
-        message_dto = MessageDTO.model_validate(record['body'])
-        print(f"Processing message: {message_dto}")
-        return (
-            message_dto.region,
-            message_dto.origin_coord,
-            message_dto.destination_coord,
-            message_dto.datetime,
-            message_dto.datasource
-        )
-    except Exception as e:
-        print(f"Error processing message: {e}")
+        return decode_body(record['body'])
+    except (DecodeError, ValueError, TypeError) as e:
+        logging.error(f"Error processing message: {e}")
         return None
 
 
@@ -55,64 +167,304 @@ def process_sqs_record(record):
 #     logging.info('Persisted with success')
 
 
+def ensure_partitions(conn, cursor: Cursor, messages: List[tuple]):
+    """Create the monthly iot partitions a batch routes into, once per month per container."""
+    missing_months = {}
+    for message in messages:
+        month = message[3][:7]
+        if month not in known_partitions:
+            missing_months.setdefault(month, message[3])
+
+    if not missing_months:
+        return
+
+    for month, datetime_value in sorted(missing_months.items()):
+        cursor.execute("SELECT public.iot_create_partition(%s::timestamp)", (datetime_value,))
+        logging.debug(f'Partition ready: {cursor.fetchone()[0]}')
+    # Committed on its own so a failed batch doesn't roll the partitions back
+    conn.commit()
+    known_partitions.update(missing_months)
+
+
+def bump_data_version(conn, cursor: Cursor):
+    """Tell readers (the API cache) that new trips were committed."""
+    try:
+        cursor.execute("UPDATE public.iot_data_version SET version = version + 1, updated_at = NOW()")
+        # Own short transaction so concurrent writers only queue on this row for an instant
+        conn.commit()
+    except Exception as e:
+        logging.warning(f"Error bumping data version: {e}")
+        conn.rollback()
+
+
+def prepare_staging(conn, cursor: Cursor):
+    """Create iot_staging once per connection, committed so a failed batch doesn't roll it back."""
+    if conn in staging_connections:
+        return
+    cursor.execute(CREATE_STAGING_QUERY)
+    conn.commit()
+    staging_connections.add(conn)
+
+
 def write_to_postgres(cursor: Cursor, messages: List[tuple]):
-    insert_query = "INSERT INTO iot (region, origin_coord, destination_coord, datetime, datasource) VALUES (%s, %s, %s, %s, %s)"
-    logging.info(f'SQL Query: {insert_query}')
+    if write_mode == 'copy':
+        copy_to_postgres(cursor, messages)
+    else:
+        insert_to_postgres(cursor, messages)
+
+
+def insert_to_postgres(cursor: Cursor, messages: List[tuple]):
+    insert_query = f"INSERT INTO iot ({IOT_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s) {ON_CONFLICT_CLAUSE}"
+    logging.debug(f'SQL Query: {insert_query}')
 
     # Use executemany for batch insert
     cursor.executemany(insert_query, messages)
 
-    logging.info('Persisted with success')
+    logging.debug('Persisted with success')
 
 
-def process_batches(messages_to_insert, batch_size):
-    batch_count = 0  # Initialize batch count
+def copy_to_postgres(cursor: Cursor, messages: List[tuple]):
+    # COPY can't skip conflicts, so rows are streamed into iot_staging and moved with one INSERT ... SELECT.
+    # The WKT (or hex EWKB, for compact messages) coordinates are parsed into geography by Postgres itself
+    copy_query = f"COPY iot_staging ({IOT_COLUMNS}) FROM STDIN"
+    insert_query = (
+        f"INSERT INTO iot ({IOT_COLUMNS}) "
+        f"SELECT region, origin_coord::geography, destination_coord::geography, datetime, datasource, ingest_key "
+        f"FROM iot_staging {ON_CONFLICT_CLAUSE}"
+    )
+    logging.debug(f'SQL Query: {copy_query}')
 
-    with connect_to_postgres() as conn:
-        cursor = conn.cursor()
-        try:
-            for batch in chunks(messages_to_insert, batch_size):
-                logging.info('Writing batch')
-                logging.info(f'Writing batch {batch_count}')  # Log batch count
+    cursor.execute(copy_query, stream=io.BytesIO(to_copy_text(messages)))
+    cursor.execute(insert_query)
+
+    logging.debug('Persisted with success')
+
+
+def to_copy_text(messages: List[tuple]) -> bytes:
+    """Render rows in COPY text format, one tab separated line per row."""
+    lines = []
+    for message in messages:
+        lines.append('\t'.join(
+            '\\N' if value is None else str(value).translate(COPY_TEXT_ESCAPES)
+            for value in message
+        ))
+    lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def copy_unsupported(e: Exception) -> bool:
+    """
+    Whether a COPY failed on COPY itself (a protocol error without SQLSTATE, feature not supported) rather than on
+    the rows: data and constraint errors would fail the INSERT fallback the same way, only slower.
+    """
+    # pg8000 reports the fields of the Postgres error as a dict, SQLSTATE under 'C'
+    details = e.args[0] if e.args else None
+    if not isinstance(details, dict):
+        return True
+    return str(details.get('C', '')).startswith(FEATURE_NOT_SUPPORTED_CLASS)
 
-                write_to_postgres(cursor, batch)
-                conn.commit()
-                batch_count += 1  # Increment batch count
 
+def write_batch(conn, cursor: Cursor, batch: List[tuple]):
+    with invocation_metrics.stage('partitions'):
+        ensure_partitions(conn, cursor, batch)
+    with invocation_metrics.stage('write'):
+        if write_mode == 'copy':
+            prepare_staging(conn, cursor)
+        try:
+            write_to_postgres(cursor, batch)
         except Exception as e:
-            logging.error(f"Error: {e}")
+            if write_mode != 'copy' or not copy_unsupported(e):
+                raise
+            # Fall back to the row by row path for this batch
+            logging.warning(f"COPY failed, retrying batch with INSERT: {e}")
+            invocation_metrics.add('copy_fallbacks')
+            conn.rollback()
+            insert_to_postgres(cursor, batch)
+    with invocation_metrics.stage('commit'):
+        conn.commit()
+
+
+def process_batches(messages_to_insert, batch_size, message_ids=None) -> List[str]:
+    """Write the messages batch by batch, returns the message ids of the rows that were not committed."""
+    batch_count = 0  # Initialize batch count
+    failed_message_ids = []
+    if message_ids is None:
+        message_ids = [None] * len(messages_to_insert)
+
+    conn = None
+    cursor = None
+    try:
+        for batch, batch_message_ids in zip(chunks(messages_to_insert, batch_size), chunks(message_ids, batch_size)):
+            logging.debug(f'Writing batch {batch_count}')  # Log batch count
+            try:
+                if cursor is None:
+                    with invocation_metrics.stage('connect'):
+                        conn = connection_manager.get_connection()
+                        cursor = conn.cursor()
+                write_batch(conn, cursor, batch)
+            except Exception as e:
+                # Only this batch is retried, the committed ones are not replayed
+                logging.error(f"Error writing batch {batch_count}: {e}")
+                invocation_metrics.add('failed_batches')
+                cursor = rollback_or_reconnect(conn, cursor)
+                if cursor is None:
+                    invocation_metrics.add('failed_records', len(batch))
+                    failed_message_ids.extend(batch_message_ids)
+                else:
+                    cursor, unwritten_message_ids = bisect_batch(conn, cursor, batch, batch_message_ids, e)
+                    failed_message_ids.extend(unwritten_message_ids)
+            else:
+                invocation_metrics.add('rows', len(batch))
+                with invocation_metrics.stage('data_version'):
+                    bump_data_version(conn, cursor)
+            invocation_metrics.add('batches')
+            batch_count += 1  # Increment batch count
+    finally:
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                connection_manager.invalidate()
+
+    return failed_message_ids
+
+
+def bisect_batch(conn, cursor: Cursor, batch: List[tuple], message_ids: List[str], error: Exception):
+    """
+    Write the halves of a batch that failed with error separately, down to single rows, so one row Postgres rejects
+    doesn't fail the messages around it. Returns the cursor to keep using (None to reconnect) and the message ids to
+    retry. A row still rejected on its own after a successful rollback is dead lettered, it would fail the same way
+    on every redelivery. Only when the rollback or reconnect fails (Postgres down, ...) are the rows left retried.
+    """
+    pending = [(batch, message_ids, error)]
+    committed = 0
+    rejected = []
+    unwritten_message_ids = []
+    while pending:
+        rows, row_message_ids, error = pending.pop()
+        if error is None:
+            try:
+                write_batch(conn, cursor, rows)
+            except Exception as e:
+                cursor = rollback_or_reconnect(conn, cursor)
+                if cursor is None:
+                    # The connection is gone, what is left goes back to SQS
+                    unwritten_message_ids.extend(row_message_ids)
+                    unwritten_message_ids.extend(message_id for _, ids, _ in pending for message_id in ids)
+                    invocation_metrics.add('failed_records', len(rows) + sum(len(rest) for rest, _, _ in pending))
+                    break
+                error = e
+            else:
+                committed += len(rows)
+                invocation_metrics.add('rows', len(rows))
+                continue
+
+        if len(rows) == 1:
+            rejected.append((row_message_ids[0], json.dumps(rows[0]), f"Rejected by Postgres: {error}"))
+            continue
+        invocation_metrics.add('batch_splits')
+        half = len(rows) // 2
+        pending.append((rows[half:], row_message_ids[half:], None))
+        pending.append((rows[:half], row_message_ids[:half], None))
+
+    if rejected:
+        for message_id, _, reason in rejected:
+            logging.error(f"Row of message {message_id} dead lettered: {reason}")
+        invocation_metrics.add('rejected_rows', len(rejected))
+        if not write_dead_letters(rejected):
+            invocation_metrics.add('failed_records', len(rejected))
+            unwritten_message_ids.extend(message_id for message_id, _, _ in rejected)
+    if committed:
+        with invocation_metrics.stage('data_version'):
+            bump_data_version(conn, cursor)
+    return cursor, unwritten_message_ids
+
+
+def rollback_or_reconnect(conn, cursor):
+    """Roll back a failed batch, returns the cursor to keep using or None to reconnect for the next batch."""
+    if conn is None:
+        return None
+    try:
+        conn.rollback()
+        return cursor
+    except Exception:
+        # The connection is unusable, the next batch (or invocation) reconnects
+        connection_manager.invalidate()
+        return None
+
+
+def write_dead_letters(failures) -> bool:
+    """Persist poison messages with their failure reason, they would fail the same way on every retry."""
+    conn = None
+    try:
+        with invocation_metrics.stage('connect'):
+            conn = connection_manager.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(
+                "INSERT INTO public.iot_dead_letter (message_id, body, reason) VALUES (%s, %s, %s)",
+                [(message_id, body if isinstance(body, str) else json.dumps(body), reason)
+                 for message_id, body, reason in failures]
+            )
+            conn.commit()
         finally:
             cursor.close()
+        return True
+    except Exception as e:
+        logging.error(f"Error writing dead letters: {e}")
+        rollback_or_reconnect(conn, None)
+        return False
+
+
+def write_decoded_batch(decoded_batch: DecodedBatch, batch_size: int) -> List[str]:
+    """Dead letter the invalid messages and write the rows, returns the message ids that were not persisted."""
+    failed_message_ids = []
+    if decoded_batch.failures:
+        invocation_metrics.add('invalid_records', len(decoded_batch.failures))
+        for message_id, _, reason in decoded_batch.failures:
+            logging.error(f"Invalid message {message_id}: {reason}")
+        # Poison messages are acknowledged once they are on the dead letter table
+        with invocation_metrics.stage('dead_letter'):
+            dead_lettered = write_dead_letters(decoded_batch.failures)
+        if not dead_lettered:
+            failed_message_ids.extend(message_id for message_id, _, _ in decoded_batch.failures)
+
+    if decoded_batch.rows:
+        failed_message_ids.extend(process_batches(decoded_batch.rows, batch_size, decoded_batch.message_ids))
+    return failed_message_ids
+
 
 def lambda_handler(event, context):
-    logging.info('Hello from Lambda!')
-    logging.info('Event: %s', event)
+    invocation_metrics.reset()
+    if log_payloads:
+        logging.info('Event: %s', event)
 
+    records = event['Records']
+    failed_message_ids = []
     try:
-        messages_batch_dto = MessagesBatchDTO.model_validate(
-            {'messages': [json.loads(record['body']) for record in event['Records']]})
-
-        if messages_batch_dto:
-            messages_to_insert = [
-                (
-                    message.region,
-                    message.origin_coord,
-                    message.destination_coord,
-                    message.datetime,
-                    message.datasource
-                )
-                for message in messages_batch_dto.messages
-            ]
-
-            logging.info('Messages Batch DTO')
-
-            # Write messages to PostgreSQL in batches
-            batch_size = 500
-            process_batches(messages_to_insert, batch_size)
-            logging.info('Finished writing')
+        # Parsed and validated in one pass, straight into insert ready rows
+        with invocation_metrics.stage('decode'):
+            decoded_batch = decode_records(records)
+        invocation_metrics.add('records', len(records))
+        invocation_metrics.add('bytes', sum(body_bytes(record.get('body')) for record in records))
+
+        # Write messages to PostgreSQL in batches
+        batch_size = 500
+        failed_message_ids.extend(write_decoded_batch(decoded_batch, batch_size))
 
     except Exception as e:
         logging.error(f"Error processing messages batch: {e}")
+        failed_message_ids = [record.get('messageId') for record in records]
+
+    # Connection reuse is reported with the stage timings, as searchable properties
+    invocation_metrics.set('write_mode', write_mode)
+    invocation_metrics.set('connection', connection_manager.metrics)
+    function_name = getattr(context, 'function_name', None) or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+    invocation_metrics.emit(function_name)
+
+    # Partial batch response, SQS only redelivers these messages (once, compact messages carry many rows)
+    return {'batchItemFailures': [{'itemIdentifier': message_id}
+                                  for message_id in dict.fromkeys(failed_message_ids) if message_id]}
 
 def chunks(lst, n):
     """Yield successive n-sized chunks from lst."""
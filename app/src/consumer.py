@@ -0,0 +1,341 @@
+"""
+Long running SQS consumer, an alternative to the Lambda runtime for sustained load: the same decoding,
+dead lettering and writes as lambda_handler, without the fixed batch size / window of the event source mapping
+and the per invocation overhead.
+
+- CONSUMER_RECEIVERS tasks long poll the queue concurrently and decode what they receive
+- one writer flushes the pending messages in one transaction, sized to commit in about CONSUMER_TARGET_FLUSH_SECONDS
+- receivers stop polling while CONSUMER_MAX_PENDING_ROWS rows wait for Postgres (backpressure)
+- messages are deleted only once their rows are committed (or dead lettered), the others come back after
+  their visibility timeout like the batchItemFailures of the Lambda
+
+Usage: SQS_QUEUE_URL=... DB_HOST=localhost python consumer.py
+"""
+import asyncio
+import logging
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional, Tuple
+
+import app
+from iot_company.repository.model.iot_model import DecodedBatch, decode_records
+from iot_company.service.ingest_metrics import body_bytes
+
+# SQS configuration, the defaults match the localstack queue of docker-script.sh
+queue_url = os.environ.get('SQS_QUEUE_URL', 'http://sqs.us-west-2.localhost.localstack.cloud:4566/000000000000/my-queue')
+sqs_endpoint_url = os.environ.get('SQS_ENDPOINT_URL', 'http://localhost:4566')
+sqs_region = os.environ.get('SQS_REGION', 'us-west-2')
+
+# Consumer configuration
+consumer_name = os.environ.get('CONSUMER_NAME', 'iot-consumer')
+consumer_receivers = int(os.environ.get('CONSUMER_RECEIVERS', 4))
+consumer_wait_seconds = int(os.environ.get('CONSUMER_WAIT_SECONDS', 20))
+# Pending and flushing messages must be deleted before it expires, or SQS delivers them again
+consumer_visibility_timeout = int(os.environ.get('CONSUMER_VISIBILITY_TIMEOUT', 60))
+consumer_min_flush_rows = int(os.environ.get('CONSUMER_MIN_FLUSH_ROWS', 100))
+consumer_max_flush_rows = int(os.environ.get('CONSUMER_MAX_FLUSH_ROWS', 20000))
+consumer_target_flush_seconds = float(os.environ.get('CONSUMER_TARGET_FLUSH_SECONDS', 0.5))
+consumer_max_flush_wait = float(os.environ.get('CONSUMER_MAX_FLUSH_WAIT', 1.0))
+consumer_max_pending_rows = int(os.environ.get('CONSUMER_MAX_PENDING_ROWS', 50000))
+consumer_metrics_seconds = float(os.environ.get('CONSUMER_METRICS_SECONDS', 60))
+
+# Same limit as SQS for receive_message and delete_message_batch
+MAX_SQS_BATCH = 10
+# Weight of the last flush (or receive interval) in the write and arrival rates
+RATE_SMOOTHING = 0.3
+# Largest change of the flush size from one flush to the next
+MAX_FLUSH_GROWTH = 2.0
+MAX_RETRY_DELAY_SECONDS = 5.0
+
+
+class PendingMessage:
+    """A received message waiting for its flush, with its decoded rows or failure."""
+    __slots__ = ('message_id', 'receipt_handle', 'bytes', 'decoded', 'rows', 'received_at')
+
+    def __init__(self, message: dict, decoded: DecodedBatch, received_at: float):
+        self.message_id = message['MessageId']
+        self.receipt_handle = message['ReceiptHandle']
+        self.bytes = body_bytes(message['Body'])
+        self.decoded = decoded
+        # Poison messages count as one row so they still take room and get flushed
+        self.rows = len(decoded.rows) or 1
+        self.received_at = received_at
+
+
+class SqsConsumer:
+    """
+    Receives, decodes and writes the trips of one queue until stop() is called.
+
+    The flush size follows the write rate of the last flushes: the rows Postgres is expected to commit in
+    target_flush_seconds. A flush starts once that many rows are pending, or max_flush_wait after the oldest
+    pending message when the arrival rate is high enough to fill min_flush_rows in that time; under a trickle
+    messages are flushed as soon as the writer is free, waiting would only add lag.
+    While a flush runs the next one builds up, so a slower Postgres gets bigger and fewer transactions.
+    """
+
+    def __init__(self, sqs, queue_url: str = queue_url, receivers: int = consumer_receivers,
+                 wait_seconds: int = consumer_wait_seconds, visibility_timeout: int = consumer_visibility_timeout,
+                 min_flush_rows: int = consumer_min_flush_rows, max_flush_rows: int = consumer_max_flush_rows,
+                 target_flush_seconds: float = consumer_target_flush_seconds,
+                 max_flush_wait: float = consumer_max_flush_wait, max_pending_rows: int = consumer_max_pending_rows,
+                 metrics_seconds: float = consumer_metrics_seconds, name: str = consumer_name):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.receivers = receivers
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.min_flush_rows = min_flush_rows
+        self.max_flush_rows = max_flush_rows
+        self.target_flush_seconds = target_flush_seconds
+        self.max_flush_wait = max_flush_wait
+        self.max_pending_rows = max_pending_rows
+        self.metrics_seconds = metrics_seconds
+        self.name = name
+
+        self.flush_rows = max(min_flush_rows, min(500, max_flush_rows))
+        self.write_rate: Optional[float] = None
+        self.arrival_rate = 0.0
+        self.stats = {'received': 0, 'deleted': 0, 'delete_failures': 0, 'failed_messages': 0, 'rows': 0,
+                      'flushes': 0, 'failed_flushes': 0, 'backpressure_waits': 0, 'last_commit': None}
+
+        self._pending: List[PendingMessage] = []
+        self._pending_rows = 0
+        self._arrived_rows = 0
+        self._arrival_started = time.monotonic()
+        self._stopping = asyncio.Event()
+        self._changed = asyncio.Condition()
+        self._deletes = set()
+        # boto3 clients are blocking, receives and deletes run on threads
+        self._sqs_executor = ThreadPoolExecutor(max_workers=receivers + 2, thread_name_prefix='sqs')
+        # The Lambda module keeps one connection and one set of metrics, like one warm container
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+
+    def stop(self):
+        """Stop receiving, the pending messages are still flushed and deleted before run() returns."""
+        self._stopping.set()
+        asyncio.ensure_future(self._notify())
+
+    async def run(self):
+        app.invocation_metrics.reset()
+        receivers = [asyncio.ensure_future(self._receive()) for _ in range(self.receivers)]
+        try:
+            await self._flush_loop(receivers)
+        finally:
+            for receiver in receivers:
+                receiver.cancel()
+            if self._deletes:
+                await asyncio.gather(*self._deletes, return_exceptions=True)
+            await asyncio.get_running_loop().run_in_executor(self._writer, self._emit_metrics)
+            self._sqs_executor.shutdown(wait=False)
+            self._writer.shutdown(wait=True)
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _receive(self):
+        loop = asyncio.get_running_loop()
+        receive = partial(self.sqs.receive_message, QueueUrl=self.queue_url, MaxNumberOfMessages=MAX_SQS_BATCH,
+                          WaitTimeSeconds=self.wait_seconds, VisibilityTimeout=self.visibility_timeout)
+        while not self._stopping.is_set():
+            if self._pending_rows >= self.max_pending_rows:
+                # Postgres is behind, leave the messages on the queue until the writer catches up
+                self.stats['backpressure_waits'] += 1
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: self._pending_rows < self.max_pending_rows or self._stopping.is_set())
+                continue
+
+            try:
+                response = await loop.run_in_executor(self._sqs_executor, receive)
+            except Exception as e:
+                logging.warning(f"Error receiving messages: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            messages = response.get('Messages', [])
+            if not messages:
+                continue
+            received_at = time.monotonic()
+            for message in messages:
+                decoded = decode_records([{'messageId': message['MessageId'], 'body': message['Body']}])
+                pending = PendingMessage(message, decoded, received_at)
+                self._pending.append(pending)
+                self._pending_rows += pending.rows
+                self._arrived_rows += pending.rows
+            self.stats['received'] += len(messages)
+            await self._notify()
+
+    async def _flush_loop(self, receivers):
+        retries = 0
+        while True:
+            ready = await self._wait_for_flush(receivers)
+            if not ready:
+                return
+            if await self._flush(self._take()):
+                retries = 0
+            else:
+                # Postgres is failing, back off and retry with smaller flushes
+                retries += 1
+                self.flush_rows = max(self.min_flush_rows, self.flush_rows // 2)
+                await asyncio.sleep(min(MAX_RETRY_DELAY_SECONDS, 0.1 * 2 ** retries))
+
+    async def _wait_for_flush(self, receivers) -> bool:
+        """Wait until a flush is due, False once stopped with nothing left to flush."""
+        while True:
+            if self._stopping.is_set():
+                if self._pending:
+                    return True
+                # A receive started before stop() may still bring messages
+                if all(receiver.done() for receiver in receivers):
+                    return False
+                await asyncio.wait(receivers, timeout=self.wait_seconds)
+                continue
+            if self._pending_rows >= self.flush_rows:
+                return True
+
+            timeout = None
+            if self._pending:
+                linger = self.max_flush_wait if self.arrival_rate * self.max_flush_wait >= self.min_flush_rows else 0
+                timeout = self._pending[0].received_at + linger - time.monotonic()
+                if timeout <= 0:
+                    return True
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _take(self) -> List[PendingMessage]:
+        """Oldest pending messages up to flush_rows rows, at least one."""
+        count = 0
+        rows = 0
+        for pending in self._pending:
+            if count and rows + pending.rows > self.flush_rows:
+                break
+            count += 1
+            rows += pending.rows
+        taken, self._pending = self._pending[:count], self._pending[count:]
+        self._pending_rows -= rows
+
+        now = time.monotonic()
+        elapsed = now - self._arrival_started
+        if elapsed > 0:
+            self.arrival_rate = _smooth(self.arrival_rate, self._arrived_rows / elapsed)
+        self._arrived_rows = 0
+        self._arrival_started = now
+        return taken
+
+    async def _flush(self, messages: List[PendingMessage]) -> bool:
+        """Write the messages in one transaction and delete the persisted ones, False when nothing was written."""
+        batch = DecodedBatch()
+        for pending in messages:
+            batch.rows.extend(pending.decoded.rows)
+            batch.message_ids.extend(pending.decoded.message_ids)
+            batch.failures.extend(pending.decoded.failures)
+
+        started = time.perf_counter()
+        written, failed = await asyncio.get_running_loop().run_in_executor(self._writer, self._write, messages, batch)
+        seconds = time.perf_counter() - started
+        await self._notify()
+
+        # Not deleted, SQS delivers them again once their visibility timeout expires
+        failed = set(failed)
+        done = [pending for pending in messages if pending.message_id not in failed]
+        self.stats['flushes'] += 1
+        self.stats['failed_messages'] += len(messages) - len(done)
+        # Deleting doesn't hold the next flush, it only has to happen before the visibility timeout
+        for i in range(0, len(done), MAX_SQS_BATCH):
+            task = asyncio.ensure_future(self._delete(done[i:i + MAX_SQS_BATCH]))
+            self._deletes.add(task)
+            task.add_done_callback(self._deletes.discard)
+        # Nothing committed and messages left to retry, rows only dead lettered are not a failed flush
+        if batch.rows and not written and failed:
+            self.stats['failed_flushes'] += 1
+            return False
+
+        self.stats['rows'] += written
+        self.stats['last_commit'] = time.time()
+        # A flush split around rejected rows says nothing about the write rate of a whole one
+        if written and written == len(batch.rows):
+            self._adapt(written, seconds)
+        return True
+
+    def _write(self, messages: List[PendingMessage], batch: DecodedBatch) -> Tuple[int, List[str]]:
+        """Runs on the writer thread, returns the rows committed and the message ids not persisted."""
+        metrics = app.invocation_metrics
+        metrics.add('records', len(messages))
+        metrics.add('bytes', sum(pending.bytes for pending in messages))
+        rows = metrics.counters['rows']
+        try:
+            # Every row of the flush in one transaction, split only when Postgres rejects some of them
+            failed = app.write_decoded_batch(batch, max(len(batch.rows), 1))
+        except Exception as e:
+            logging.error(f"Error flushing {len(messages)} messages: {e}")
+            failed = [pending.message_id for pending in messages]
+            metrics.add('failed_batches')
+        written = metrics.counters['rows'] - rows
+        if time.perf_counter() - metrics.started >= self.metrics_seconds:
+            self._emit_metrics()
+        return written, failed
+
+    def _emit_metrics(self):
+        """One EMF line per metrics interval instead of per invocation, rows_per_second is the sustained rate."""
+        metrics = app.invocation_metrics
+        metrics.set('write_mode', app.write_mode)
+        metrics.set('connection', app.connection_manager.metrics)
+        metrics.set('consumer', {
+            'flush_rows': self.flush_rows,
+            'write_rows_per_second': round(self.write_rate or 0.0, 1),
+            'arrival_rows_per_second': round(self.arrival_rate, 1),
+            'pending_rows': self._pending_rows,
+            **{key: value for key, value in self.stats.items() if key != 'last_commit'},
+        })
+        metrics.emit(self.name)
+        metrics.reset()
+
+    def _adapt(self, rows: int, seconds: float):
+        self.write_rate = rows / seconds if self.write_rate is None else _smooth(self.write_rate, rows / seconds)
+        target = self.write_rate * self.target_flush_seconds
+        target = min(target, self.flush_rows * MAX_FLUSH_GROWTH, self.max_flush_rows)
+        self.flush_rows = max(self.min_flush_rows, int(target))
+
+    async def _delete(self, messages: List[PendingMessage]):
+        entries = [{'Id': str(index), 'ReceiptHandle': pending.receipt_handle}
+                   for index, pending in enumerate(messages)]
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(
+                self._sqs_executor, partial(self.sqs.delete_message_batch, QueueUrl=self.queue_url, Entries=entries))
+        except Exception as e:
+            # The rows are committed, the messages come back after the visibility timeout and are skipped as duplicates
+            logging.warning(f"Error deleting {len(entries)} messages: {e}")
+            self.stats['delete_failures'] += len(entries)
+            return
+        failed = response.get('Failed', [])
+        if failed:
+            logging.warning(f"{len(failed)} messages not deleted, receipt handles expired: {failed[0]}")
+        self.stats['deleted'] += len(response.get('Successful', []))
+        self.stats['delete_failures'] += len(failed)
+
+
+def _smooth(current: float, observed: float) -> float:
+    return current + RATE_SMOOTHING * (observed - current)
+
+
+async def main():
+    import boto3
+
+    consumer = SqsConsumer(boto3.client('sqs', region_name=sqs_region, endpoint_url=sqs_endpoint_url))
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, consumer.stop)
+    logging.info(f"Consuming {queue_url} with {consumer.receivers} receivers")
+    await consumer.run()
+    logging.info(f"Stopped: {consumer.stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+import base64
+import binascii
+import struct
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+# Compact bodies start with the marker and the format version, JSON bodies with '{'
+MARKER = 'iotc'
+VERSION = 1
+PREFIX = f'{MARKER}{VERSION}:'
+
+# SQS rejects messages over 256 KiB
+MAX_MESSAGE_BYTES = 256 * 1024
+# String indexes are unsigned shorts
+MAX_STRINGS = 0xFFFF
+
+# Payload, little endian and base64 encoded after the prefix:
+#   string count, then every string as its UTF-8 length and bytes (regions and datasources, each stored once)
+#   trip count, then every trip as a fixed TRIP struct
+STRING_COUNT = struct.Struct('<H')
+STRING_LENGTH = struct.Struct('<H')
+TRIP_COUNT = struct.Struct('<I')
+# origin lon/lat, destination lon/lat, microseconds since 1970-01-01 (naive datetime), region and datasource indexes
+TRIP = struct.Struct('<ddddqHH')
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Bytes of a packed trip before the string indexes: the coordinates and the datetime
+TRIP_CONTENT_SIZE = 40
+
+# (region, origin_lon, origin_lat, destination_lon, destination_lat, datetime, datasource)
+Trip = Tuple[str, float, float, float, float, datetime, str]
+# Same with the datetime as microseconds since EPOCH and the strings resolved, followed by the packed
+# coordinates and datetime bytes, as decoded
+DecodedTrip = Tuple[str, float, float, float, float, int, str, bytes]
+
+
+class CompactFormatError(ValueError):
+    pass
+
+
+def is_compact(body) -> bool:
+    return body.__class__ is str and body.startswith(MARKER)
+
+
+def encode_trips(trips: Sequence[Trip]) -> str:
+    """One message body carrying every trip, see encode_messages to stay under the SQS message size."""
+    strings = {}
+    packed = []
+    for region, origin_lon, origin_lat, destination_lon, destination_lat, trip_datetime, datasource in trips:
+        packed.append(TRIP.pack(origin_lon, origin_lat, destination_lon, destination_lat,
+                                (trip_datetime - EPOCH) // MICROSECOND,
+                                strings.setdefault(region, len(strings)), strings.setdefault(datasource, len(strings))))
+    if len(strings) > MAX_STRINGS:
+        raise CompactFormatError(f"More than {MAX_STRINGS} distinct strings in one message")
+
+    parts = [STRING_COUNT.pack(len(strings))]
+    for value in strings:
+        encoded = value.encode('utf-8')
+        parts.append(STRING_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    parts.append(TRIP_COUNT.pack(len(packed)))
+    parts.extend(packed)
+    return PREFIX + base64.b64encode(b''.join(parts)).decode('ascii')
+
+
+def encode_messages(trips: Iterable[Trip], trips_per_message: int,
+                    max_bytes: int = MAX_MESSAGE_BYTES) -> List[str]:
+    """Packs trips into bodies of at most trips_per_message trips and max_bytes bytes."""
+    bodies = []
+    current = []
+    strings = set()
+    raw_size = STRING_COUNT.size + TRIP_COUNT.size
+    for trip in trips:
+        new_strings = {trip[0], trip[6]} - strings
+        added = TRIP.size + sum(STRING_LENGTH.size + len(value.encode('utf-8')) for value in new_strings)
+        if current and (len(current) >= trips_per_message or _encoded_size(raw_size + added) > max_bytes
+                        or len(strings) + len(new_strings) > MAX_STRINGS):
+            bodies.append(encode_trips(current))
+            current, strings = [], set()
+            raw_size = STRING_COUNT.size + TRIP_COUNT.size
+            new_strings = {trip[0], trip[6]}
+            added = TRIP.size + sum(STRING_LENGTH.size + len(value.encode('utf-8')) for value in new_strings)
+        current.append(trip)
+        strings |= new_strings
+        raw_size += added
+    if current:
+        bodies.append(encode_trips(current))
+    return bodies
+
+
+def decode_trips(body: str) -> Iterator[DecodedTrip]:
+    """Trips of a compact body, raises CompactFormatError when the body itself is unreadable."""
+    if not body.startswith(PREFIX):
+        raise CompactFormatError(f"Unsupported compact format version {body[len(MARKER):].split(':')[0]!r}")
+    try:
+        payload = base64.b64decode(body[len(PREFIX):], validate=True)
+    except (binascii.Error, ValueError):
+        raise CompactFormatError("Compact body is not valid base64")
+
+    try:
+        (string_count,) = STRING_COUNT.unpack_from(payload, 0)
+        offset = STRING_COUNT.size
+        strings = []
+        for _ in range(string_count):
+            (length,) = STRING_LENGTH.unpack_from(payload, offset)
+            offset += STRING_LENGTH.size
+            if offset + length > len(payload):
+                raise CompactFormatError("Truncated compact body")
+            strings.append(payload[offset:offset + length].decode('utf-8'))
+            offset += length
+        (trip_count,) = TRIP_COUNT.unpack_from(payload, offset)
+        offset += TRIP_COUNT.size
+    except (struct.error, UnicodeDecodeError) as e:
+        raise CompactFormatError(f"Invalid compact header: {e}")
+    if len(payload) - offset != trip_count * TRIP.size:
+        raise CompactFormatError("Compact body size doesn't match its trip count")
+
+    unpack_from = TRIP.unpack_from
+    for start in range(offset, len(payload), TRIP.size):
+        origin_lon, origin_lat, destination_lon, destination_lat, microseconds, region, datasource = \
+            unpack_from(payload, start)
+        if region >= string_count or datasource >= string_count:
+            raise CompactFormatError("String index out of range")
+        yield (strings[region], origin_lon, origin_lat, destination_lon, destination_lat, microseconds,
+               strings[datasource], payload[start:start + TRIP_CONTENT_SIZE])
+
+
+def _encoded_size(raw_size: int) -> int:
+    return len(PREFIX) + 4 * ((raw_size + 2) // 3)
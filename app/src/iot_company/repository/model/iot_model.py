@@ -1,53 +1,208 @@
-import logging
-from dataclasses import dataclass, field
-from typing import List
-from typing import Optional, Tuple
-
-@dataclass
-class MessageDTO:
-    region: str
-    origin_coord: str
-    destination_coord: str
-    datetime: str
-    datasource: str #= field(init=False)
-
-    def __post_init__(self):
-        if not isinstance(self.region, str) or len(self.region) > 255:
-            raise ValueError("Invalid 'region' value")
-
-        if not isinstance(self.datasource, str) or len(self.datasource) > 255:
-            raise ValueError("Invalid 'datasource' value")
-
-    @classmethod
-    def model_validate(cls, data: dict) -> Optional['MessageDTO']:
+import json
+import re
+import struct
+from datetime import datetime, timedelta
+from hashlib import md5
+from typing import Iterable, List, Optional, Tuple
+
+from iot_company.repository.model.compact_codec import EPOCH, decode_trips, is_compact
+
+try:
+    # Faster parsing when the wheel is packaged with the lambda, json is the fallback
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+# POINT (lon lat) as produced by shapely, coordinates may use exponents
+POINT_PATTERN = re.compile(r'\s*POINT\s*\(\s*(\S+)\s+(\S+)\s*\)\s*', re.IGNORECASE)
+
+MAX_TEXT_LENGTH = 255
+
+# What ingest_key hashes after the region and datasource: origin lon/lat, destination lon/lat doubles and the
+# datetime as days, seconds and microseconds since EPOCH, packed from the parsed values of either format
+KEY_CONTENT = struct.Struct('<ddddiii')
+MICROSECONDS_PER_DAY = 86400 * 1000000
+
+# Hex EWKB of a SRID 4326 point (little endian, point type with the SRID flag), followed by lon and lat doubles.
+# Postgres reads it into geography without parsing WKT text
+EWKB_POINT_PREFIX = '0101000020e6100000'
+
+
+class DecodeError(ValueError):
+    pass
+
+
+class DecodedBatch:
+    """
+    Result of decoding the SQS records of one invocation, a compact record may carry many trips.
+    rows are insert ready (region, origin_coord, destination_coord, datetime, datasource, ingest_key) tuples,
+    message_ids[i] is the SQS message of rows[i], failures are (message_id, body, reason).
+    """
+    __slots__ = ('rows', 'message_ids', 'failures')
+
+    def __init__(self):
+        self.rows: List[tuple] = []
+        self.message_ids: List[Optional[str]] = []
+        self.failures: List[Tuple[Optional[str], str, str]] = []
+
+
+def decode_body(body) -> tuple:
+    """Parse and validate one message body in a single pass, returns its insert ready row."""
+    message = loads(body)
+    if not isinstance(message, dict):
+        raise DecodeError("Message body is not a JSON object")
+
+    try:
+        region = message['region']
+        origin_coord = message['origin_coord']
+        destination_coord = message['destination_coord']
+        datetime_value = message['datetime']
+        datasource = message['datasource']
+    except KeyError as e:
+        raise DecodeError(f"Missing field {e}")
+
+    return decode_row(region, origin_coord, destination_coord, datetime_value, datasource)
+
+
+def decode_row(region, origin_coord, destination_coord, datetime_value, datasource) -> tuple:
+    """Validate the fields of one trip, whatever it was read from, returns its insert ready row."""
+    if region.__class__ is not str:
+        raise DecodeError("Invalid 'region' value")
+    if datasource.__class__ is not str:
+        raise DecodeError("Invalid 'datasource' value")
+    _check_text(region, datasource)
+    origin_lon, origin_lat = _check_point('origin_coord', origin_coord)
+    destination_lon, destination_lat = _check_point('destination_coord', destination_coord)
+    # Keyed on the parsed value, '2018-05-28 09:03:40' from a CSV and '2018-05-28T09:03:40' from the generator
+    # are the same trip
+    since_epoch = _parse_datetime(datetime_value) - EPOCH
+
+    content = KEY_CONTENT.pack(origin_lon, origin_lat, destination_lon, destination_lat,
+                               since_epoch.days, since_epoch.seconds, since_epoch.microseconds)
+    return (region, origin_coord, destination_coord, datetime_value, datasource,
+            ingest_key(region, datasource, content))
+
+
+def decode_compact_trip(region, origin_lon, origin_lat, destination_lon, destination_lat, microseconds,
+                        datasource, content: bytes) -> tuple:
+    """
+    Validate one trip of a compact body, returns its insert ready row with EWKB coordinates.
+    content is the packed coordinates and datetime, the trip is keyed like the same one sent as JSON.
+    """
+    _check_text(region, datasource)
+    _check_coordinates('origin_coord', origin_lon, origin_lat)
+    _check_coordinates('destination_coord', destination_lon, destination_lat)
+    try:
+        datetime_value = (EPOCH + timedelta(microseconds=microseconds)).isoformat()
+    except OverflowError:
+        raise DecodeError("Invalid 'datetime' value, out of range")
+
+    days, microseconds = divmod(microseconds, MICROSECONDS_PER_DAY)
+    seconds, microseconds = divmod(microseconds, 1000000)
+    key = ingest_key(region, datasource, KEY_CONTENT.pack(origin_lon, origin_lat, destination_lon, destination_lat,
+                                                          days, seconds, microseconds))
+    # The little endian lon/lat doubles are the tail of the EWKB
+    return (region, EWKB_POINT_PREFIX + content[:16].hex(), EWKB_POINT_PREFIX + content[16:32].hex(),
+            datetime_value, datasource, key)
+
+
+def ingest_key(region: str, datasource: str, content: bytes) -> str:
+    """
+    Idempotency key of a trip: the same content always hashes to the same key whichever message
+    (or SQS redelivery) and format carried it. content is the KEY_CONTENT of its parsed coordinates and datetime,
+    so the key doesn't depend on how they were written.
+    """
+    return md5((region + '\x1f' + datasource + '\x1f').encode('utf-8') + content, usedforsecurity=False).hexdigest()
+
+
+def decode_records(records: Iterable[dict]) -> DecodedBatch:
+    """Decode SQS records, invalid ones are collected as failures instead of failing the batch."""
+    batch = DecodedBatch()
+    rows_append = batch.rows.append
+    message_ids_append = batch.message_ids.append
+
+    for record in records:
+        body = record.get('body')
+        if is_compact(body):
+            _decode_compact_record(batch, record.get('messageId'), body)
+            continue
         try:
-            return cls(
-                region=data['region'],
-                origin_coord=data['origin_coord'],
-                destination_coord=data['destination_coord'],
-                datetime=data['datetime'],
-                datasource=data['datasource']
-            )
-        except Exception as e:
-            print(f"Error validating message: {e}")
-            return None
-
-
-@dataclass
-class MessagesBatchDTO:
-    messages: List[MessageDTO]
-
-    def __post_init__(self):
-        for message in self.messages:
-            if not isinstance(message, MessageDTO):
-                raise ValueError("Invalid message in 'messages' list")
-
-    @classmethod
-    def model_validate(cls, data: dict) -> Optional['MessagesBatchDTO']:
+            row = decode_body(body)
+        except (ValueError, TypeError) as e:
+            # JSON decode errors of json and orjson are ValueErrors too
+            batch.failures.append((record.get('messageId'), body, str(e)))
+            continue
+        rows_append(row)
+        message_ids_append(record.get('messageId'))
+
+    return batch
+
+
+def _decode_compact_record(batch: DecodedBatch, message_id: Optional[str], body: str):
+    try:
+        trips = list(decode_trips(body))
+    except ValueError as e:
+        # Unreadable as a whole, the message is a poison message like an invalid JSON body
+        batch.failures.append((message_id, body, str(e)))
+        return
+
+    for trip in trips:
         try:
-            return cls(
-                messages=[MessageDTO.model_validate(message_data) for message_data in data['messages']]
-            )
-        except Exception as e:
-            logging.error(f"Error validating messages batch: {e}")
-            return None
\ No newline at end of file
+            row = decode_compact_trip(*trip)
+        except ValueError as e:
+            # Only the invalid trip is dead lettered, as JSON since the body may carry thousands of trips
+            batch.failures.append((message_id, json.dumps(trip[:-1]), str(e)))
+            continue
+        batch.rows.append(row)
+        batch.message_ids.append(message_id)
+
+
+def _parse_datetime(value) -> datetime:
+    # YYYY-MM-DD[T ]HH:MM:SS[.ffffff], fromisoformat alone also takes week dates, bare dates, offsets, 'Z', ...
+    # The separators are checked by position, cheaper than a regex, the digits by fromisoformat
+    if (value.__class__ is not str or not (len(value) == 19 or 21 <= len(value) <= 26 and value[19] == '.')
+            or value[4] != '-' or value[7] != '-' or value[10] not in 'T ' or value[13] != ':' or value[16] != ':'):
+        raise DecodeError("Invalid 'datetime' value, expected YYYY-MM-DD HH:MM:SS[.ffffff]")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise DecodeError("Invalid 'datetime' value, not a valid date and time")
+    if parsed.tzinfo is not None:
+        raise DecodeError("Invalid 'datetime' value, expected YYYY-MM-DD HH:MM:SS[.ffffff]")
+    return parsed
+
+
+def _check_text(region: str, datasource: str):
+    # Postgres text can't store NUL, the whole COPY of the batch would fail on it
+    if len(region) > MAX_TEXT_LENGTH or '\x00' in region:
+        raise DecodeError("Invalid 'region' value")
+    if len(datasource) > MAX_TEXT_LENGTH or '\x00' in datasource:
+        raise DecodeError("Invalid 'datasource' value")
+
+
+def _check_point(name: str, value) -> Tuple[float, float]:
+    try:
+        # Fast path for the canonical 'POINT (lon lat)' the generator sends, the regex handles the rest
+        if value.startswith('POINT (') and value[-1] == ')':
+            longitude, latitude = value[7:-1].split(' ')
+        else:
+            longitude, latitude = POINT_PATTERN.fullmatch(value).groups()
+    except (AttributeError, ValueError):
+        # Not a string, no match or not two coordinates
+        raise DecodeError(f"Invalid '{name}' value, expected POINT (lon lat)")
+
+    try:
+        longitude = float(longitude)
+        latitude = float(latitude)
+    except ValueError:
+        raise DecodeError(f"Invalid '{name}' coordinates")
+    # Same check as _check_coordinates, inlined since it runs twice per trip
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        raise DecodeError(f"Invalid '{name}' coordinates, out of range")
+    return longitude, latitude
+
+
+def _check_coordinates(name: str, longitude: float, latitude: float):
+    # NaN fails the comparisons too
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        raise DecodeError(f"Invalid '{name}' coordinates, out of range")
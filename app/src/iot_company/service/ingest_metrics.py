@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Per invocation metrics configuration
+metrics_enabled = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+metrics_namespace = os.environ.get('METRICS_NAMESPACE', 'IotIngest')
+
+# Stages timed on every invocation, reported as <stage>_ms even when they didn't run
+STAGES = ('decode', 'dead_letter', 'connect', 'partitions', 'write', 'commit', 'data_version')
+# Counters reported as metrics, anything else added with set() is a searchable property
+COUNTERS = ('records', 'bytes', 'invalid_records', 'rows', 'batches', 'failed_batches', 'failed_records',
+            'batch_splits', 'rejected_rows', 'copy_fallbacks')
+
+
+def body_bytes(body) -> int:
+    """UTF-8 size of an SQS body, what SQS bills and limits, without encoding the ASCII ones (compact, most JSON)."""
+    if not body:
+        return 0
+    return len(body) if body.isascii() else len(body.encode('utf-8'))
+
+
+class InvocationMetrics:
+    """
+    Stage durations and counters of one Lambda invocation, emitted as one CloudWatch Embedded Metric Format
+    line: CloudWatch turns it into metrics without a PutMetricData call, and it is plain JSON elsewhere.
+    """
+
+    def __init__(self, namespace: str = metrics_namespace, stream=None):
+        self.namespace = namespace
+        self._stream = stream
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.durations = dict.fromkeys(STAGES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.properties = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Add the time spent in the block to the stage, stages can run several times per invocation."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - started
+
+    def add(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value):
+        self.properties[name] = value
+
+    def document(self, function_name: str) -> dict:
+        total = time.perf_counter() - self.started
+        values = {f"{name}_ms": round(seconds * 1000, 3) for name, seconds in self.durations.items()}
+        values['total_ms'] = round(total * 1000, 3)
+        values.update(self.counters)
+        values['rows_per_second'] = round(self.counters['rows'] / total, 1) if total else 0.0
+
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [
+                        {'Name': name, 'Unit': _unit(name)} for name in values
+                    ],
+                }],
+            },
+            'FunctionName': function_name,
+            **values,
+            **self.properties,
+        }
+
+    def emit(self, function_name: str):
+        """Write the EMF line to stdout, not through logging whose prefix would break the JSON."""
+        if not metrics_enabled:
+            return
+        stream = self._stream or sys.stdout
+        stream.write(json.dumps(self.document(function_name), separators=(',', ':')) + '\n')
+        stream.flush()
+
+
+def _unit(name: str) -> str:
+    if name.endswith('_ms'):
+        return 'Milliseconds'
+    if name == 'bytes':
+        return 'Bytes'
+    if name == 'rows_per_second':
+        return 'Count/Second'
+    return 'Count'
@@ -0,0 +1,137 @@
+import importlib.util
+import json
+import os
+import sys
+import time
+
+# Root of the iot-company repo
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+LAMBDA_SRC_DIR = os.path.join(REPO_DIR, 'app', 'src')
+API_SRC_DIR = os.path.join(REPO_DIR, 'api', 'src')
+EVENTS_DIR = os.path.join(REPO_DIR, 'app', 'events')
+SQS_GENERATOR_DIR = os.path.join(REPO_DIR, 'bin', 'sqs_generator')
+
+# Cost of one write transaction and of each row in it when the Postgres writes are simulated
+SIMULATED_TRANSACTION_SECONDS = 0.003
+SIMULATED_ROW_SECONDS = 0.00002
+
+# $1 trips of the EXPLAIN checks over 2022-2023, spread over 200 regions and the whole globe
+SEED_QUERY = """
+    INSERT INTO public.iot (region, origin_coord, destination_coord, datetime, datasource, ingest_key)
+    SELECT
+        'Region' || (n % 200),
+        ST_SetSRID(ST_MakePoint(random() * 360 - 180, random() * 180 - 90), 4326)::geography,
+        ST_SetSRID(ST_MakePoint(random() * 360 - 180, random() * 180 - 90), 4326)::geography,
+        TIMESTAMP '2022-01-01' + (n % 730) * INTERVAL '1 day' + (n % 24) * INTERVAL '1 hour',
+        'explain_check',
+        md5('explain_check' || n)::uuid
+    FROM GENERATE_SERIES(1, $1) AS n
+"""
+
+
+def load_module(module_name, src_dir):
+    """Import app.py from src_dir under module_name, both the lambda and the api ship an app.py."""
+    if src_dir not in sys.path:
+        sys.path.insert(0, src_dir)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(src_dir, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_lambda_module():
+    # Benchmarks run against a local Postgres unless told otherwise
+    os.environ.setdefault('DB_HOST', 'localhost')
+    return load_module('iot_lambda_app', LAMBDA_SRC_DIR)
+
+
+def simulate_writer(app):
+    """Replace the Postgres writes of a loaded Lambda module with sleeps, every row counts as committed."""
+    def process_batches(messages_to_insert, batch_size, message_ids=None):
+        for batch in app.chunks(messages_to_insert, batch_size):
+            time.sleep(SIMULATED_TRANSACTION_SECONDS + SIMULATED_ROW_SECONDS * len(batch))
+            app.invocation_metrics.add('rows', len(batch))
+        return []
+
+    app.process_batches = process_batches
+    return app
+
+
+def add_api_src_to_path():
+    """Make the API iot_company modules importable without loading its app.py."""
+    if API_SRC_DIR not in sys.path:
+        sys.path.insert(0, API_SRC_DIR)
+
+
+def load_api_queries():
+    """SQL of the API endpoints, importable without the API dependencies."""
+    add_api_src_to_path()
+    from iot_company.repository import queries
+    return queries
+
+
+def add_sqs_generator_to_path():
+    """Make the replay model and the fake SQS queue of bin/sqs_generator importable."""
+    if SQS_GENERATOR_DIR not in sys.path:
+        sys.path.insert(0, SQS_GENERATOR_DIR)
+
+
+def percentiles(seconds):
+    """p50/p95/p99 (nearest rank) and max of durations in seconds, reported in milliseconds."""
+    if not seconds:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    ordered = sorted(seconds)
+
+    def rank(percent):
+        return ordered[max(0, min(len(ordered), -(-len(ordered) * percent // 100)) - 1)]
+
+    return {'p50': round(rank(50) * 1000, 3), 'p95': round(rank(95) * 1000, 3),
+            'p99': round(rank(99) * 1000, 3), 'max': round(ordered[-1] * 1000, 3)}
+
+
+def plan_nodes(plan):
+    """Flatten an EXPLAIN (FORMAT JSON) plan into its nodes."""
+    nodes = [plan]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def sample_rows(count, datasource='benchmark'):
+    """Insert ready rows shaped like the ones lambda_handler builds."""
+    if LAMBDA_SRC_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_SRC_DIR)
+    from iot_company.repository.model.iot_model import decode_row
+
+    rows = []
+    for i in range(count):
+        lon = -180 + (i * 7.3) % 360
+        lat = -90 + (i * 3.1) % 180
+        row = (
+            f'Region{i % 50}',
+            f'POINT ({lon:.6f} {lat:.6f})',
+            f'POINT ({-lon:.6f} {-lat:.6f})',
+            f'2023-{i % 12 + 1:02d}-{i % 28 + 1:02d}T{i % 24:02d}:{i // 24 % 60:02d}:{i // 1440 % 60:02d}.000000',
+            datasource,
+        )
+        rows.append(decode_row(*row))
+    return rows
+
+
+async def connect():
+    """asyncpg connection to the Postgres of the DB_* variables, the local docker-compose one by default."""
+    import asyncpg
+    return await asyncpg.connect(
+        host=os.environ.get('DB_HOST', 'localhost'),
+        port=int(os.environ.get('DB_PORT', 5432)),
+        user=os.environ.get('DB_USER', 'myuser'),
+        password=os.environ.get('DB_PASSWORD', 'mypassword'),
+        database=os.environ.get('DB_NAME', 'mydatabase'),
+    )
+
+
+async def explain(conn, query, *args):
+    """Root node of the JSON plan of query."""
+    result = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+    return json.loads(result)[0]['Plan']
@@ -0,0 +1,186 @@
+"""
+Sustained ingest rows/sec of the asyncio SQS consumer (app/src/consumer.py) versus the Lambda path, against the
+local Postgres + PostGIS started with bin/docker-compose.yml:
+- the same replayed trips are queued on an in-process fake SQS queue before each run
+- the Lambda run drains it with --lambdas processes polling like the event source mapping (see pipeline_benchmark.py)
+- the consumer run drains it with --consumers processes, each running one SqsConsumer with --receivers receivers
+Benchmark trips are deleted and the rollups rebuilt after each run, so both runs write the same rows.
+With --simulated-writer no Postgres is needed: each write transaction sleeps 3 ms plus 20 us per row instead, the
+rows/sec then compare the polling and flushing of both paths, not what Postgres sustains.
+
+The JSON report (the writer used, rows/sec and elapsed seconds per path, the flushes and flush size of the
+consumer) is printed and written with --output.
+
+Usage: DB_HOST=localhost python consumer_benchmark.py [--total 100000] [--format compact] [--consumers 1]
+       [--simulated-writer]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common import LAMBDA_SRC_DIR, SIMULATED_ROW_SECONDS, SIMULATED_TRANSACTION_SECONDS, add_sqs_generator_to_path, \
+    simulate_writer
+
+add_sqs_generator_to_path()
+import replay  # noqa: E402
+from fake_sqs import MAX_RECEIVE_MESSAGES  # noqa: E402
+from iot_company.repository.model.compact_codec import encode_messages  # noqa: E402
+from pipeline_benchmark import BENCHMARK_DATASOURCE, QUEUE_URL, QueueManager, cleanup, lambda_worker  # noqa: E402
+
+# Trips synthesized at once while filling the queue
+GENERATION_CHUNK = 10000
+# Seconds between the checks for a drained queue
+DRAIN_POLL_SECONDS = 0.1
+
+
+def fill_queue(sqs, model, args) -> int:
+    """Queue args.total replayed trips of the benchmark datasource, returns the messages sent."""
+    sent = 0
+    for chunk_index, offset in enumerate(range(0, args.total, GENERATION_CHUNK)):
+        count = min(GENERATION_CHUNK, args.total - offset)
+        if args.format == 'compact':
+            trips = model.trips(count, args.seed, chunk_index, values=True)
+            bodies = encode_messages([trip[:6] + (BENCHMARK_DATASOURCE,) for trip in trips], args.trips_per_message)
+        else:
+            bodies = [json.dumps(dict(trip, datasource=BENCHMARK_DATASOURCE))
+                      for trip in model.trips(count, args.seed, chunk_index)]
+        for i in range(0, len(bodies), MAX_RECEIVE_MESSAGES):
+            sqs.send_message_batch(QueueUrl=QUEUE_URL, Entries=[
+                {'Id': str(index), 'MessageBody': body}
+                for index, body in enumerate(bodies[i:i + MAX_RECEIVE_MESSAGES])
+            ])
+        sent += len(bodies)
+    return sent
+
+
+def consumer_worker(sqs, receivers, simulated_writer):
+    """Runs on its own process, one SqsConsumer until the queue is drained."""
+    os.environ['METRICS_ENABLED'] = 'false'
+    os.environ.setdefault('DB_HOST', 'localhost')
+    if LAMBDA_SRC_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_SRC_DIR)
+    import consumer
+    if simulated_writer:
+        simulate_writer(consumer.app)
+    logging.getLogger().setLevel(logging.WARNING)
+    return asyncio.run(drain(consumer.SqsConsumer(sqs, QUEUE_URL, receivers=receivers, wait_seconds=1)))
+
+
+async def drain(consumer):
+    async def stop_when_drained():
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(DRAIN_POLL_SECONDS)
+            counts = await loop.run_in_executor(None, sqs_counts)
+            # In flight messages include the ones pending on any consumer, deleted after their commit
+            if not counts['visible'] and not counts['in_flight']:
+                consumer.stop()
+                return
+
+    def sqs_counts():
+        return consumer.sqs.counts()
+
+    watcher = asyncio.ensure_future(stop_when_drained())
+    await consumer.run()
+    watcher.cancel()
+    return dict(consumer.stats, flush_rows=consumer.flush_rows,
+                write_rows_per_second=round(consumer.write_rate or 0.0, 1))
+
+
+def run_lambdas(sqs, producer_done, args):
+    with ProcessPoolExecutor(max_workers=args.lambdas) as executor:
+        started = time.time()
+        workers = [executor.submit(lambda_worker, sqs, producer_done, args.batch_size, args.batch_window,
+                                   args.simulated_writer)
+                   for _ in range(args.lambdas)]
+        stats = [worker.result() for worker in workers]
+    last_commit = max((s['last_commit'] for s in stats if s['last_commit']), default=started)
+    return {
+        'elapsed_seconds': round(last_commit - started, 3),
+        'failed_messages': sum(s['failed'] for s in stats),
+        'invocations': sum(s['invocations'] for s in stats),
+    }
+
+
+def run_consumers(sqs, args):
+    with ProcessPoolExecutor(max_workers=args.consumers) as executor:
+        started = time.time()
+        workers = [executor.submit(consumer_worker, sqs, args.receivers, args.simulated_writer) for _ in range(args.consumers)]
+        stats = [worker.result() for worker in workers]
+    last_commit = max((s['last_commit'] for s in stats if s['last_commit']), default=started)
+    return {
+        'elapsed_seconds': round(last_commit - started, 3),
+        'failed_messages': sum(s['failed_messages'] for s in stats),
+        'flushes': sum(s['flushes'] for s in stats),
+        'backpressure_waits': sum(s['backpressure_waits'] for s in stats),
+        'flush_rows': [s['flush_rows'] for s in stats],
+        'write_rows_per_second': [s['write_rows_per_second'] for s in stats],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--total', type=int, default=100000, help='Trips queued for each run')
+    parser.add_argument('--format', choices=('json', 'compact'), default='json', help='SQS message format')
+    parser.add_argument('--trips-per-message', type=int, default=100, help='Trips per compact message')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the replayed trips')
+    parser.add_argument('--lambdas', type=int, default=1, help='Concurrent Lambda processes')
+    parser.add_argument('--batch-size', type=int, default=100, help='Event source mapping batch size')
+    parser.add_argument('--batch-window', type=float, default=1.0, help='Event source mapping batching window')
+    parser.add_argument('--consumers', type=int, default=1, help='Consumer processes')
+    parser.add_argument('--receivers', type=int, default=4, help='Concurrent receivers per consumer')
+    parser.add_argument('--keep', action='store_true', help="Keep the trips of the last run")
+    parser.add_argument('--simulated-writer', action='store_true',
+                        help='Sleep instead of writing to Postgres, the rows/sec are not Postgres figures')
+    parser.add_argument('--output', default=None, help='Also write the JSON report to this file')
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = random.randrange(2 ** 32)
+
+    # Read when the Lambda module is first imported, cleanup() imports it here before forking the consumers
+    os.environ['METRICS_ENABLED'] = 'false'
+    model = replay.TripModel.from_csv(replay.DEFAULT_CSV, seed=args.seed)
+    report = {'config': {key: value for key, value in vars(args).items() if key != 'output'}}
+    if args.simulated_writer:
+        report['writer'] = (f'simulated, not Postgres: {SIMULATED_TRANSACTION_SECONDS * 1000:g} ms per transaction '
+                            f'+ {SIMULATED_ROW_SECONDS * 1000000:g} us per row')
+    else:
+        report['writer'] = f"postgres {os.environ.get('DB_HOST', 'localhost')}"
+    runs = (('lambda', lambda sqs, done: run_lambdas(sqs, done, args)),
+            ('consumer', lambda sqs, done: run_consumers(sqs, args)))
+
+    manager = QueueManager()
+    manager.start()
+    try:
+        for index, (name, run) in enumerate(runs):
+            sqs = manager.FakeSqsClient()
+            producer_done = manager.Event()
+            messages = fill_queue(sqs, model, args)
+            producer_done.set()
+            try:
+                result = run(sqs, producer_done)
+            finally:
+                if not args.simulated_writer and (not args.keep or index < len(runs) - 1):
+                    cleanup()
+            elapsed = result['elapsed_seconds']
+            report[name] = dict(messages=messages, rows_per_second=round(args.total / elapsed, 1) if elapsed else None,
+                                **result)
+    finally:
+        manager.shutdown()
+
+    if report['lambda']['rows_per_second'] and report['consumer']['rows_per_second']:
+        report['consumer_speedup'] = round(report['consumer']['rows_per_second'] / report['lambda']['rows_per_second'], 2)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Records/sec of the lambda message decoding: the previous path (json.loads per record into MessageDTO
+dataclasses, then a tuple list) versus the single pass decode_records, on the sample events of
+app/events scaled to 10k records.
+
+Usage: python decode_speed.py [--records 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass
+
+from common import EVENTS_DIR, load_lambda_module
+
+SAMPLE_EVENTS = ['batch_sqs_to_lambda_event.json', 'sqs_to_lambda_event.json']
+
+
+@dataclass
+class PreviousMessageDTO:
+    # Shape of the MessageDTO the lambda used before decode_records
+    region: str
+    origin_coord: str
+    destination_coord: str
+    datetime: str
+    datasource: str
+
+    def __post_init__(self):
+        if not isinstance(self.region, str) or len(self.region) > 255:
+            raise ValueError("Invalid 'region' value")
+
+        if not isinstance(self.datasource, str) or len(self.datasource) > 255:
+            raise ValueError("Invalid 'datasource' value")
+
+
+def previous_path(records):
+    messages = [json.loads(record['body']) for record in records]
+    dtos = [PreviousMessageDTO(
+        region=data['region'],
+        origin_coord=data['origin_coord'],
+        destination_coord=data['destination_coord'],
+        datetime=data['datetime'],
+        datasource=data['datasource']
+    ) for data in messages]
+    return [(dto.region, dto.origin_coord, dto.destination_coord, dto.datetime, dto.datasource) for dto in dtos]
+
+
+def scaled_records(count):
+    records = []
+    for name in SAMPLE_EVENTS:
+        with open(os.path.join(EVENTS_DIR, name)) as file:
+            records.extend(json.load(file)['Records'])
+    return [records[i % len(records)] for i in range(count)]
+
+
+def best_time(decode, records, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decode(records)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per path, the best one is reported')
+    args = parser.parse_args()
+
+    load_lambda_module()
+    from iot_company.repository.model import iot_model
+
+    records = scaled_records(args.records)
+    print(f"JSON library: {iot_model.loads.__module__}")
+    print(f"{'path':>14} {'seconds':>10} {'records/sec':>12}")
+    for name, decode in (('previous', previous_path), ('decode_records', iot_model.decode_records)):
+        elapsed = best_time(decode, records, args.repeat)
+        print(f"{name:>14} {elapsed:>10.4f} {args.records / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
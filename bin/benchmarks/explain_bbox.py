@@ -0,0 +1,114 @@
+"""
+EXPLAIN checks for the bounding box queries of the API: seeds public.iot inside a transaction (the weekly
+rollup is filled by its trigger), asserts the plans match origins and destinations through their own indexes
+(idx_iot_origin_geom / idx_iot_destination_geom, idx_weekly_rollup_origin_cell / _destination_cell) without
+sequential scans, also for a box crossing the antimeridian and for the batch queries of
+/weekly_average_trips/batch, checks the rollup queries return the same weeks as the window queries, then rolls back.
+
+Usage: DB_HOST=localhost python explain_bbox.py [--rows 1000000]
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+
+from common import SEED_QUERY, connect, explain, load_api_queries, plan_nodes
+
+OPEN_WINDOW = (datetime(1, 1, 1), datetime(9999, 12, 31))
+MONTH_WINDOW = (datetime(2023, 3, 1), datetime(2023, 4, 1))
+# About 1/60,000 of the globe, and the same crossing the antimeridian
+SMALL_BBOX = (10.0, 45.0, 11.0, 46.0)
+ANTIMERIDIAN_BBOX = (179.5, -0.5, -179.5, 0.5)
+# A dashboard page: 20 small boxes, one of them crossing the antimeridian, and one region set
+BATCH_BBOXES = [(float(lon), 45.0, lon + 1.0, 46.0) for lon in range(-100, 90, 10)] + [ANTIMERIDIAN_BBOX]
+BATCH_AREAS = (
+    [f'box{index}' for index in range(len(BATCH_BBOXES))],
+    *([bbox[index] for bbox in BATCH_BBOXES] for index in range(4)),
+    ['regions', 'regions'],
+    ['Region1', 'Region2'],
+    100,
+)
+
+
+def check(name, plan, index_suffixes, relation_prefix):
+    nodes = plan_nodes(plan)
+    indexes = {node['Index Name'] for node in nodes if 'Index Name' in node}
+    seq_scans = {node['Relation Name'] for node in nodes
+                 if node['Node Type'] == 'Seq Scan' and node.get('Relation Name', '').startswith(relation_prefix)}
+
+    uses_indexes = all(any(index.endswith(suffix) for index in indexes) for suffix in index_suffixes)
+    passed = uses_indexes and not seq_scans
+    print(f"{'PASS' if passed else 'FAIL'} {name}: indexes={sorted(indexes)} seq_scans={sorted(seq_scans)}")
+    return passed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='Trips seeded over 2022-2023')
+    args = parser.parse_args()
+
+    queries = load_api_queries()
+    conn = await connect()
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        await conn.execute("SELECT public.iot_create_partitions(TIMESTAMP '2022-01-01', 23)")
+        await conn.execute(SEED_QUERY, args.rows)
+        await conn.execute("ANALYZE public.iot")
+        await conn.execute("ANALYZE public.iot_weekly_rollup")
+
+        raw_indexes = ('origin_geom_idx', 'destination_geom_idx')
+        rollup_indexes = ('idx_weekly_rollup_origin_cell', 'idx_weekly_rollup_destination_cell')
+        results = [
+            check('weekly_average_trips window, every partition',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, *SMALL_BBOX, *OPEN_WINDOW),
+                  raw_indexes, 'iot_'),
+            check('weekly_average_trips window, one month',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, *SMALL_BBOX, *MONTH_WINDOW),
+                  raw_indexes, 'iot_'),
+            check('weekly_average_trips window, antimeridian',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, *ANTIMERIDIAN_BBOX, *OPEN_WINDOW),
+                  raw_indexes, 'iot_'),
+            check('weekly_average_trips rollup',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_QUERY, *SMALL_BBOX),
+                  rollup_indexes + raw_indexes, 'iot'),
+            check('weekly_average_trips rollup, antimeridian',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_QUERY, *ANTIMERIDIAN_BBOX),
+                  rollup_indexes + raw_indexes, 'iot'),
+            check('weekly_average_trips batch window',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_BATCH_WINDOW_QUERY, *BATCH_AREAS, *OPEN_WINDOW),
+                  raw_indexes + ('region_datetime_idx',), 'iot_'),
+            check('weekly_average_trips batch rollup',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_BATCH_QUERY, *BATCH_AREAS),
+                  rollup_indexes + raw_indexes + ('idx_weekly_rollup_region',), 'iot'),
+        ]
+
+        # The rollup queries are exact, same weeks and counts as the raw trips of a window covering every trip
+        for name, bbox in (('small box', SMALL_BBOX), ('antimeridian box', ANTIMERIDIAN_BBOX)):
+            rollup_rows = await conn.fetch(queries.WEEKLY_AVERAGE_TRIPS_QUERY, *bbox)
+            window_rows = await conn.fetch(queries.WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, *bbox, *OPEN_WINDOW)
+            same = [tuple(row) for row in rollup_rows] == [tuple(row) for row in window_rows]
+            print(f"{'PASS' if same else 'FAIL'} weekly_average_trips rollup vs window, {name}: "
+                  f"{len(rollup_rows)} / {len(window_rows)} weeks")
+            results.append(same)
+
+        # Both halves of the antimeridian box are searched, a point just east of -180 is found
+        await conn.execute(
+            "INSERT INTO public.iot (region, origin_coord, destination_coord, datetime, datasource, ingest_key) "
+            "VALUES ('Antimeridian', 'POINT (-179.9 0.1)', 'POINT (0 0)', '2023-03-15', 'explain_check', "
+            "md5('antimeridian')::uuid)"
+        )
+        rows = await conn.fetch(queries.WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, *ANTIMERIDIAN_BBOX, *MONTH_WINDOW)
+        found = any('Antimeridian' in (row['regions'] or '') for row in rows)
+        center = rows[0]['bounding_box_longitude'] if rows else None
+        print(f"{'PASS' if found and center == 180 else 'FAIL'} antimeridian results: found={found} center={center}")
+        results.append(found and center == 180)
+    finally:
+        await transaction.rollback()
+        await conn.close()
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+EXPLAIN checks for the time window queries of the API: seeds public.iot inside a transaction,
+asserts the plans prune partitions and use idx_iot_datetime / idx_iot_region_datetime, then rolls back.
+
+Usage: DB_HOST=localhost python explain_time_window.py [--rows 500000]
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+
+from common import SEED_QUERY, connect, explain, load_api_queries, plan_nodes
+
+DAY_WINDOW = (datetime(2023, 3, 1), datetime(2023, 3, 2))
+MONTH_WINDOW = (datetime(2023, 3, 1), datetime(2023, 4, 1))
+
+
+def check(name, plan, index_suffix):
+    nodes = plan_nodes(plan)
+    indexes = {node['Index Name'] for node in nodes if 'Index Name' in node}
+    relations = {node['Relation Name'] for node in nodes if node.get('Relation Name', '').startswith('iot_')}
+
+    uses_index = any(index.endswith(index_suffix) for index in indexes)
+    pruned = all(relation in ('iot_y2023m03', 'iot_cluster_grid') for relation in relations)
+    print(f"{'PASS' if uses_index and pruned else 'FAIL'} {name}: indexes={sorted(indexes)} relations={sorted(relations)}")
+    return uses_index and pruned
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500000, help='Trips seeded over 2022-2023')
+    args = parser.parse_args()
+
+    queries = load_api_queries()
+    conn = await connect()
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        await conn.execute("SELECT public.iot_create_partitions(TIMESTAMP '2022-01-01', 23)")
+        await conn.execute(SEED_QUERY, args.rows)
+        await conn.execute("ANALYZE public.iot")
+
+        results = [
+            check('similar_trips',
+                  await explain(conn, queries.SIMILAR_TRIPS_WINDOW_QUERY, 1000, 10, *DAY_WINDOW),
+                  'datetime_idx'),
+            check('weekly_average_trips',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, -120.0, -30.0, 50.0, 70.0, *DAY_WINDOW),
+                  'datetime_idx'),
+            check('weekly_average_trips_by_regions',
+                  await explain(conn, queries.WEEKLY_AVERAGE_TRIPS_BY_REGIONS_WINDOW_QUERY, ['Region1', 'Region2'],
+                                *MONTH_WINDOW, None),
+                  'region_datetime_idx'),
+        ]
+    finally:
+        await transaction.rollback()
+        await conn.close()
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+Compares rows/sec of the lambda write modes against a local Postgres started with bin/docker-compose.yml:
+- insert: executemany INSERT ... ON CONFLICT DO NOTHING
+- copy: COPY into iot_staging + deduplicating INSERT ... SELECT (the default)
+- copy_no_dedup: COPY straight into iot, the cost floor deduplication is measured against
+- copy_redelivery: copy of a batch that is already stored, every row conflicts
+
+Usage: DB_HOST=localhost python ingest_write_modes.py [--repeat 3]
+"""
+import argparse
+import io
+import time
+
+from common import load_lambda_module, sample_rows
+
+BATCH_SIZES = [10, 500, 10000]
+BENCHMARK_DATASOURCE = 'benchmark'
+
+
+def copy_no_dedup(app, cursor, rows):
+    cursor.execute(f"COPY iot ({app.IOT_COLUMNS}) FROM STDIN", stream=io.BytesIO(app.to_copy_text(rows)))
+
+
+def time_write(conn, write, rows):
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    write(cursor, rows)
+    conn.commit()
+    elapsed = time.perf_counter() - started
+    cursor.close()
+    return elapsed
+
+
+def cleanup(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM iot WHERE datasource = %s", (BENCHMARK_DATASOURCE,))
+    conn.commit()
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per batch size, the best one is reported')
+    args = parser.parse_args()
+
+    app = load_lambda_module()
+    conn = app.connect_to_postgres()
+    app.prepare_staging(conn, conn.cursor())
+    modes = {
+        'insert': app.insert_to_postgres,
+        'copy': app.copy_to_postgres,
+        'copy_no_dedup': lambda cursor, rows: copy_no_dedup(app, cursor, rows),
+    }
+
+    print(f"{'batch':>8} {'mode':>16} {'seconds':>10} {'rows/sec':>12}")
+    try:
+        for batch_size in BATCH_SIZES:
+            rows = sample_rows(batch_size, BENCHMARK_DATASOURCE)
+            # Partition creation is a one off cost, keep it out of the timings
+            app.ensure_partitions(conn, conn.cursor(), rows)
+
+            results = {}
+            for mode, write in modes.items():
+                timings = []
+                for _ in range(args.repeat):
+                    timings.append(time_write(conn, write, rows))
+                    cleanup(conn)
+                results[mode] = min(timings)
+
+            # Rows already stored, as on an SQS redelivery
+            time_write(conn, app.copy_to_postgres, rows)
+            results['copy_redelivery'] = min(time_write(conn, app.copy_to_postgres, rows) for _ in range(args.repeat))
+            cleanup(conn)
+
+            for mode, best in results.items():
+                print(f"{batch_size:>8} {mode:>16} {best:>10.4f} {batch_size / best:>12.0f}")
+            overhead = (results['copy'] / results['copy_no_dedup'] - 1) * 100
+            print(f"{batch_size:>8} {'dedup overhead':>16} {overhead:>9.1f}%")
+    finally:
+        cleanup(conn)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+End to end benchmark of generator -> SQS -> lambda_handler -> Postgres -> API on one box, against the local
+Postgres + PostGIS started with bin/docker-compose.yml:
+- trips synthesized by the replay model of bin/sqs_generator are sent to an in-process fake SQS queue
+- Lambda processes poll the queue like the SQS event source mapping (batch size + batching window),
+  call lambda_handler and delete the messages it didn't report in batchItemFailures
+- lag probes sent during the ingest are polled on the API until they are queryable
+- once the queue is drained, concurrent clients hit the three endpoints
+
+The JSON report (ingest rows/sec, ingest to queryable lag, API p50/p95/p99 per endpoint) is printed
+and written with --output for regression tracking. Benchmark trips are deleted afterwards unless --keep.
+
+Usage: DB_HOST=localhost python pipeline_benchmark.py [--total 100000] [--lambdas 2] [--batch-size 100]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+from urllib.parse import urlencode, urlsplit
+
+from common import API_SRC_DIR, add_sqs_generator_to_path, load_lambda_module, percentiles, simulate_writer
+
+add_sqs_generator_to_path()
+import replay  # noqa: E402
+from fake_sqs import FakeSqsClient, MAX_RECEIVE_MESSAGES  # noqa: E402
+
+QUEUE_URL = 'fake://pipeline-benchmark'
+BENCHMARK_DATASOURCE = 'pipeline_benchmark'
+# Trips synthesized at once by the producer
+GENERATION_CHUNK = 1000
+# Long polling of an idle Lambda poller
+LONG_POLL_SECONDS = 1.0
+PROBE_TIMEOUT_SECONDS = 60
+API_STARTUP_SECONDS = 30
+
+
+class QueueManager(BaseManager):
+    pass
+
+
+# One queue and one stop flag shared by the producer, the probes and every Lambda process
+QueueManager.register('FakeSqsClient', FakeSqsClient)
+QueueManager.register('Event', threading.Event)
+
+
+def produce(sqs, model, args):
+    """Send args.total replayed trips in batches of 10, at args.rate messages/sec when set."""
+    started = time.monotonic()
+    sent = 0
+    for chunk_index, offset in enumerate(range(0, args.total, GENERATION_CHUNK)):
+        trips = model.trips(min(GENERATION_CHUNK, args.total - offset), args.seed, chunk_index)
+        for i in range(0, len(trips), MAX_RECEIVE_MESSAGES):
+            batch = trips[i:i + MAX_RECEIVE_MESSAGES]
+            entries = [{'Id': str(idx), 'MessageBody': json.dumps(dict(trip, datasource=BENCHMARK_DATASOURCE))}
+                       for idx, trip in enumerate(batch)]
+            sqs.send_message_batch(QueueUrl=QUEUE_URL, Entries=entries)
+            sent += len(entries)
+            if args.rate:
+                delay = started + sent / args.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def receive_batch(sqs, batch_size, batch_window):
+    """Poll like the event source mapping: invoke once batch_size messages or batch_window after the first one."""
+    messages = []
+    window_end = None
+    while len(messages) < batch_size:
+        wait = LONG_POLL_SECONDS if not messages else max(0.0, window_end - time.monotonic())
+        response = sqs.receive_message(QueueUrl=QUEUE_URL, WaitTimeSeconds=wait,
+                                       MaxNumberOfMessages=min(MAX_RECEIVE_MESSAGES, batch_size - len(messages)))
+        received = response.get('Messages', [])
+        if received and window_end is None:
+            window_end = time.monotonic() + batch_window
+        messages.extend(received)
+        if not received and not messages:
+            break
+        if window_end is not None and time.monotonic() >= window_end:
+            break
+    return messages
+
+
+def to_lambda_event(messages):
+    return {'Records': [{
+        'messageId': message['MessageId'],
+        'receiptHandle': message['ReceiptHandle'],
+        'body': message['Body'],
+        'attributes': message['Attributes'],
+        'messageAttributes': {},
+        'eventSource': 'aws:sqs',
+        'eventSourceARN': QUEUE_URL,
+    } for message in messages]}
+
+
+def lambda_worker(sqs, producer_done, batch_size, batch_window, simulated_writer=False):
+    """Runs on its own process, as one warm Lambda container: poll, invoke, delete what was committed."""
+    # Stage timings are summed here instead of printing an EMF line per invocation
+    os.environ['METRICS_ENABLED'] = 'false'
+    app = load_lambda_module()
+    if simulated_writer:
+        simulate_writer(app)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stats = {'invocations': 0, 'messages': 0, 'failed': 0, 'last_commit': None,
+             'invocation_seconds': [], 'commit_lag_seconds': [], 'stage_seconds': {}}
+    while True:
+        messages = receive_batch(sqs, batch_size, batch_window)
+        if not messages:
+            if producer_done.is_set() and not sqs.approximate_number_of_messages():
+                return stats
+            continue
+
+        started = time.perf_counter()
+        response = app.lambda_handler(to_lambda_event(messages), None)
+        committed_at = time.time()
+        stats['invocation_seconds'].append(time.perf_counter() - started)
+        for stage, seconds in app.invocation_metrics.durations.items():
+            stats['stage_seconds'][stage] = stats['stage_seconds'].get(stage, 0.0) + seconds
+
+        failed = {failure['itemIdentifier'] for failure in response['batchItemFailures']}
+        done = [message for message in messages if message['MessageId'] not in failed]
+        for i in range(0, len(done), MAX_RECEIVE_MESSAGES):
+            sqs.delete_message_batch(QueueUrl=QUEUE_URL, Entries=[
+                {'Id': str(idx), 'ReceiptHandle': message['ReceiptHandle']}
+                for idx, message in enumerate(done[i:i + MAX_RECEIVE_MESSAGES])
+            ])
+
+        stats['invocations'] += 1
+        stats['messages'] += len(done)
+        stats['failed'] += len(failed)
+        stats['last_commit'] = committed_at
+        stats['commit_lag_seconds'].extend(
+            committed_at - int(message['Attributes']['SentTimestamp']) / 1000 for message in done)
+
+
+class ApiClient:
+    """Keep alive HTTP connection, one per client thread."""
+
+    def __init__(self, base_url, bypass_cache=False):
+        url = urlsplit(base_url)
+        self._conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        self._headers = {'X-Cache-Bypass': '1'} if bypass_cache else {}
+
+    def get(self, path, params):
+        self._conn.request('GET', f"{path}?{urlencode(params, doseq=True)}", headers=self._headers)
+        response = self._conn.getresponse()
+        return response.status, response.read()
+
+
+def probe_lag(sqs, base_url, model, stop, interval, lags, timeouts):
+    """Send a one trip marker region now and then, time until the API returns it."""
+    client = ApiClient(base_url)
+    while not stop.wait(interval):
+        marker = f"lag_probe_{uuid.uuid4().hex[:12]}"
+        trip = dict(model.trip(random.Random(marker)), region=marker, datasource=BENCHMARK_DATASOURCE)
+        sent_at = time.monotonic()
+        sqs.send_message_batch(QueueUrl=QUEUE_URL, Entries=[{'Id': '0', 'MessageBody': json.dumps(trip)}])
+        while time.monotonic() - sent_at < PROBE_TIMEOUT_SECONDS:
+            status, body = client.get('/weekly_average_trips_by_regions', {'regions': marker})
+            if status == 200 and json.loads(body).get('data'):
+                lags.append(time.monotonic() - sent_at)
+                break
+            time.sleep(0.05)
+        else:
+            timeouts.append(marker)
+
+
+def api_requests(model, count, seed):
+    """count (path, params) of each endpoint, drawn around the replayed regions."""
+    rng = random.Random(seed)
+    regions = model.regions.values
+    requests = []
+    for _ in range(count):
+        requests.append(('/similar_trips', {'radius_m': rng.choice([250, 500, 1000, 5000]), 'limit': 10}))
+
+        region = rng.choice(regions)
+        min_lon, min_lat, max_lon, max_lat = region.bbox
+        lon, lat = rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat)
+        half = rng.uniform(0.01, 0.1)
+        requests.append(('/weekly_average_trips', {'min_lon': lon - half, 'min_lat': lat - half,
+                                                   'max_lon': lon + half, 'max_lat': lat + half}))
+
+        names = [r.name for r in rng.sample(regions, rng.randint(1, len(regions)))]
+        requests.append(('/weekly_average_trips_by_regions', {'regions': names}))
+    rng.shuffle(requests)
+    return requests
+
+
+def hammer_api(base_url, requests, concurrency, bypass_cache):
+    local = threading.local()
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def call(request):
+        path, params = request
+        if not hasattr(local, 'client'):
+            local.client = ApiClient(base_url, bypass_cache)
+        started = time.perf_counter()
+        try:
+            status, body = local.client.get(path, params)
+            ok = status == 200
+        except (OSError, http.client.HTTPException):
+            local.client = ApiClient(base_url, bypass_cache)
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.setdefault(path, []).append(elapsed)
+            if not ok:
+                errors[path] = errors.get(path, 0) + 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, requests))
+    elapsed = time.monotonic() - started
+
+    return {path: {
+        'requests': len(timings),
+        'errors': errors.get(path, 0),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'latency_ms': percentiles(timings),
+    } for path, timings in sorted(latencies.items())}
+
+
+def start_api(port, workers):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=API_SRC_DIR, env=dict(os.environ, DB_HOST=os.environ.get('DB_HOST', 'localhost')))
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + API_STARTUP_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            if ApiClient(base_url).get('/pool_stats', {})[0] == 200:
+                return process, base_url
+        except OSError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"API didn't start on {base_url}")
+
+
+def cleanup():
+    # The rollups, clusters and leaderboards are kept by insert triggers only, rebuild them without the benchmark trips
+    app = load_lambda_module()
+    conn = app.connect_to_postgres()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM iot WHERE datasource = %s", (BENCHMARK_DATASOURCE,))
+    cursor.execute("SELECT public.iot_rebuild_weekly_rollup(), public.iot_rebuild_trip_clusters(), "
+                   "public.iot_rebuild_leaderboards()")
+    app.bump_data_version(conn, cursor)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--total', type=int, default=100000, help='Trips sent through the queue')
+    parser.add_argument('--rate', type=float, default=None, help='Messages per second, unlimited by default')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the replayed trips and API parameters')
+    parser.add_argument('--lambdas', type=int, default=2, help='Concurrent Lambda processes')
+    parser.add_argument('--batch-size', type=int, default=100, help='Event source mapping batch size')
+    parser.add_argument('--batch-window', type=float, default=1.0, help='Event source mapping batching window')
+    parser.add_argument('--probe-interval', type=float, default=1.0, help='Seconds between lag probes')
+    parser.add_argument('--api-url', default=None, help='Benchmark a running API instead of starting uvicorn')
+    parser.add_argument('--api-port', type=int, default=8765, help='Port of the API started by the benchmark')
+    parser.add_argument('--api-workers', type=int, default=1, help='uvicorn workers of the API')
+    parser.add_argument('--api-requests', type=int, default=1000, help='Requests per endpoint')
+    parser.add_argument('--api-concurrency', type=int, default=16, help='Concurrent API clients')
+    parser.add_argument('--bypass-cache', action='store_true', help='Send X-Cache-Bypass to measure the queries')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the benchmark trips")
+    parser.add_argument('--output', default=None, help='Also write the JSON report to this file')
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = random.randrange(2 ** 32)
+
+    model = replay.TripModel.from_csv(replay.DEFAULT_CSV, seed=args.seed)
+    api_process, base_url = (None, args.api_url) if args.api_url else start_api(args.api_port, args.api_workers)
+
+    manager = QueueManager()
+    manager.start()
+    try:
+        sqs = manager.FakeSqsClient()
+        producer_done = manager.Event()
+        probes_done = threading.Event()
+        lags, timeouts = [], []
+        prober = threading.Thread(target=probe_lag,
+                                  args=(sqs, base_url, model, probes_done, args.probe_interval, lags, timeouts))
+
+        started = time.time()
+        with ProcessPoolExecutor(max_workers=args.lambdas) as executor:
+            workers = [executor.submit(lambda_worker, sqs, producer_done, args.batch_size, args.batch_window)
+                       for _ in range(args.lambdas)]
+            prober.start()
+            produce(sqs, model, args)
+            # Probes stop with the load, the Lambdas stop once the queue is drained
+            probes_done.set()
+            prober.join()
+            producer_done.set()
+            stats = [worker.result() for worker in workers]
+
+        messages = sum(s['messages'] for s in stats)
+        last_commit = max((s['last_commit'] for s in stats if s['last_commit']), default=started)
+        elapsed = last_commit - started
+        report = {
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'api_url')},
+            'ingest': {
+                'messages': messages,
+                'failed': sum(s['failed'] for s in stats),
+                'invocations': sum(s['invocations'] for s in stats),
+                'elapsed_seconds': round(elapsed, 3),
+                'rows_per_second': round(messages / elapsed, 1) if elapsed else None,
+                'invocation_ms': percentiles([t for s in stats for t in s['invocation_seconds']]),
+                'send_to_commit_ms': percentiles([t for s in stats for t in s['commit_lag_seconds']]),
+                # Where the Lambdas spent their time, summed over every invocation
+                'stage_total_ms': {stage: round(sum(s['stage_seconds'].get(stage, 0.0) for s in stats) * 1000, 3)
+                                   for stage in stats[0]['stage_seconds']},
+            },
+            'queryable_lag_ms': dict(percentiles(lags), probes=len(lags), timeouts=len(timeouts)),
+            'api': hammer_api(base_url, api_requests(model, args.api_requests, args.seed),
+                              args.api_concurrency, args.bypass_cache),
+        }
+    finally:
+        manager.shutdown()
+        if api_process:
+            api_process.terminate()
+            api_process.wait()
+        if not args.keep:
+            cleanup()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
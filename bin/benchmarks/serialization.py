@@ -0,0 +1,65 @@
+"""
+Rows/sec of the API response encoding: one Pydantic model per row + model_dump + JSONResponse
+(previous path) versus encode_rows straight from the rows with orjson.
+
+Usage: python serialization.py [--repeat 3]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from common import add_api_src_to_path
+
+add_api_src_to_path()
+
+from fastapi.responses import JSONResponse
+from iot_company.repository.model.iot_api_model import WeeklyAverageTripsByRegions
+from iot_company.service.serialization import columns_of, encode_rows
+
+ROW_COUNTS = [1000, 10000, 100000]
+COLUMNS = columns_of(WeeklyAverageTripsByRegions)
+
+
+def sample_rows(count):
+    # Same shape as the /weekly_average_trips_by_regions rows
+    first_week = datetime(2023, 1, 2)
+    return [('Prague, Turin', first_week - timedelta(weeks=i), i % 5000) for i in range(count)]
+
+
+def pydantic_path(rows):
+    result_data = [WeeklyAverageTripsByRegions(
+        regions=row[0],
+        week_start=row[1],
+        weekly_avg_trips=row[2],
+    ).model_dump() for row in rows]
+    return JSONResponse(content={"data": result_data}).body
+
+
+def fast_path(rows):
+    return encode_rows(COLUMNS, rows)
+
+
+def best_time(encode, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per row count, the best one is reported')
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'path':>10} {'seconds':>10} {'rows/sec':>12}")
+    for count in ROW_COUNTS:
+        rows = sample_rows(count)
+        for name, encode in (('pydantic', pydantic_path), ('orjson', fast_path)):
+            elapsed = best_time(encode, rows, args.repeat)
+            print(f"{count:>8} {name:>10} {elapsed:>10.4f} {count / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Latency of the weekly average endpoints answered from the columnar snapshot versus the SQL path: seeds trips
+(committed, the snapshot loads them through its own connection), builds a snapshot in a temporary directory,
+checks that a second refresh appends nothing, then runs the same random bounding boxes and region sets with a time
+window both ways, and the boxes without a window, checking that they return the same weeks and counts. Reports the
+snapshot build time and size, and p50/p95/p99 per path as JSON.
+Seeded trips are deleted and the rollups rebuilt afterwards unless --keep.
+
+Usage: DB_HOST=localhost python snapshot_benchmark.py [--rows 1000000] [--requests 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import asyncpg
+
+from common import add_api_src_to_path, load_api_queries, percentiles
+
+add_api_src_to_path()
+
+from iot_company.service.snapshot import ColumnarSnapshot
+
+BENCHMARK_DATASOURCE = 'snapshot_benchmark'
+
+SEED_QUERY = """
+    INSERT INTO public.iot (region, origin_coord, destination_coord, datetime, datasource, ingest_key)
+    SELECT
+        'Region' || (n % 200),
+        ST_SetSRID(ST_MakePoint(random() * 360 - 180, random() * 180 - 90), 4326)::geography,
+        ST_SetSRID(ST_MakePoint(random() * 360 - 180, random() * 180 - 90), 4326)::geography,
+        TIMESTAMP '2022-01-01' + (n % 730) * INTERVAL '1 day' + (n % 24) * INTERVAL '1 hour',
+        $2,
+        md5($2 || n)::uuid
+    FROM GENERATE_SERIES(1, $1) AS n
+"""
+
+CLEANUP_QUERIES = (
+    "DELETE FROM public.iot WHERE datasource = $1",
+    "SELECT public.iot_rebuild_weekly_rollup(), public.iot_rebuild_trip_clusters(), public.iot_rebuild_leaderboards()",
+    "UPDATE public.iot_data_version SET version = version + 1, updated_at = NOW()",
+)
+
+WINDOW = (datetime(2022, 3, 1), datetime(2023, 9, 1))
+
+
+def random_bbox(rng):
+    # 1 to 20 degree boxes, some of them crossing the antimeridian
+    size = rng.uniform(1, 20)
+    min_lon = rng.uniform(-180, 180)
+    max_lon = min_lon + size if min_lon + size <= 180 else min_lon + size - 360
+    min_lat = rng.uniform(-90, 90 - size)
+    return round(min_lon, 4), round(min_lat, 4), round(max_lon, 4), round(min_lat + size, 4)
+
+
+def random_regions(rng):
+    return tuple(sorted({f'Region{rng.randrange(200)}' for _ in range(rng.randint(1, 5))}))
+
+
+def weeks_and_counts(rows, week_index, count_index):
+    return [(row[week_index], float(row[count_index])) for row in rows]
+
+
+async def timed_call(durations, call):
+    started = time.perf_counter()
+    result = await call
+    durations.append(time.perf_counter() - started)
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='Trips seeded over 2022-2023, 0 to use the table as is')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and path')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='Keep the seeded trips')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    queries = load_api_queries()
+    pool = await asyncpg.create_pool(
+        host=os.environ.get('DB_HOST', 'localhost'),
+        port=int(os.environ.get('DB_PORT', 5432)),
+        user=os.environ.get('DB_USER', 'myuser'),
+        password=os.environ.get('DB_PASSWORD', 'mypassword'),
+        database=os.environ.get('DB_NAME', 'mydatabase'),
+    )
+    directory = tempfile.mkdtemp(prefix='iot_snapshot_')
+    try:
+        if args.rows:
+            await pool.execute("SELECT public.iot_create_partitions(TIMESTAMP '2022-01-01', 23)")
+            await pool.execute(SEED_QUERY, args.rows, BENCHMARK_DATASOURCE)
+            await pool.execute("ANALYZE public.iot")
+
+        snapshot = ColumnarSnapshot(directory)
+        started = time.perf_counter()
+        await snapshot.refresh(pool)
+        build_seconds = time.perf_counter() - started
+        view = snapshot.view
+        # Trips already in the snapshot are not appended again, also on a table smaller than the id overlap
+        await snapshot.refresh(pool)
+        stable = snapshot.view.rows == view.rows
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+        rng = random.Random(args.seed)
+        durations = {'weekly_average_trips': {'sql': [], 'snapshot': []},
+                     'weekly_average_trips_no_window': {'sql': [], 'snapshot': []},
+                     'weekly_average_trips_by_regions': {'sql': [], 'snapshot': []}}
+        mismatches = 0
+        for _ in range(args.requests):
+            bbox = random_bbox(rng)
+            sql_rows = await timed_call(durations['weekly_average_trips']['sql'],
+                                        pool.fetch(queries.WEEKLY_AVERAGE_TRIPS_WINDOW_QUERY, *bbox, *WINDOW))
+            snapshot_rows = await timed_call(durations['weekly_average_trips']['snapshot'],
+                                             view.weekly_average_trips(bbox, WINDOW))
+            # float32 coordinates may move a trip lying on the border of a box
+            mismatches += weeks_and_counts(sql_rows, 3, 4) != weeks_and_counts(snapshot_rows, 3, 4)
+
+            sql_rows = await timed_call(durations['weekly_average_trips_no_window']['sql'],
+                                        pool.fetch(queries.WEEKLY_AVERAGE_TRIPS_QUERY, *bbox))
+            snapshot_rows = await timed_call(durations['weekly_average_trips_no_window']['snapshot'],
+                                             view.weekly_average_trips(bbox, None))
+            mismatches += weeks_and_counts(sql_rows, 3, 4) != weeks_and_counts(snapshot_rows, 3, 4)
+
+            regions = random_regions(rng)
+            sql_rows = await timed_call(durations['weekly_average_trips_by_regions']['sql'],
+                                        pool.fetch(queries.WEEKLY_AVERAGE_TRIPS_BY_REGIONS_WINDOW_QUERY,
+                                                   list(regions), *WINDOW, None))
+            snapshot_rows = await timed_call(durations['weekly_average_trips_by_regions']['snapshot'],
+                                             view.weekly_average_trips_by_regions(regions, WINDOW, None, None))
+            mismatches += weeks_and_counts(sql_rows, 1, 2) != weeks_and_counts(snapshot_rows, 1, 2)
+
+        report = {
+            'rows': view.rows,
+            'rows_after_second_refresh': snapshot.view.rows,
+            'snapshot_build_seconds': round(build_seconds, 3),
+            'snapshot_bytes': size,
+            'requests': args.requests,
+            'mismatches': mismatches,
+            'latency_ms': {endpoint: {path: percentiles(seconds) for path, seconds in paths.items()}
+                           for endpoint, paths in durations.items()},
+        }
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(report, output, indent=2)
+        await snapshot.stop()
+        if not stable:
+            raise SystemExit(f"Second refresh appended {snapshot.view.rows - view.rows} rows")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        if args.rows and not args.keep:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(CLEANUP_QUERIES[0], BENCHMARK_DATASOURCE)
+                    for query in CLEANUP_QUERIES[1:]:
+                        await conn.execute(query)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
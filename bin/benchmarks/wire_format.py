@@ -0,0 +1,76 @@
+"""
+Size and speed of the SQS message formats on replayed trips: JSON bodies with WKT points (one trip per message)
+versus compact bodies (struct packed trips, base64, several trips per message). Reports bytes per trip, the
+messages needed for the run, encode trips/sec on the generator side and decode_records trips/sec on the
+Lambda side. No database or SQS needed.
+
+Usage: python wire_format.py [--trips 100000] [--repeat 3]
+"""
+import argparse
+import json
+import time
+
+from common import add_sqs_generator_to_path
+
+add_sqs_generator_to_path()
+
+import replay
+from iot_company.repository.model import compact_codec, iot_model
+
+TRIPS_PER_MESSAGE = [1, 10, 100, 1000, 100000]
+
+
+def json_bodies(trips):
+    return [json.dumps({
+        "region": region,
+        "origin_coord": replay.format_point(origin_lon, origin_lat),
+        "destination_coord": replay.format_point(destination_lon, destination_lat),
+        "datetime": trip_datetime.isoformat(),
+        "datasource": datasource,
+    }) for region, origin_lon, origin_lat, destination_lon, destination_lat, trip_datetime, datasource in trips]
+
+
+def as_records(bodies):
+    return [{'messageId': str(index), 'body': body} for index, body in enumerate(bodies)]
+
+
+def best_time(function, argument, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(argument)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trips', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per path, the best one is reported')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    model = replay.TripModel.from_csv(replay.DEFAULT_CSV, seed=args.seed, hotspots=replay.HOTSPOTS_PER_REGION,
+                                      hotspot_share=replay.HOTSPOT_SHARE, hotspot_skew=replay.HOTSPOT_SKEW,
+                                      hotspot_radius_m=replay.HOTSPOT_RADIUS_M, start_date=None, end_date=None)
+    trips = model.trips(args.trips, args.seed, values=True)
+
+    formats = [('json', json_bodies)] + [
+        (f'compact/{count}', lambda values, count=count: compact_codec.encode_messages(values, count))
+        for count in TRIPS_PER_MESSAGE
+    ]
+    print(f"JSON library: {iot_model.loads.__module__}")
+    print(f"{'format':>16} {'bytes/trip':>11} {'messages':>9} {'encode trips/s':>15} {'decode trips/s':>15}")
+    for name, encode in formats:
+        encode_seconds, bodies = best_time(encode, trips, args.repeat)
+        records = as_records(bodies)
+        decode_seconds, batch = best_time(iot_model.decode_records, records, args.repeat)
+        if batch.failures or len(batch.rows) != args.trips:
+            raise SystemExit(f"{name}: decoded {len(batch.rows)} trips, {len(batch.failures)} failures")
+        size = sum(len(body) for body in bodies)
+        print(f"{name:>16} {size / args.trips:>11.1f} {len(bodies):>9} {args.trips / encode_seconds:>15.0f} "
+              f"{args.trips / decode_seconds:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -74,7 +74,8 @@ case "$1" in
              --function-name my-lambda \
              --event-source-arn arn:aws:sqs:us-west-2:000000000000:my-queue \
              --batch-size 500 \
-             --maximum-batching-window-in-seconds 1
+             --maximum-batching-window-in-seconds 1 \
+             --function-response-types ReportBatchItemFailures
 
         rm "$CURRENT_DIR/lambda_function.zip"
         rm -rf "$CURRENT_DIR/src"
@@ -1,13 +1,391 @@
 -- init.sql
 CREATE EXTENSION IF NOT EXISTS postgis;
 DROP TABLE IF EXISTS public.iot;
+-- Range partitioned by month of datetime so time filtered queries and vacuum only touch the relevant months
 CREATE TABLE IF NOT EXISTS  public.iot (
-    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    id BIGINT GENERATED ALWAYS AS IDENTITY,
     region VARCHAR(255),
     origin_coord GEOGRAPHY(Point, 4326),
     destination_coord GEOGRAPHY(Point, 4326),
-    datetime TIMESTAMP,
-    datasource VARCHAR(255)
-);
+    datetime TIMESTAMP NOT NULL,
+    datasource VARCHAR(255),
+    ingest_key UUID NOT NULL, -- md5 of the trip content, makes at least once delivery idempotent
+    -- Planar copies of the coordinates, lon/lat bounding boxes are matched on them through their own GiST indexes
+    -- (casting the geography inside the predicate can't use an index)
+    origin_geom GEOMETRY(Point, 4326) GENERATED ALWAYS AS (origin_coord::geometry) STORED,
+    destination_geom GEOMETRY(Point, 4326) GENERATED ALWAYS AS (destination_coord::geometry) STORED,
+    PRIMARY KEY (id, datetime)
+) PARTITION BY RANGE (datetime);
 CREATE INDEX IF NOT EXISTS idx_origin_coord ON public.iot USING GIST(origin_coord);
 CREATE INDEX IF NOT EXISTS idx_destination_coord ON public.iot USING GIST(destination_coord);
+CREATE INDEX IF NOT EXISTS idx_iot_origin_geom ON public.iot USING GIST(origin_geom);
+CREATE INDEX IF NOT EXISTS idx_iot_destination_geom ON public.iot USING GIST(destination_geom);
+-- Deduplication, writers insert with ON CONFLICT (ingest_key, datetime) DO NOTHING.
+-- Partitioned unique indexes must contain the partition key, the same trip always has the same datetime.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_iot_ingest_key ON public.iot (ingest_key, datetime);
+-- Time window filters, the region one also serves the region endpoint with a window
+CREATE INDEX IF NOT EXISTS idx_iot_datetime ON public.iot (datetime);
+CREATE INDEX IF NOT EXISTS idx_iot_region_datetime ON public.iot (region, datetime);
+
+-- Safety net for rows whose month partition was not created, the ingest creates partitions before writing
+CREATE TABLE IF NOT EXISTS public.iot_default PARTITION OF public.iot DEFAULT;
+
+-- Creates the partition holding the month of month_of (iot_yYYYYmMM) when missing and returns its name
+CREATE OR REPLACE FUNCTION public.iot_create_partition(month_of TIMESTAMP)
+RETURNS TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    month_start TIMESTAMP := DATE_TRUNC('month', month_of);
+    partition_name TEXT := 'iot_y' || TO_CHAR(month_start, 'YYYY') || 'm' || TO_CHAR(month_start, 'MM');
+BEGIN
+    IF to_regclass('public.' || partition_name) IS NULL THEN
+        -- Serialize concurrent writers asking for the same partition
+        PERFORM pg_advisory_xact_lock(hashtext('public.iot_create_partition'));
+        EXECUTE FORMAT(
+            'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.iot FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, month_start + INTERVAL '1 month'
+        );
+    END IF;
+    RETURN partition_name;
+END
+$$;
+
+-- Creates the partitions from the month of from_month up to months_ahead months later
+CREATE OR REPLACE FUNCTION public.iot_create_partitions(from_month TIMESTAMP, months_ahead INTEGER)
+RETURNS SETOF TEXT LANGUAGE sql AS $$
+    SELECT public.iot_create_partition(from_month + MAKE_INTERVAL(months => month_offset))
+    FROM GENERATE_SERIES(0, months_ahead) AS month_offset;
+$$;
+
+-- Retention: detaches (and optionally drops) the monthly partitions entirely older than cutoff.
+-- Their trips are subtracted from the weekly rollup, whose bounding box answers add the raw trips of the cells on
+-- the box edges: a detached month must leave both. Cluster and leaderboard tables keep their counts.
+-- The API answers read the raw trips and the rollup, so the data version is bumped for their cached responses to go stale.
+CREATE OR REPLACE FUNCTION public.iot_detach_partitions_older_than(cutoff TIMESTAMP, drop_detached BOOLEAN DEFAULT FALSE)
+RETURNS SETOF TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.oid = 'public.iot'::regclass
+          AND child.relname ~ '^iot_y[0-9]{4}m[0-9]{2}$'
+          AND TO_TIMESTAMP(SUBSTRING(child.relname FROM 6), 'YYYY"m"MM')::TIMESTAMP + INTERVAL '1 month' <= cutoff
+        ORDER BY child.relname
+    LOOP
+        EXECUTE FORMAT('ALTER TABLE public.iot DETACH PARTITION public.%I', partition_name);
+        -- Counted once detached, no insert can reach the partition anymore
+        EXECUTE FORMAT(
+            'UPDATE public.iot_weekly_rollup AS rollup
+             SET trip_count = rollup.trip_count - detached.trip_count
+             FROM (
+                 SELECT
+                     DATE_TRUNC(''week'', iot.datetime) AS week_start,
+                     COALESCE(iot.region, '''') AS region,
+                     public.iot_grid_index(ST_X(iot.origin_coord::geometry), public.iot_rollup_cell_size_m()) AS origin_cell_x,
+                     public.iot_grid_index(ST_Y(iot.origin_coord::geometry), public.iot_rollup_cell_size_m()) AS origin_cell_y,
+                     public.iot_grid_index(ST_X(iot.destination_coord::geometry), public.iot_rollup_cell_size_m()) AS destination_cell_x,
+                     public.iot_grid_index(ST_Y(iot.destination_coord::geometry), public.iot_rollup_cell_size_m()) AS destination_cell_y,
+                     COUNT(*) AS trip_count
+                 FROM public.%I iot
+                 WHERE
+                     iot.origin_coord IS NOT NULL
+                     AND iot.destination_coord IS NOT NULL
+                     AND iot.datetime IS NOT NULL
+                 GROUP BY 1, 2, 3, 4, 5, 6
+             ) AS detached
+             WHERE rollup.week_start = detached.week_start
+               AND rollup.region = detached.region
+               AND rollup.origin_cell_x = detached.origin_cell_x
+               AND rollup.origin_cell_y = detached.origin_cell_y
+               AND rollup.destination_cell_x = detached.destination_cell_x
+               AND rollup.destination_cell_y = detached.destination_cell_y',
+            partition_name
+        );
+        DELETE FROM public.iot_weekly_rollup WHERE trip_count <= 0;
+        IF drop_detached THEN
+            EXECUTE FORMAT('DROP TABLE public.%I', partition_name);
+        END IF;
+        RETURN NEXT partition_name;
+    END LOOP;
+    -- FOUND is true when the loop detached at least one partition
+    IF FOUND THEN
+        UPDATE public.iot_data_version SET version = version + 1, updated_at = NOW();
+    END IF;
+END
+$$;
+
+SELECT public.iot_create_partitions(DATE_TRUNC('month', NOW())::TIMESTAMP, 3);
+
+-- Similar trips clustering
+-- Every trip is bucketed by region, hour of day and the grid cells of its origin and destination,
+-- so similar trips become a grouped count over indexed keys instead of a self join on ST_DWithin.
+-- Cells are square in degrees (~111,320 meters per degree) like a geohash, one set per configured cell size.
+DROP TABLE IF EXISTS public.iot_trip_cluster;
+DROP TABLE IF EXISTS public.iot_cluster_grid;
+CREATE TABLE IF NOT EXISTS public.iot_cluster_grid (
+    cell_size_m INTEGER PRIMARY KEY CHECK (cell_size_m > 0)
+);
+INSERT INTO public.iot_cluster_grid (cell_size_m) VALUES (250), (500), (1000), (5000) ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS public.iot_trip_cluster (
+    cell_size_m INTEGER NOT NULL,
+    region VARCHAR(255) NOT NULL,
+    hour_of_day SMALLINT NOT NULL,
+    origin_cell_x INTEGER NOT NULL,
+    origin_cell_y INTEGER NOT NULL,
+    destination_cell_x INTEGER NOT NULL,
+    destination_cell_y INTEGER NOT NULL,
+    trip_count BIGINT NOT NULL,
+    PRIMARY KEY (cell_size_m, region, hour_of_day, origin_cell_x, origin_cell_y, destination_cell_x, destination_cell_y)
+);
+CREATE INDEX IF NOT EXISTS idx_trip_cluster_count ON public.iot_trip_cluster (cell_size_m, trip_count DESC);
+
+CREATE OR REPLACE FUNCTION public.iot_grid_index(coord DOUBLE PRECISION, cell_size_m INTEGER)
+RETURNS INTEGER LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT floor(coord / (cell_size_m / 111320.0))::INTEGER
+$$;
+
+-- Adds the trips of an insert statement to every grid, locks are taken in key order to avoid deadlocks between writers
+CREATE OR REPLACE FUNCTION public.iot_trip_cluster_after_insert()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO public.iot_trip_cluster AS cluster
+    SELECT
+        grid.cell_size_m,
+        COALESCE(new_rows.region, ''),
+        EXTRACT(HOUR FROM new_rows.datetime)::SMALLINT,
+        public.iot_grid_index(ST_X(new_rows.origin_coord::geometry), grid.cell_size_m),
+        public.iot_grid_index(ST_Y(new_rows.origin_coord::geometry), grid.cell_size_m),
+        public.iot_grid_index(ST_X(new_rows.destination_coord::geometry), grid.cell_size_m),
+        public.iot_grid_index(ST_Y(new_rows.destination_coord::geometry), grid.cell_size_m),
+        COUNT(*)
+    FROM
+        new_rows
+    CROSS JOIN
+        public.iot_cluster_grid grid
+    WHERE
+        new_rows.origin_coord IS NOT NULL
+        AND new_rows.destination_coord IS NOT NULL
+        AND new_rows.datetime IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+    ORDER BY 1, 2, 3, 4, 5, 6, 7
+    ON CONFLICT (cell_size_m, region, hour_of_day, origin_cell_x, origin_cell_y, destination_cell_x, destination_cell_y)
+    DO UPDATE SET trip_count = cluster.trip_count + EXCLUDED.trip_count;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER iot_trip_cluster_after_insert
+    AFTER INSERT ON public.iot
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.iot_trip_cluster_after_insert();
+
+-- Recomputes every grid from public.iot, run it after adding a row to iot_cluster_grid
+CREATE OR REPLACE FUNCTION public.iot_rebuild_trip_clusters()
+RETURNS VOID LANGUAGE sql AS $$
+    TRUNCATE public.iot_trip_cluster;
+    INSERT INTO public.iot_trip_cluster
+    SELECT
+        grid.cell_size_m,
+        COALESCE(iot.region, ''),
+        EXTRACT(HOUR FROM iot.datetime)::SMALLINT,
+        public.iot_grid_index(ST_X(iot.origin_coord::geometry), grid.cell_size_m),
+        public.iot_grid_index(ST_Y(iot.origin_coord::geometry), grid.cell_size_m),
+        public.iot_grid_index(ST_X(iot.destination_coord::geometry), grid.cell_size_m),
+        public.iot_grid_index(ST_Y(iot.destination_coord::geometry), grid.cell_size_m),
+        COUNT(*)
+    FROM
+        public.iot iot
+    CROSS JOIN
+        public.iot_cluster_grid grid
+    WHERE
+        iot.origin_coord IS NOT NULL
+        AND iot.destination_coord IS NOT NULL
+        AND iot.datetime IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5, 6, 7;
+$$;
+
+-- Weekly rollup behind the weekly average endpoints
+-- One row per week, region, origin cell and destination cell, maintained by the inserts on public.iot,
+-- so weekly averages read a few thousand pre-aggregated rows instead of scanning the raw trips.
+DROP TABLE IF EXISTS public.iot_weekly_rollup;
+CREATE TABLE IF NOT EXISTS public.iot_weekly_rollup (
+    week_start TIMESTAMP NOT NULL,
+    region VARCHAR(255) NOT NULL,
+    origin_cell_x INTEGER NOT NULL,
+    origin_cell_y INTEGER NOT NULL,
+    destination_cell_x INTEGER NOT NULL,
+    destination_cell_y INTEGER NOT NULL,
+    trip_count BIGINT NOT NULL,
+    PRIMARY KEY (week_start, region, origin_cell_x, origin_cell_y, destination_cell_x, destination_cell_y)
+);
+CREATE INDEX IF NOT EXISTS idx_weekly_rollup_region ON public.iot_weekly_rollup (region, week_start);
+-- Bounding box lookups, origin and destination cells are searched separately
+CREATE INDEX IF NOT EXISTS idx_weekly_rollup_origin_cell ON public.iot_weekly_rollup (origin_cell_x, origin_cell_y);
+CREATE INDEX IF NOT EXISTS idx_weekly_rollup_destination_cell ON public.iot_weekly_rollup (destination_cell_x, destination_cell_y);
+
+-- Cell size of the weekly rollup (~10km), cells fully inside a bounding box are read from the rollup, trips of the
+-- cells on its edges from public.iot
+CREATE OR REPLACE FUNCTION public.iot_rollup_cell_size_m()
+RETURNS INTEGER LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT 10000
+$$;
+
+CREATE OR REPLACE FUNCTION public.iot_weekly_rollup_after_insert()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO public.iot_weekly_rollup AS rollup
+    SELECT
+        DATE_TRUNC('week', new_rows.datetime),
+        COALESCE(new_rows.region, ''),
+        public.iot_grid_index(ST_X(new_rows.origin_coord::geometry), public.iot_rollup_cell_size_m()),
+        public.iot_grid_index(ST_Y(new_rows.origin_coord::geometry), public.iot_rollup_cell_size_m()),
+        public.iot_grid_index(ST_X(new_rows.destination_coord::geometry), public.iot_rollup_cell_size_m()),
+        public.iot_grid_index(ST_Y(new_rows.destination_coord::geometry), public.iot_rollup_cell_size_m()),
+        COUNT(*)
+    FROM
+        new_rows
+    WHERE
+        new_rows.origin_coord IS NOT NULL
+        AND new_rows.destination_coord IS NOT NULL
+        AND new_rows.datetime IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5, 6
+    ORDER BY 1, 2, 3, 4, 5, 6
+    ON CONFLICT (week_start, region, origin_cell_x, origin_cell_y, destination_cell_x, destination_cell_y)
+    DO UPDATE SET trip_count = rollup.trip_count + EXCLUDED.trip_count;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER iot_weekly_rollup_after_insert
+    AFTER INSERT ON public.iot
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.iot_weekly_rollup_after_insert();
+
+-- Recomputes the rollup from public.iot
+CREATE OR REPLACE FUNCTION public.iot_rebuild_weekly_rollup()
+RETURNS VOID LANGUAGE sql AS $$
+    TRUNCATE public.iot_weekly_rollup;
+    INSERT INTO public.iot_weekly_rollup
+    SELECT
+        DATE_TRUNC('week', iot.datetime),
+        COALESCE(iot.region, ''),
+        public.iot_grid_index(ST_X(iot.origin_coord::geometry), public.iot_rollup_cell_size_m()),
+        public.iot_grid_index(ST_Y(iot.origin_coord::geometry), public.iot_rollup_cell_size_m()),
+        public.iot_grid_index(ST_X(iot.destination_coord::geometry), public.iot_rollup_cell_size_m()),
+        public.iot_grid_index(ST_Y(iot.destination_coord::geometry), public.iot_rollup_cell_size_m()),
+        COUNT(*)
+    FROM
+        public.iot iot
+    WHERE
+        iot.origin_coord IS NOT NULL
+        AND iot.destination_coord IS NOT NULL
+        AND iot.datetime IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5, 6;
+$$;
+
+-- Leaderboards: trips per region with its latest datasource, and the regions each datasource appeared in.
+-- Kept by the insert trigger in the transaction of the write, so the top regions and datasource questions
+-- read a handful of rows instead of scanning and sorting public.iot.
+DROP TABLE IF EXISTS public.iot_region_stats;
+CREATE TABLE IF NOT EXISTS public.iot_region_stats (
+    region VARCHAR(255) PRIMARY KEY,
+    trip_count BIGINT NOT NULL,
+    latest_datetime TIMESTAMP,
+    latest_datasource VARCHAR(255)
+);
+CREATE INDEX IF NOT EXISTS idx_region_stats_count ON public.iot_region_stats (trip_count DESC, region);
+
+DROP TABLE IF EXISTS public.iot_datasource_region;
+CREATE TABLE IF NOT EXISTS public.iot_datasource_region (
+    datasource VARCHAR(255) NOT NULL,
+    region VARCHAR(255) NOT NULL,
+    trip_count BIGINT NOT NULL,
+    PRIMARY KEY (datasource, region)
+);
+
+-- Few and hot rows, every writer locks them in key order to avoid deadlocks
+CREATE OR REPLACE FUNCTION public.iot_leaderboards_after_insert()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO public.iot_region_stats AS stats
+    SELECT
+        COALESCE(new_rows.region, ''),
+        COUNT(*),
+        MAX(new_rows.datetime),
+        (ARRAY_AGG(new_rows.datasource ORDER BY new_rows.datetime DESC NULLS LAST))[1]
+    FROM
+        new_rows
+    GROUP BY 1
+    ORDER BY 1
+    ON CONFLICT (region) DO UPDATE SET
+        trip_count = stats.trip_count + EXCLUDED.trip_count,
+        latest_datasource = CASE WHEN stats.latest_datetime IS NULL OR EXCLUDED.latest_datetime >= stats.latest_datetime
+                                 THEN EXCLUDED.latest_datasource ELSE stats.latest_datasource END,
+        latest_datetime = GREATEST(stats.latest_datetime, EXCLUDED.latest_datetime);
+
+    INSERT INTO public.iot_datasource_region AS datasource_region
+    SELECT
+        COALESCE(new_rows.datasource, ''),
+        COALESCE(new_rows.region, ''),
+        COUNT(*)
+    FROM
+        new_rows
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (datasource, region)
+    DO UPDATE SET trip_count = datasource_region.trip_count + EXCLUDED.trip_count;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER iot_leaderboards_after_insert
+    AFTER INSERT ON public.iot
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.iot_leaderboards_after_insert();
+
+-- Recomputes both leaderboards from public.iot
+CREATE OR REPLACE FUNCTION public.iot_rebuild_leaderboards()
+RETURNS VOID LANGUAGE sql AS $$
+    TRUNCATE public.iot_region_stats, public.iot_datasource_region;
+    INSERT INTO public.iot_region_stats
+    SELECT
+        COALESCE(iot.region, ''),
+        COUNT(*),
+        MAX(iot.datetime),
+        (ARRAY_AGG(iot.datasource ORDER BY iot.datetime DESC NULLS LAST))[1]
+    FROM
+        public.iot iot
+    GROUP BY 1;
+    INSERT INTO public.iot_datasource_region
+    SELECT
+        COALESCE(iot.datasource, ''),
+        COALESCE(iot.region, ''),
+        COUNT(*)
+    FROM
+        public.iot iot
+    GROUP BY 1, 2;
+$$;
+
+-- Data version stamp, bumped by the ingest after every committed batch and by the retention detaching partitions.
+-- The API keys its response cache on it so entries only go stale when new trips land.
+DROP TABLE IF EXISTS public.iot_data_version;
+CREATE TABLE IF NOT EXISTS public.iot_data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id), -- Single row table
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+INSERT INTO public.iot_data_version (id, version, updated_at) VALUES (TRUE, 0, NOW()) ON CONFLICT DO NOTHING;
+
+-- Poison messages the ingest could not decode, kept with the failure reason instead of being redelivered
+DROP TABLE IF EXISTS public.iot_dead_letter;
+CREATE TABLE IF NOT EXISTS public.iot_dead_letter (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    message_id VARCHAR(255),
+    body TEXT,
+    reason TEXT,
+    failed_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,227 @@
+"""
+Bulk loads a CSV in the trips.csv schema into public.iot without going through SQS.
+
+The file is cut into byte ranges ending on line boundaries, each range is parsed, validated and
+COPYed by a worker process over its own connection, then moved into iot with the same deduplicating
+INSERT ... SELECT the Lambda uses, one transaction per range. Finished ranges are recorded in a
+checkpoint file, a rerun with the same arguments skips them (and a range loaded twice only adds
+duplicates that ON CONFLICT skips).
+
+Quoted fields must not span lines, which is the case of the trips.csv schema.
+
+Usage: python load_csv.py trips.csv [--workers 4] [--chunk-mb 32] [--checkpoint trips.csv.checkpoint.json]
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from psycopg2 import connect
+
+# The loader validates, keys and stages trips with the Lambda code, so both paths store the same rows
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app', 'src'))
+from app import (CREATE_STAGING_QUERY, IOT_COLUMNS, ON_CONFLICT_CLAUSE, bump_data_version,  # noqa: E402
+                 ensure_partitions, to_copy_text)
+from iot_company.repository.model.iot_model import decode_row  # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retrieve PostgreSQL connection parameters from environment variables
+db_host = os.environ.get('DB_HOST', 'localhost')
+db_port = os.environ.get('DB_PORT', 5432)
+db_name = os.environ.get('DB_NAME', 'mydatabase')
+db_user = os.environ.get('DB_USER', 'myuser')
+db_password = os.environ.get('DB_PASSWORD', 'mypassword')
+
+CSV_COLUMNS = ('region', 'origin_coord', 'destination_coord', 'datetime', 'datasource')
+
+# Same staging table and deduplicating move as the Lambda COPY path
+COPY_QUERY = f"COPY iot_staging ({IOT_COLUMNS}) FROM STDIN"
+MOVE_QUERY = (
+    f"INSERT INTO iot ({IOT_COLUMNS}) "
+    f"SELECT region, origin_coord::geography, destination_coord::geography, datetime, datasource, ingest_key "
+    f"FROM iot_staging {ON_CONFLICT_CLAUSE}"
+)
+
+# Rejected rows kept per chunk for the rejects file, the rest are only counted
+MAX_REJECTS_PER_CHUNK = 1000
+
+
+def connect_to_postgres():
+    return connect(host=db_host, port=db_port, user=db_user, password=db_password, database=db_name)
+
+
+def read_header(path):
+    """Positions of the trips.csv columns in the file header and the offset of the first data line."""
+    with open(path, 'rb') as f:
+        header_line = f.readline()
+        header = next(csv.reader([header_line.decode('utf-8-sig')]))
+        missing = [column for column in CSV_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"{path} is missing the columns {missing}")
+        return [header.index(column) for column in CSV_COLUMNS], f.tell()
+
+
+def chunk_ranges(path, start, chunk_bytes):
+    """(offset, length) byte ranges of about chunk_bytes covering the file from start, cut after a newline."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        offset = start
+        while offset < size:
+            f.seek(min(offset + chunk_bytes, size))
+            # Finish the line the cut fell on
+            f.readline()
+            end = min(f.tell(), size)
+            yield offset, end - offset
+            offset = end
+
+
+class Checkpoint:
+    """Ranges already loaded, saved after every range so an interrupted load resumes where it stopped."""
+
+    def __init__(self, path, source, chunk_bytes):
+        self.path = path
+        # Offsets only mean something for the same file cut the same way
+        self.source = {'csv': os.path.abspath(source), 'size': os.path.getsize(source), 'chunk_bytes': chunk_bytes}
+        self.completed = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            saved = json.load(f)
+        if saved['source'] != self.source:
+            raise ValueError(f"{self.path} belongs to another file or chunk size, use --restart to ignore it")
+        self.completed = {int(offset): stats for offset, stats in saved['completed'].items()}
+
+    def done(self, offset, stats):
+        self.completed[offset] = stats
+        # Written aside and renamed so a crash never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'source': self.source, 'completed': self.completed}, f)
+        os.replace(tmp_path, self.path)
+
+    def totals(self):
+        return {key: sum(stats[key] for stats in self.completed.values()) for key in ('rows', 'inserted', 'rejected')}
+
+
+# Connection of each worker process
+worker_conn = None
+
+
+def init_worker():
+    global worker_conn
+    worker_conn = connect_to_postgres()
+    cursor = worker_conn.cursor()
+    cursor.execute(CREATE_STAGING_QUERY)
+    worker_conn.commit()
+    cursor.close()
+
+
+def load_chunk(path, offset, length, columns):
+    """Runs on a worker process: parse, validate and load one byte range in one transaction."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        text = f.read(length).decode('utf-8')
+
+    rows = []
+    rejects = []
+    read = 0
+    for values in csv.reader(io.StringIO(text)):
+        if not values:
+            continue
+        read += 1
+        try:
+            rows.append(decode_row(*(values[i] for i in columns)))
+        except (ValueError, TypeError, IndexError) as e:
+            if len(rejects) < MAX_REJECTS_PER_CHUNK:
+                rejects.append(values + [str(e)])
+
+    cursor = worker_conn.cursor()
+    try:
+        ensure_partitions(worker_conn, cursor, rows)
+        cursor.copy_expert(COPY_QUERY, io.BytesIO(to_copy_text(rows)))
+        cursor.execute(MOVE_QUERY)
+        inserted = cursor.rowcount
+        worker_conn.commit()
+    except Exception:
+        worker_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return offset, {'rows': read, 'inserted': inserted, 'rejected': read - len(rows)}, rejects
+
+
+def load(args):
+    columns, data_start = read_header(args.csv)
+    chunk_bytes = int(args.chunk_mb * 1024 * 1024)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.csv}.checkpoint.json", args.csv, chunk_bytes)
+    if not args.restart:
+        checkpoint.load()
+    if checkpoint.completed:
+        logger.info(f"Resuming, {len(checkpoint.completed)} chunks already loaded")
+
+    rejects_file = open(args.rejects, 'a', newline='') if args.rejects else None
+    rejects_writer = csv.writer(rejects_file) if rejects_file else None
+    conn = connect_to_postgres()
+    cursor = conn.cursor()
+    started = time.monotonic()
+    loaded_rows = 0
+    try:
+        ranges = (r for r in chunk_ranges(args.csv, data_start, chunk_bytes) if r[0] not in checkpoint.completed)
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+            pending = deque()
+            while True:
+                # Keep every worker busy with one chunk queued behind, never the whole file in memory
+                for offset, length in ranges:
+                    pending.append(executor.submit(load_chunk, args.csv, offset, length, columns))
+                    if len(pending) >= args.workers * 2:
+                        break
+                if not pending:
+                    break
+
+                offset, stats, rejects = pending.popleft().result()
+                checkpoint.done(offset, stats)
+                if rejects_writer:
+                    rejects_writer.writerows(rejects)
+                # Readers see the new trips chunk after chunk, not only at the end
+                bump_data_version(conn, cursor)
+
+                loaded_rows += stats['rows']
+                elapsed = time.monotonic() - started
+                logger.info(f"Chunk at byte {offset}: {stats}, {loaded_rows / elapsed:.0f} rows/sec")
+    finally:
+        cursor.close()
+        conn.close()
+        if rejects_file:
+            rejects_file.close()
+
+    elapsed = time.monotonic() - started
+    result = dict(checkpoint.totals(), elapsed_seconds=round(elapsed, 3),
+                  rows_per_second=round(loaded_rows / elapsed, 1) if elapsed else 0.0)
+    logger.info(f"Load finished: {json.dumps(result)}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv', help='CSV file with the trips.csv columns')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Parallel COPY workers')
+    parser.add_argument('--chunk-mb', type=float, default=32, help='Size of the byte range each worker loads at once')
+    parser.add_argument('--checkpoint', default=None, help='Progress file, <csv>.checkpoint.json by default')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and load the whole file')
+    parser.add_argument('--rejects', default=None, help='Append the invalid rows and why to this CSV')
+    load(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
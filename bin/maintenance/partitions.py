@@ -0,0 +1,57 @@
+"""
+Partition maintenance for public.iot, meant to run daily (cron, EventBridge, ...).
+Creates the upcoming monthly partitions and applies the retention policy.
+
+Usage: python partitions.py [--months-ahead 3] [--retention-months 24] [--drop]
+"""
+import argparse
+import logging
+import os
+
+from psycopg2 import connect
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retrieve PostgreSQL connection parameters from environment variables
+db_host = os.environ.get('DB_HOST', 'localhost')
+db_port = os.environ.get('DB_PORT', 5432)
+db_name = os.environ.get('DB_NAME', 'mydatabase')
+db_user = os.environ.get('DB_USER', 'myuser')
+db_password = os.environ.get('DB_PASSWORD', 'mypassword')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--months-ahead', type=int, default=3, help='Partitions created after the current month')
+    parser.add_argument('--retention-months', type=int, default=None,
+                        help='Detach partitions older than this many months, retention is off when missing')
+    parser.add_argument('--drop', action='store_true', help='Drop the detached partitions instead of keeping them')
+    args = parser.parse_args()
+
+    conn = connect(host=db_host, port=db_port, user=db_user, password=db_password, database=db_name)
+    try:
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT public.iot_create_partitions(DATE_TRUNC('month', NOW())::TIMESTAMP, %s)",
+            (args.months_ahead,)
+        )
+        logger.info(f"Partitions ready: {[row[0] for row in cursor.fetchall()]}")
+
+        if args.retention_months is not None:
+            cursor.execute(
+                "SELECT public.iot_detach_partitions_older_than("
+                "DATE_TRUNC('month', NOW())::TIMESTAMP - MAKE_INTERVAL(months => %s), %s)",
+                (args.retention_months, args.drop)
+            )
+            logger.info(f"Partitions detached: {[row[0] for row in cursor.fetchall()]}")
+
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
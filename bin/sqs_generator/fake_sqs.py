@@ -0,0 +1,110 @@
+import threading
+import time
+import uuid
+from collections import deque
+
+# Same limit as SQS for receive_message
+MAX_RECEIVE_MESSAGES = 10
+
+
+class FakeSqsClient:
+    """
+    In-process stand-in for the SQS client calls the pipeline uses, so load tests can run
+    without localstack. One instance is one queue, share it between threads.
+    Received messages stay in flight until deleted and come back once their visibility timeout expires.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, visibility_timeout: float = 30.0):
+        # Simulated round trip of every call
+        self.latency_seconds = latency_seconds
+        self.visibility_timeout = visibility_timeout
+        self._messages = deque()
+        # receipt handle -> message, and (deadline, receipt handle) in receive order
+        self._in_flight = {}
+        self._deadlines = deque()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self.sent_count = 0
+        self.deleted_count = 0
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        successful = []
+        with self._lock:
+            for entry in Entries:
+                message_id = str(uuid.uuid4())
+                self._messages.append({
+                    'MessageId': message_id,
+                    'Body': entry['MessageBody'],
+                    'SentTimestamp': int(time.time() * 1000),
+                    'ReceiveCount': 0,
+                })
+                successful.append({'Id': entry['Id'], 'MessageId': message_id})
+            self.sent_count += len(successful)
+            self._available.notify_all()
+        return {'Successful': successful, 'Failed': []}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        deadline = time.monotonic() + WaitTimeSeconds
+        visibility_timeout = self.visibility_timeout if VisibilityTimeout is None else VisibilityTimeout
+        with self._lock:
+            self._requeue_expired()
+            # Long polling: wait for messages until WaitTimeSeconds
+            while not self._messages and time.monotonic() < deadline:
+                self._available.wait(deadline - time.monotonic())
+                self._requeue_expired()
+
+            received = []
+            for _ in range(min(MaxNumberOfMessages, MAX_RECEIVE_MESSAGES, len(self._messages))):
+                message = self._messages.popleft()
+                message['ReceiveCount'] += 1
+                receipt_handle = str(uuid.uuid4())
+                self._in_flight[receipt_handle] = message
+                self._deadlines.append((time.monotonic() + visibility_timeout, receipt_handle))
+                received.append({
+                    'MessageId': message['MessageId'],
+                    'ReceiptHandle': receipt_handle,
+                    'Body': message['Body'],
+                    'Attributes': {
+                        'SentTimestamp': str(message['SentTimestamp']),
+                        'ApproximateReceiveCount': str(message['ReceiveCount']),
+                    },
+                })
+        return {'Messages': received} if received else {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        successful = []
+        failed = []
+        with self._lock:
+            for entry in Entries:
+                if self._in_flight.pop(entry['ReceiptHandle'], None) is None:
+                    failed.append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True})
+                else:
+                    successful.append({'Id': entry['Id']})
+            self.deleted_count += len(successful)
+        return {'Successful': successful, 'Failed': failed}
+
+    def approximate_number_of_messages(self) -> int:
+        return len(self._messages)
+
+    def approximate_number_of_messages_not_visible(self) -> int:
+        return len(self._in_flight)
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {'sent': self.sent_count, 'deleted': self.deleted_count,
+                    'visible': len(self._messages), 'in_flight': len(self._in_flight)}
+
+    def _requeue_expired(self):
+        # Deadlines are ordered as long as receivers keep the same visibility timeout
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, receipt_handle = self._deadlines.popleft()
+            message = self._in_flight.pop(receipt_handle, None)
+            if message is not None:
+                self._messages.appendleft(message)
@@ -1,7 +1,13 @@
+import argparse
 import boto3
 import json
-import uuid
-from datetime import datetime
+import math
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from faker import Faker
 from shapely.geometry import Point
 from shapely.wkt import dumps as wkt_dumps
@@ -10,23 +16,36 @@ import threading
 import logging
 from queue import Queue
 
+# The compact wire format is defined next to its decoder, in the Lambda sources
+LAMBDA_SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app', 'src')
+if LAMBDA_SRC_DIR not in sys.path:
+    sys.path.insert(0, LAMBDA_SRC_DIR)
+
+import replay  # noqa: E402
+from fake_sqs import FakeSqsClient  # noqa: E402
+from iot_company.repository.model.compact_codec import encode_messages  # noqa: E402
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Replace 'your-queue-url' with the actual URL of your SQS queue
 queue_url = 'http://sqs.us-west-2.localhost.localstack.cloud:4566/000000000000/my-queue'
+endpoint_url = 'http://localhost:4566'
 
-# Define the total number of messages and number of threads
-TOTAL_MESSAGES = 10000
-NUM_THREADS = 4
+# Define the total number of trips, generator processes and sender threads
+TOTAL_TRIPS = 10000
+NUM_PROCESSES = os.cpu_count() or 4
+NUM_SENDERS = 8
+# SQS send_message_batch accepts at most 10 entries
 BATCH_SIZE = 10
+# Trips generated per task on a generator process
+GENERATION_CHUNK = 500
+# Trips packed in each compact message, bodies are also kept under the 256 KiB SQS limit
+TRIPS_PER_MESSAGE = 100
 
 fake = Faker()
 
-# Shared queue for coordinating messages
-message_queue = Queue()
-
 
 def generate_sample_payload():
     region = fake.city()
@@ -44,6 +63,12 @@ def generate_sample_payload():
     }
 
 
+def generate_sample_trip():
+    # Same trips as generate_sample_payload, as values for the compact format (no WKT)
+    return (fake.city(), random.uniform(-180, 180), random.uniform(-90, 90), random.uniform(-180, 180),
+            random.uniform(-90, 90), fake.date_time_this_decade(), fake.word())
+
+
 def generate_random_point():
     # Generate random coordinates within a specific bounding box
     min_longitude, max_longitude = -180, 180
@@ -57,62 +82,196 @@ def generate_random_point():
     return wkt_dumps(point)
 
 
-def send_messages_to_sqs(messages):
-    # Create an SQS client
-    sqs = boto3.client('sqs', region_name='us-west-2', endpoint_url='http://localhost:4566')
+def seed_generator_process():
+    # Forked processes inherit the parent random state, reseed so they don't all produce the same trips
+    seed = os.getpid() ^ time.time_ns()
+    random.seed(seed)
+    fake.seed_instance(seed)
 
-    # Convert messages to JSON
-    message_bodies = [json.dumps(payload) for payload in messages]
 
-    # Send messages in batches
-    sent_total_count = 0
-    for i in range(0, len(message_bodies), BATCH_SIZE):
-        batch = message_bodies[i:i + BATCH_SIZE]
-        entries = [{'Id': str(idx), 'MessageBody': body} for idx, body in enumerate(batch)]
+def generate_bodies(count, chunk_index=0):
+    """Runs on a generator process, returns count JSON message bodies ready to send."""
+    return [json.dumps(generate_sample_payload()) for _ in range(count)]
 
-        response = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
 
-        # Log every 100 messages sent to SQS
-        sent_count = 0
-        for success in response.get('Successful', []):
-            sent_count += 1
-            if sent_count == 10:
-                sent_total_count += sent_count
-                logger.info(f"Thread {threading.current_thread().name} sent {sent_total_count} messages to SQS")
-            # logger.info(f"Thread {threading.current_thread().name} sent MessageId: {success['MessageId']}")
-            # logger.info(f"Thread {threading.current_thread().name} sent {sent_count} messages to SQS")
-            # if sent_count % 100 == 0:
-                # logger.info(f"Thread {threading.current_thread().name} sent {sent_count} messages to SQS")
+def generate_compact_bodies(count, chunk_index=0, trips_per_message=TRIPS_PER_MESSAGE):
+    """Runs on a generator process, returns compact message bodies carrying count trips."""
+    return encode_messages([generate_sample_trip() for _ in range(count)], trips_per_message)
 
 
-def worker():
-    # Each thread generates and enqueues messages
-    for _ in range(TOTAL_MESSAGES // NUM_THREADS):
-        sample_payload = generate_sample_payload()
-        message_queue.put(sample_payload)
+class RateLimiter:
+    """Spaces sends evenly to reach a target number of trips per second, no limit when rate is falsy."""
 
-        # Log every 100 messages processed by each thread
-        if message_queue.qsize() % 100 == 0:
-            logger.info(f"Thread {threading.current_thread().name} processed {message_queue.qsize()} messages")
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
 
+    def wait(self, count):
+        if not self._interval:
+            return
+        self._next = max(self._next, time.monotonic() - 1.0) + count * self._interval
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
 
-def main():
-    # Create and start threads
-    threads = []
-    for i in range(NUM_THREADS):
-        thread = threading.Thread(target=worker, name=f"Thread-{i + 1}")
-        threads.append(thread)
+
+class SendStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.latencies = []
+
+    def record(self, latency, sent, failed):
+        with self._lock:
+            self.latencies.append(latency)
+            self.sent += sent
+            self.failed += failed
+
+    def percentile(self, percent):
+        # Nearest rank
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def sender(batch_queue, sqs, stats):
+    # Each sender thread sends batches until it gets the None sentinel
+    while True:
+        batch = batch_queue.get()
+        if batch is None:
+            return
+        entries = [{'Id': str(idx), 'MessageBody': body} for idx, body in enumerate(batch)]
+
+        started = time.perf_counter()
+        try:
+            response = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+            stats.record(time.perf_counter() - started, len(response.get('Successful', [])),
+                         len(response.get('Failed', [])))
+        except Exception as e:
+            logger.error(f"Thread {threading.current_thread().name} failed to send batch: {e}")
+            stats.record(time.perf_counter() - started, 0, len(batch))
+
+        if stats.sent and stats.sent % 1000 < BATCH_SIZE:
+            logger.info(f"Thread {threading.current_thread().name} sent {stats.sent} messages to SQS")
+
+
+def create_sqs_clients(args):
+    if args.fake_sqs:
+        # One in-process queue shared by every sender
+        return [FakeSqsClient(args.fake_latency_ms / 1000)] * args.senders
+    # One client (and HTTP connection pool) per sender thread
+    return [boto3.client('sqs', region_name='us-west-2', endpoint_url=args.endpoint_url) for _ in range(args.senders)]
+
+
+def run(args, generate=generate_bodies, sqs_clients=None, initializer=seed_generator_process, initargs=()):
+    """
+    Streams generation and sending: generator processes produce chunks of bodies while sender threads
+    push them to SQS, with a bounded queue in between so neither side runs ahead of the other.
+    """
+    sqs_clients = sqs_clients or create_sqs_clients(args)
+    stats = SendStats()
+    batch_queue = Queue(maxsize=args.senders * 4)
+    threads = [threading.Thread(target=sender, args=(batch_queue, sqs, stats), name=f"Sender-{i + 1}")
+               for i, sqs in enumerate(sqs_clients)]
+    for thread in threads:
         thread.start()
 
-    # Wait for all threads to finish
+    limiter = RateLimiter(args.rate)
+    started = time.monotonic()
+    deadline = started + args.duration if args.duration else None
+    remaining = args.total if args.total else float('inf')
+
+    with ProcessPoolExecutor(max_workers=args.processes, initializer=initializer, initargs=initargs) as executor:
+        pending = deque()
+        chunk_index = 0
+        while True:
+            # Keep a couple of chunks in flight per process, never the whole run
+            while remaining > 0 and len(pending) < args.processes * 2:
+                count = int(min(GENERATION_CHUNK, remaining))
+                pending.append((count, executor.submit(generate, count, chunk_index)))
+                remaining -= count
+                chunk_index += 1
+            if not pending:
+                break
+
+            count, future = pending.popleft()
+            bodies = future.result()
+            # One per JSON message, a compact message carries many
+            trips_per_body = count / len(bodies) if bodies else 0
+            for i in range(0, len(bodies), BATCH_SIZE):
+                if deadline and time.monotonic() >= deadline:
+                    break
+                batch = bodies[i:i + BATCH_SIZE]
+                limiter.wait(len(batch) * trips_per_body)
+                batch_queue.put(batch)
+
+            if deadline and time.monotonic() >= deadline:
+                for _, future in pending:
+                    future.cancel()
+                break
+
+    for _ in threads:
+        batch_queue.put(None)
     for thread in threads:
         thread.join()
 
-    # Accumulate messages from the queue
-    messages_to_send = [message_queue.get() for _ in range(message_queue.qsize())]
+    return report(stats, time.monotonic() - started)
 
-    # Send messages
-    send_messages_to_sqs(messages_to_send)
+
+def report(stats, elapsed):
+    result = {
+        'sent': stats.sent,
+        'failed': stats.failed,
+        'elapsed_seconds': round(elapsed, 3),
+        'messages_per_second': round(stats.sent / elapsed, 1) if elapsed else 0.0,
+        'send_latency_ms': {
+            'p50': round(stats.percentile(50) * 1000, 3),
+            'p95': round(stats.percentile(95) * 1000, 3),
+            'p99': round(stats.percentile(99) * 1000, 3),
+        },
+    }
+    logger.info(f"Load generation finished: {json.dumps(result)}")
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generates IoT trips and sends them to SQS")
+    parser.add_argument('--total', type=int, default=TOTAL_TRIPS,
+                        help='Trips to send, 0 for no limit (then use --duration)')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+    parser.add_argument('--rate', type=float, default=None, help='Target trips per second, unlimited by default')
+    parser.add_argument('--processes', type=int, default=NUM_PROCESSES, help='Generator processes')
+    parser.add_argument('--senders', type=int, default=NUM_SENDERS, help='Sender threads, one SQS client each')
+    parser.add_argument('--endpoint-url', default=endpoint_url, help='SQS endpoint (localstack, moto server, ...)')
+    parser.add_argument('--fake-sqs', action='store_true', help='Send to an in-process fake queue instead of SQS')
+    parser.add_argument('--fake-latency-ms', type=float, default=0.0, help='Simulated latency of the fake queue')
+    parser.add_argument('--format', choices=('json', 'compact'), default='json',
+                        help='json: one trip per message, compact: binary trips packed in each message')
+    parser.add_argument('--trips-per-message', type=int, default=TRIPS_PER_MESSAGE,
+                        help='Trips per compact message, capped by the SQS message size')
+    parser.add_argument('--mode', choices=('random', 'replay'), default='random',
+                        help='random trips around the globe, or replay the distributions learned from --csv')
+    replay.add_model_arguments(parser)
+    args = parser.parse_args(argv)
+    if not args.total and not args.duration:
+        parser.error('--total 0 needs --duration')
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.mode == 'replay':
+        generate = replay.generate_bodies
+        if args.format == 'compact':
+            generate = partial(replay.generate_compact_bodies, trips_per_message=args.trips_per_message)
+        # The model is learned once here and handed to every generator process
+        run(args, generate, initializer=replay.init_replay_process, initargs=(replay.build_model(args), args.seed))
+    elif args.format == 'compact':
+        run(args, partial(generate_compact_bodies, trips_per_message=args.trips_per_message))
+    else:
+        run(args)
 
     logger.info("All threads have finished processing messages")
 
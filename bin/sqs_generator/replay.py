@@ -0,0 +1,253 @@
+import argparse
+import bisect
+import csv
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+# trips.csv sample at the root of the repo
+DEFAULT_CSV = os.path.join(REPO_DIR, 'trips.csv')
+# The compact wire format is defined next to its decoder, in the Lambda sources
+LAMBDA_SRC_DIR = os.path.join(REPO_DIR, 'app', 'src')
+if LAMBDA_SRC_DIR not in sys.path:
+    sys.path.insert(0, LAMBDA_SRC_DIR)
+
+from iot_company.repository.model.compact_codec import encode_messages
+CSV_COLUMNS = ('region', 'origin_coord', 'destination_coord', 'datetime', 'datasource')
+METERS_PER_DEGREE = 111320
+
+# Hot spot defaults, see the README for what each one controls
+HOTSPOTS_PER_REGION = 8
+HOTSPOT_SHARE = 0.8
+HOTSPOT_SKEW = 1.2
+HOTSPOT_RADIUS_M = 400
+
+
+def parse_point(value: str):
+    # 'POINT (lon lat)' as found on trips.csv
+    lon, lat = value.strip()[len('POINT'):].strip(' ()').split()
+    return float(lon), float(lat)
+
+
+def format_point(lon: float, lat: float) -> str:
+    return f"POINT ({lon!r} {lat!r})"
+
+
+class WeightedChoice:
+    """Picks values proportionally to their weights with a bisect over the cumulative weights."""
+
+    def __init__(self, values, weights):
+        self.values = list(values)
+        self.cumulative = list(itertools.accumulate(weights))
+
+    def pick(self, rng: random.Random):
+        return self.values[bisect.bisect_right(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+class RegionModel:
+    """What was learned of one region: trip share, bounding box, hours, datasources and hot spots."""
+
+    def __init__(self, name, trips, bbox, hours, datasources, origin_hotspots, destination_hotspots):
+        self.name = name
+        self.trips = trips
+        # (min_lon, min_lat, max_lon, max_lat) of every origin and destination seen
+        self.bbox = bbox
+        self.hours = hours
+        self.datasources = datasources
+        self.origin_hotspots = origin_hotspots
+        self.destination_hotspots = destination_hotspots
+
+
+class TripModel:
+    """
+    Distributions learned from a CSV in the trips.csv schema, used to synthesize trips with the spatial and
+    temporal locality of the sample instead of uniformly random points around the globe.
+    The model is built once (hot spots included) and shipped to the generator processes, each chunk of trips
+    is drawn from its own seeded random so a seed reproduces the same trips whatever the process scheduling.
+    """
+
+    def __init__(self, regions, first_day, days, hotspot_share=HOTSPOT_SHARE, hotspot_radius_m=HOTSPOT_RADIUS_M):
+        self.regions = WeightedChoice(regions, [region.trips for region in regions])
+        self.first_day = first_day
+        self.days = days
+        self.hotspot_share = hotspot_share
+        self.hotspot_radius_m = hotspot_radius_m
+
+    @classmethod
+    def from_csv(cls, path, seed=None, hotspots=HOTSPOTS_PER_REGION, hotspot_share=HOTSPOT_SHARE,
+                 hotspot_skew=HOTSPOT_SKEW, hotspot_radius_m=HOTSPOT_RADIUS_M, start_date=None, end_date=None):
+        rng = random.Random(seed)
+        origins = defaultdict(list)
+        destinations = defaultdict(list)
+        hours = defaultdict(Counter)
+        datasources = defaultdict(Counter)
+        first, last = None, None
+
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                region = row['region']
+                origins[region].append(parse_point(row['origin_coord']))
+                destinations[region].append(parse_point(row['destination_coord']))
+                trip_datetime = datetime.fromisoformat(row['datetime'])
+                hours[region][trip_datetime.hour] += 1
+                datasources[region][row['datasource']] += 1
+                first = min(first, trip_datetime) if first else trip_datetime
+                last = max(last, trip_datetime) if last else trip_datetime
+
+        if not origins:
+            raise ValueError(f"No trips found on {path}")
+
+        regions = []
+        # Sorted so the same CSV and seed always give the same hot spots
+        for name in sorted(origins):
+            points = origins[name] + destinations[name]
+            bbox = (min(p[0] for p in points), min(p[1] for p in points),
+                    max(p[0] for p in points), max(p[1] for p in points))
+            regions.append(RegionModel(
+                name=name,
+                trips=len(origins[name]),
+                bbox=bbox,
+                hours=WeightedChoice(*zip(*sorted(hours[name].items()))),
+                datasources=WeightedChoice(*zip(*sorted(datasources[name].items()))),
+                origin_hotspots=_hotspots(rng, origins[name], hotspots, hotspot_skew),
+                destination_hotspots=_hotspots(rng, destinations[name], hotspots, hotspot_skew),
+            ))
+
+        first_day = start_date or first.date()
+        last_day = end_date or last.date()
+        days = (last_day - first_day).days + 1
+        if days <= 0:
+            raise ValueError("end date is before start date")
+        return cls(regions, first_day, days, hotspot_share, hotspot_radius_m)
+
+    def trip(self, rng: random.Random) -> dict:
+        region, origin_lon, origin_lat, destination_lon, destination_lat, trip_datetime, datasource = \
+            self.trip_values(rng)
+        return {
+            "region": region,
+            "origin_coord": format_point(origin_lon, origin_lat),
+            "destination_coord": format_point(destination_lon, destination_lat),
+            "datetime": trip_datetime.isoformat(),
+            "datasource": datasource,
+        }
+
+    def trip_values(self, rng: random.Random) -> tuple:
+        """(region, origin lon, origin lat, destination lon, destination lat, datetime, datasource) of a trip."""
+        region = self.regions.pick(rng)
+        day = self.first_day + timedelta(days=rng.randrange(self.days))
+        trip_datetime = datetime(day.year, day.month, day.day, region.hours.pick(rng),
+                                 rng.randrange(60), rng.randrange(60))
+        return (region.name, *self._point(rng, region, region.origin_hotspots),
+                *self._point(rng, region, region.destination_hotspots), trip_datetime, region.datasources.pick(rng))
+
+    def trips(self, count: int, seed, chunk_index: int = 0, values: bool = False):
+        # Each chunk has its own random, derived from the seed and its position
+        rng = random.Random(f"{seed}:{chunk_index}")
+        trip = self.trip_values if values else self.trip
+        return [trip(rng) for _ in range(count)]
+
+    def _point(self, rng: random.Random, region: RegionModel, hotspots) -> tuple:
+        min_lon, min_lat, max_lon, max_lat = region.bbox
+        if hotspots and rng.random() < self.hotspot_share:
+            # Normally distributed around a hot spot, clamped to the region
+            center_lon, center_lat = hotspots.pick(rng)
+            lat = center_lat + rng.gauss(0, self.hotspot_radius_m / METERS_PER_DEGREE)
+            lon = center_lon + rng.gauss(0, self.hotspot_radius_m / (METERS_PER_DEGREE *
+                                                                     math.cos(math.radians(center_lat))))
+            lon = min(max(lon, min_lon), max_lon)
+            lat = min(max(lat, min_lat), max_lat)
+        else:
+            lon = rng.uniform(min_lon, max_lon)
+            lat = rng.uniform(min_lat, max_lat)
+        return lon, lat
+
+
+def _hotspots(rng: random.Random, points, count: int, skew: float):
+    # Hot spots are seen points, the i-th one weighs 1 / (i + 1) ** skew (Zipf like, 0 means even)
+    if not count or not points:
+        return None
+    centers = rng.sample(points, min(count, len(points)))
+    return WeightedChoice(centers, [1 / (rank + 1) ** skew for rank in range(len(centers))])
+
+
+# Set on every generator process by init_replay_process
+trip_model = None
+replay_seed = None
+
+
+def init_replay_process(model: TripModel, seed):
+    global trip_model, replay_seed
+    trip_model = model
+    replay_seed = seed
+
+
+def generate_bodies(count, chunk_index=0):
+    """Runs on a generator process, returns count JSON message bodies ready to send."""
+    return [json.dumps(trip) for trip in trip_model.trips(count, replay_seed, chunk_index)]
+
+
+def generate_compact_bodies(count, chunk_index=0, trips_per_message=100):
+    """Runs on a generator process, returns compact bodies carrying count trips."""
+    return encode_messages(trip_model.trips(count, replay_seed, chunk_index, values=True), trips_per_message)
+
+
+def add_model_arguments(parser):
+    parser.add_argument('--csv', default=DEFAULT_CSV, help='CSV in the trips.csv schema to learn from')
+    parser.add_argument('--seed', type=int, default=None, help='Seed to reproduce the same trips')
+    parser.add_argument('--hotspots', type=int, default=HOTSPOTS_PER_REGION,
+                        help='Hot spots per region for origins and destinations, 0 for none')
+    parser.add_argument('--hotspot-share', type=float, default=HOTSPOT_SHARE,
+                        help='Share of points drawn around a hot spot, the rest is uniform over the region')
+    parser.add_argument('--hotspot-skew', type=float, default=HOTSPOT_SKEW,
+                        help='Zipf exponent of the hot spot popularity, 0 makes them even')
+    parser.add_argument('--hotspot-radius-m', type=float, default=HOTSPOT_RADIUS_M,
+                        help='Standard deviation in meters of the points around a hot spot')
+    parser.add_argument('--start-date', type=lambda value: datetime.fromisoformat(value).date(), default=None,
+                        help='First day of the trips, the first day of the CSV by default')
+    parser.add_argument('--end-date', type=lambda value: datetime.fromisoformat(value).date(), default=None,
+                        help='Last day of the trips, the last day of the CSV by default')
+
+
+def build_model(args) -> TripModel:
+    if args.seed is None:
+        # Logged so a run can be reproduced afterwards
+        args.seed = random.randrange(2 ** 32)
+    logger.info(f"Replaying {args.csv} with seed {args.seed}")
+    return TripModel.from_csv(args.csv, seed=args.seed, hotspots=args.hotspots,
+                              hotspot_share=args.hotspot_share, hotspot_skew=args.hotspot_skew,
+                              hotspot_radius_m=args.hotspot_radius_m,
+                              start_date=args.start_date, end_date=args.end_date)
+
+
+def write_csv(model: TripModel, path: str, total: int, seed, chunk_size: int = 10000):
+    """Synthesize total trips into a CSV in the trips.csv schema, for loading without SQS."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for chunk_index, start in enumerate(range(0, total, chunk_size)):
+            writer.writerows(model.trips(min(chunk_size, total - start), seed, chunk_index))
+    logger.info(f"Wrote {total} trips to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthesizes trips learned from trips.csv into a CSV file")
+    add_model_arguments(parser)
+    parser.add_argument('--total', type=int, default=1000000, help='Trips to write')
+    parser.add_argument('--output', required=True, help='CSV file to write')
+    args = parser.parse_args()
+    write_csv(build_model(args), args.output, args.total, args.seed)
+
+
+if __name__ == "__main__":
+    main()
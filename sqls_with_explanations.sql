@@ -63,6 +63,29 @@ ORDER BY
 
 
 
+-- Same question answered from the precomputed clusters (see iot_trip_cluster on bin/init.sql)
+--- Every insert on public.iot adds its trips to one bucket per region, hour of day, origin cell and destination cell,
+--- for every cell size on iot_cluster_grid, so the grouping is a read of idx_trip_cluster_count instead of a self join.
+--- Cell centers are returned as coordinates, a cell of 1000 meters groups trips starting and ending in the same ~1km squares.
+SELECT
+    cluster.region,
+    cluster.hour_of_day,
+    (cluster.origin_cell_x + 0.5) * (cluster.cell_size_m / 111320.0) AS origin_longitude,
+    (cluster.origin_cell_y + 0.5) * (cluster.cell_size_m / 111320.0) AS origin_latitude,
+    (cluster.destination_cell_x + 0.5) * (cluster.cell_size_m / 111320.0) AS destination_longitude,
+    (cluster.destination_cell_y + 0.5) * (cluster.cell_size_m / 111320.0) AS destination_latitude,
+    cluster.trip_count
+FROM
+    public.iot_trip_cluster cluster
+WHERE
+    cluster.cell_size_m = 1000
+    AND cluster.trip_count > 1
+ORDER BY
+    cluster.trip_count DESC
+LIMIT 10;
+
+
+
 -- Develop a way to obtain the weekly average number of trips for an area, defined by a
 -- bounding box (given by coordinates) or by a region.
 -- The area_filter common table expression (CTE) defines the bounding box using the ST_MakeEnvelope function.
@@ -154,4 +177,30 @@ SELECT  region, count(*) as region_count
 FROM public.iot
 WHERE datasource = 'cheap_mobile'
 GROUP BY region
-ORDER BY region_count desc;
\ No newline at end of file
+ORDER BY region_count desc;
+
+
+
+-- Same two questions answered from the leaderboards (see iot_region_stats on bin/init.sql), served by /top_regions and /datasource_regions
+--- The insert trigger keeps the trip count, latest datetime and latest datasource of every region and the trips per datasource and region,
+--- so both questions read a few rows by index instead of scanning and sorting public.iot.
+SELECT
+    stats.region,
+    stats.latest_datasource,
+    stats.latest_datetime,
+    stats.trip_count
+FROM
+    public.iot_region_stats stats
+ORDER BY
+    stats.trip_count DESC
+LIMIT 2;
+
+SELECT
+    datasource_region.region,
+    datasource_region.trip_count
+FROM
+    public.iot_datasource_region datasource_region
+WHERE
+    datasource_region.datasource = 'cheap_mobile'
+ORDER BY
+    datasource_region.trip_count DESC;